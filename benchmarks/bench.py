@@ -0,0 +1,1078 @@
+import argparse
+import gc
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ericchat.util import (ChatMessage, ConvoJournal, ConvoSearchIndex,
+                           ConvoTree, ThinkingTrace)
+
+
+def _fake_text(rnd: random.Random, vocab, n_words: int) -> str:
+    return " ".join(rnd.choice(vocab) for _ in range(n_words))
+
+
+def bench_search(n_convos: int = 10_000, messages_per_convo: int = 6, words_per_message: int = 40,
+                 vocab_size: int = 20_000, n_queries: int = 200, seed: int = 0) -> Dict[str, float]:
+    rnd = random.Random(seed)
+    vocab = [f"{rnd.choice('abcdefghijklmnopqrstuvwxyz')}{rnd.choice('aeiou')}{i:x}" for i in range(vocab_size)]
+
+    # generated up front, it would otherwise take about half of the timed indexing
+    texts = [_fake_text(rnd, vocab, words_per_message) for _ in range(n_convos * messages_per_convo)]
+    n_words = len(texts) * words_per_message
+
+    index = ConvoSearchIndex()
+    start = time.perf_counter()
+    for i, text in enumerate(texts):
+        index.add(i // messages_per_convo, i % messages_per_convo, text)
+    index_seconds = time.perf_counter() - start
+
+    # mix of full words, multi word queries and short prefixes
+    queries = []
+    for i in range(n_queries):
+        word = rnd.choice(vocab)
+        if i % 3 == 0:
+            queries.append(word[:3])
+        elif i % 3 == 1:
+            queries.append(f"{word} {rnd.choice(vocab)[:4]}")
+        else:
+            queries.append(word)
+
+    # don't bill the collection of indexing garbage to the first unlucky query
+    gc.collect()
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    return {
+        "messages": len(index),
+        "index_seconds": index_seconds,
+        "messages_per_second": len(index) / index_seconds,
+        "words_per_second": n_words / index_seconds,
+        "query_p50_ms": latencies[len(latencies) // 2],
+        "query_p95_ms": latencies[int(len(latencies) * 0.95)],
+        "query_max_ms": latencies[-1],
+    }
+
+
+def bench_journal(n_convos: int = 50, turns_per_convo: int = 4, tokens_per_answer: int = 2000,
+                  thinking_per_answer: int = 2000, flush_interval: float = 0.05, seed: int = 0) -> Dict[str, float]:
+    # Streams thinking and answers token by token through the journal the way stream_step does and
+    # reports how many bytes reached the disk for every byte of text. Tokens come much faster than the
+    # journal flushes here, so most partial records are dropped when their answer is committed. At
+    # reading speed they reach the disk first and every answer is written twice, about 2x.
+    rnd = random.Random(seed)
+    words = ["the", "model", "token", "stream", "memory", "answer", "thinking", "cache", "journal", "disk"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ConvoJournal(Path(tmp) / "journal.jsonl", flush_interval=flush_interval)
+        journal.start()
+
+        start = time.perf_counter()
+        for convo_id in range(n_convos):
+            journal.record_new(convo_id)
+            for turn in range(turns_per_convo):
+                journal.record_message(convo_id, turn * 2, ChatMessage(text="question " * 8, role="user"))
+                thinking = ThinkingTrace()
+                for _ in range(thinking_per_answer):
+                    token = " " + rnd.choice(words)
+                    thinking.append(token)
+                    journal.record_partial(convo_id, thinking=token)
+                answer = []
+                for _ in range(tokens_per_answer):
+                    token = " " + rnd.choice(words)
+                    answer.append(token)
+                    journal.record_partial(convo_id, text=token)
+                journal.record_message(convo_id, turn * 2 + 1, ChatMessage(text="".join(answer), role="assistant",
+                                                                           marker="text", thinking=thinking))
+        submit_seconds = time.perf_counter() - start
+        journal.close()
+
+        result = journal.stats()
+        replayed = journal.replay()
+
+    tokens = n_convos * turns_per_convo * (tokens_per_answer + thinking_per_answer)
+    result["submit_seconds"] = submit_seconds
+    result["submit_us_per_token"] = submit_seconds * 1e6 / tokens
+    result["replayed_convos"] = len(replayed)
+    return result
+
+
+def bench_cancel(prompt_words: int = 40_000, prefill_tps: float = 2000.0, prefill_step_size: int = 512,
+                 cancel_after: float = 0.5, runs: int = 5) -> Dict[str, float]:
+    # Cancel-to-idle latency while a slow prefill is running on the fake backend.
+    # Without chunking the whole prompt (~20s here) would have to finish first.
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend, InferenceCancelled
+
+    backend = FakeChatBackend(prefill_tps=prefill_tps)
+    messages = [{"role": "user", "content": "word " * prompt_words}]
+    latencies = []
+
+    for _ in range(runs):
+        done = threading.Event()
+
+        def _consume():
+            try:
+                for _ in backend.stream(messages, CHATCallArgs(max_len=64), prefill_step_size=prefill_step_size):
+                    pass
+            except InferenceCancelled:
+                pass
+            finally:
+                done.set()
+
+        threading.Thread(target=_consume, daemon=True).start()
+        time.sleep(cancel_after)
+        start = time.monotonic()
+        backend.cancel()
+        done.wait()
+        latencies.append((time.monotonic() - start) * 1000)
+
+    latencies.sort()
+    return {
+        "prompt_tokens": backend.prompt_tokens(messages),
+        "full_prefill_seconds": backend.prompt_tokens(messages) / prefill_tps,
+        "chunk_ms": prefill_step_size * 1000 / prefill_tps,
+        "cancel_p50_ms": latencies[len(latencies) // 2],
+        "cancel_max_ms": latencies[-1],
+    }
+
+
+def bench_speculative(n_tokens: int = 4000, verify_ms: float = 50.0, draft_ms: float = 5.0,
+                      seed: int = 0) -> Dict[str, float]:
+    # Adaptive K against fixed K on fake draft/target models in simulated time. The draft agrees
+    # 95% of the time for the first half (boilerplate) and 40% for the second half.
+    from ericchat.util import (DraftController, FakeDraftModel,
+                               FakeTargetModel, SimClock, speculative_generate)
+
+    def _agreement(position: int) -> float:
+        return 0.95 if position < n_tokens // 2 else 0.4
+
+    def _run(controller: DraftController) -> Tuple[float, DraftController]:
+        clock = SimClock()
+        target = FakeTargetModel(clock, verify_seconds=verify_ms / 1000)
+        draft = FakeDraftModel(target, clock, agreement=_agreement, step_seconds=draft_ms / 1000, seed=seed)
+        tokens = [token for token, _ in speculative_generate(target, draft, [0], n_tokens, controller, clock=clock)]
+        assert tokens == [target.token_at(i) for i in range(n_tokens)]
+        return n_tokens / clock.now, controller
+
+    result = {"plain_tps": 1000 / verify_ms}
+    for k in (2, 4, 8):
+        tps, _ = _run(DraftController(k=k, min_k=k, max_k=k, probe_interval=1))
+        result[f"fixed_k{k}_tps"] = tps
+    tps, controller = _run(DraftController())
+    result["adaptive_tps"] = tps
+    result["adaptive_acceptance"] = controller.acceptance_rate
+    result["adaptive_rounds"] = controller.rounds
+    return result
+
+
+def bench_watchdog(n_tokens: int = 200_000, loop_period: int = 60, segment: int = 16, seed: int = 0) -> Dict[str, float]:
+    # Per-token cost of the repetition watchdog fed the way _do_inference does, a segment of pieces at
+    # a time, and fed piece by piece. Both next to the cost of stream_step, false positives on text
+    # that doesn't loop, and how many tokens into a loop it takes to catch it.
+    from erictransformer import CHATStreamResult
+
+    from ericchat.eric_state import EricUIState
+    from ericchat.util import RepetitionWatchdog
+
+    rnd = random.Random(seed)
+    vocab = [f"w{i}" for i in range(5000)] + [" the", " a", ",", ".", "\n", "|", " of"]
+    pieces = [rnd.choice(vocab) for _ in range(n_tokens)]
+
+    watchdog = RepetitionWatchdog()
+    false_positives = 0
+    start = time.perf_counter()
+    # including the buffering of the pieces
+    buffer = []
+    for text in pieces:
+        if len(buffer) >= segment:
+            if watchdog.feed_segment(buffer, "thinking") is not None:
+                false_positives += 1
+            buffer = []
+        buffer.append(text)
+    watchdog_ns = (time.perf_counter() - start) * 1e9 / n_tokens
+
+    watchdog.reset()
+    start = time.perf_counter()
+    for text in pieces:
+        watchdog.feed(text, "thinking")
+    per_piece_ns = (time.perf_counter() - start) * 1e9 / n_tokens
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = EricUIState(Path(tmp), backend="fake")
+        steps = [CHATStreamResult(text=text, marker="text", payload={}) for text in pieces[:20_000]]
+        start = time.perf_counter()
+        for step in steps:
+            state.stream_step(step)
+        stream_step_ns = (time.perf_counter() - start) * 1e9 / len(steps)
+
+    # a paragraph the model keeps repeating after some ordinary text
+    watchdog.reset()
+    paragraph = [rnd.choice(vocab) for _ in range(loop_period)]
+    looping = [rnd.choice(vocab) for _ in range(500)] + paragraph * 50
+    caught_at = None
+    for i in range(0, len(looping), segment):
+        if watchdog.feed_segment(looping[i:i + segment], "thinking") is not None:
+            caught_at = i + segment - 500
+            break
+
+    return {
+        "watchdog_ns_per_token": watchdog_ns,
+        "watchdog_ns_per_token_fed_one_by_one": per_piece_ns,
+        "stream_step_ns_per_token": stream_step_ns,
+        "watchdog_pct_of_stream_step": watchdog_ns * 100 / stream_step_ns,
+        "false_positives": false_positives,
+        "loop_period": loop_period,
+        # counted to the end of the segment the loop was caught in
+        "tokens_into_loop_when_caught": caught_at if caught_at is not None else -1,
+    }
+
+
+def bench_replay(thinking_words: int = 20_000, answer_words: int = 2000) -> Dict[str, float]:
+    # Records a thinking-heavy fake generation and replays it as fast as possible.
+    # Real traces are replayed with `python -m ericchat replay TRACE`.
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend
+    from ericchat.replay import replay_trace
+    from ericchat.util import StreamRecorder
+
+    backend = FakeChatBackend(prefill_tps=0, decode_tps=0,
+                              thinking=" ".join(f"step{i % 97}" for i in range(thinking_words)),
+                              answer=" ".join(f"word{i % 89}" for i in range(answer_words)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "fake.jsonl"
+        with StreamRecorder(path, backend="fake") as recorder:
+            for piece in backend.stream([{"role": "user", "content": "hi"}], CHATCallArgs(max_len=thinking_words + answer_words + 2)):
+                recorder.record(piece)
+        result = replay_trace(path)
+        result["trace_bytes"] = path.stat().st_size
+    return result
+
+
+def bench_tracing(n_spans: int = 200_000, lag_seconds: float = 1.0) -> Dict[str, float]:
+    # Cost of a span with the tracer off and on, and what the loop lag monitor sees when an
+    # asyncio loop is blocked by 30 ms handlers.
+    import asyncio
+    import json
+
+    from ericchat.util import LoopLagMonitor, SamplingProfiler, Tracer
+
+    result = {}
+    for enabled in (False, True):
+        tracer = Tracer(enabled=enabled)
+        start = time.perf_counter()
+        for _ in range(n_spans):
+            with tracer.span("step"):
+                pass
+        result[f"span_ns_{'on' if enabled else 'off'}"] = (time.perf_counter() - start) * 1e9 / n_spans
+
+    tracer = Tracer(enabled=True)
+    loop = asyncio.new_event_loop()
+    monitor = LoopLagMonitor(loop, tracer, interval=0.01)
+    profiler = SamplingProfiler(tracer, thread_id=threading.get_ident())
+
+    def _block():
+        with tracer.span("slow handler"):
+            time.sleep(0.03)
+        loop.call_later(0.05, _block)
+
+    monitor.start()
+    profiler.start()
+    loop.call_soon(_block)
+    loop.run_until_complete(asyncio.sleep(lag_seconds))
+    profiler.stop()
+    monitor.stop()
+    loop.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "trace.json"
+        tracer.dump(path)
+        data = json.loads(path.read_text())
+        result["trace_events"] = len(data["traceEvents"])
+        result["trace_samples"] = len(data.get("samples", []))
+
+    result.update(monitor.stats())
+    return result
+
+
+def bench_branching(n_turns: int = 500, n_branches: int = 2000, words_per_message: int = 200, seed: int = 0) -> Dict[str, float]:
+    # A long convo edited and regenerated at random points. Branches share their prefix, so
+    # memory follows the unique messages while a copy per branch would grow with every fork.
+    import tracemalloc
+
+    rnd = random.Random(seed)
+    vocab = [f"w{i}" for i in range(5000)]
+
+    tracemalloc.start()
+    tree = ConvoTree()
+    for turn in range(n_turns):
+        tree.append(ChatMessage(text=_fake_text(rnd, vocab, words_per_message), role="user"))
+        tree.append(ChatMessage(text=_fake_text(rnd, vocab, words_per_message), role="assistant", marker="text"))
+
+    fork_seconds = 0.0
+    copied_messages = 0
+    for _ in range(n_branches):
+        # edits and regenerations mostly land near the end of the convo
+        index = len(tree) - 1 - rnd.randrange(min(len(tree), 8))
+        start = time.perf_counter()
+        tree.fork(index)
+        fork_seconds += time.perf_counter() - start
+        while len(tree) < n_turns * 2:
+            tree.append(ChatMessage(text=_fake_text(rnd, vocab, words_per_message), role="assistant", marker="text"))
+        # what a branch would have cost if every fork copied the convo
+        copied_messages += len(tree)
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+
+    switch_seconds = 0.0
+    n_switches = 0
+    for _ in range(n_branches):
+        index = rnd.randrange(len(tree))
+        start = time.perf_counter()
+        tree.switch_sibling(index, rnd.choice((-1, 1)))
+        switch_seconds += time.perf_counter() - start
+        n_switches += 1
+
+    return {
+        "nodes": len(tree.nodes),
+        "copy_per_branch_messages": copied_messages,
+        "memory_mb": memory_mb,
+        "fork_us": fork_seconds * 1e6 / n_branches,
+        "switch_us": switch_seconds * 1e6 / n_switches,
+    }
+
+
+def bench_cache(n_requests: int = 200, n_distinct: int = 40, answer_words: int = 300, decode_tps: float = 2000.0,
+                max_kb: int = 256, seed: int = 0) -> Dict[str, float]:
+    # Templated prompts asked again and again at the lowest creativity, through a cache too small for
+    # all of them. Misses stream from the fake model, hits replay through EricUIState.stream_step.
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend
+    from ericchat.eric_state import EricUIState
+    from ericchat.util import GenerationCache
+
+    rnd = random.Random(seed)
+    backend = FakeChatBackend(prefill_tps=0, decode_tps=decode_tps, thinking="",
+                              answer=" ".join(f"word{i % 89}" for i in range(answer_words)))
+    args = CHATCallArgs(max_len=answer_words + 2, top_k=0, temp=0.7, top_p=0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = EricUIState(Path(tmp) / "models", backend="fake")
+        cache = GenerationCache(Path(tmp) / "cache", max_bytes=max_kb * 1024)
+        hit_seconds, miss_seconds = [], []
+        for _ in range(n_requests):
+            # a few questions are asked much more often than the rest
+            question = int(n_distinct * rnd.random() ** 2)
+            messages = [{"role": "user", "content": f"Template question {question}"}]
+            key = cache.key("fake:fake@bench", messages, args)
+
+            start = time.perf_counter()
+            path = cache.lookup(key)
+            if path is not None:
+                stream = cache.replay(path)
+                recorder = None
+            else:
+                stream = backend.stream(messages, args)
+                recorder = cache.recorder(key)
+            for piece in stream:
+                state.stream_step(piece)
+                if recorder is not None:
+                    recorder.record(piece)
+            state.finish_chat()
+            if recorder is not None:
+                cache.commit(key, recorder)
+            (hit_seconds if path is not None else miss_seconds).append(time.perf_counter() - start)
+
+        result = cache.stats()
+
+    result["hit_ms"] = sum(hit_seconds) * 1000 / len(hit_seconds) if hit_seconds else 0.0
+    result["miss_ms"] = sum(miss_seconds) * 1000 / len(miss_seconds) if miss_seconds else 0.0
+    return result
+
+
+def bench_tasks(rounds: int = 30, decode_tps: float = 400.0, load_seconds: float = 0.05,
+                download_chunks: int = 1000, chunk_ms: float = 2.0, seed: int = 0) -> Dict[str, float]:
+    # The app's task setup without the GUI: a stream is started, then a model load is submitted at a
+    # random point of it, the way the Model button can be pressed mid answer. Every load must wait for
+    # the stream to stop and no stream may ever see its model replaced, "overlaps" has to stay 0.
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend, InferenceCancelled
+    from ericchat.util import TaskManager
+    from ericchat.util.tasks import CANCELLED, DOWNLOAD, FINISHED, GENERATE, LOAD
+
+    rnd = random.Random(seed)
+    events = []
+    manager = TaskManager(on_event=events.append)
+    holder = {"model": FakeChatBackend(decode_tps=decode_tps, answer="word " * 2000)}
+    spans = {GENERATE: [], LOAD: []}
+    lock = threading.Lock()
+    swapped = 0
+
+    def generate(task):
+        nonlocal swapped
+        model = holder["model"]
+        task.token.on_cancel(model.cancel)
+        start = time.perf_counter()
+        try:
+            for _ in model.stream([{"role": "user", "content": "hi"}], CHATCallArgs(max_len=4000)):
+                task.token.raise_if_cancelled()
+        except InferenceCancelled:
+            pass
+        finally:
+            with lock:
+                spans[GENERATE].append((start, time.perf_counter()))
+                swapped += holder["model"] is not model
+
+    def load(task):
+        start = time.perf_counter()
+        time.sleep(load_seconds)
+        holder["model"] = FakeChatBackend(decode_tps=decode_tps, answer="word " * 2000)
+        with lock:
+            spans[LOAD].append((start, time.perf_counter()))
+
+    supersede_ms = []
+    for _ in range(rounds):
+        stream = manager.submit(GENERATE, generate)
+        time.sleep(rnd.uniform(0, 0.1))
+        start = time.perf_counter()
+        loading = manager.submit(LOAD, load)
+        stream.wait()
+        supersede_ms.append((time.perf_counter() - start) * 1000)
+        loading.wait()
+
+    def download(task):
+        for i in range(download_chunks):
+            task.token.raise_if_cancelled()
+            time.sleep(chunk_ms / 1000)
+            task.report((i + 1) / download_chunks, "Downloading")
+
+    downloading = manager.submit(DOWNLOAD, download)
+    time.sleep(chunk_ms * download_chunks / 4000)
+    start = time.perf_counter()
+    downloading.cancel()
+    downloading.wait()
+    download_cancel_ms = (time.perf_counter() - start) * 1000
+    manager.shutdown(wait=True)
+
+    overlaps = sum(1 for g0, g1 in spans[GENERATE] for l0, l1 in spans[LOAD] if g0 < l1 and l0 < g1)
+    finished = {e.task_id: e.state for e in events if e.state in FINISHED}
+    if overlaps or swapped:
+        raise AssertionError(f"{overlaps} loads ran during a stream, {swapped} streams saw their model replaced")
+    supersede_ms.sort()
+    return {
+        "rounds": rounds,
+        "overlaps": overlaps,
+        "swapped_models": swapped,
+        "streams_cancelled": sum(1 for state in finished.values() if state == CANCELLED) - 1,
+        "supersede_p50_ms": supersede_ms[len(supersede_ms) // 2],
+        "supersede_max_ms": supersede_ms[-1],
+        "download_state": downloading.state,
+        "download_cancel_ms": download_cancel_ms,
+        "events": len(events),
+    }
+
+
+def bench_retrieval(n_files: int = 1000, chunks_per_file: int = 110, chunk_chars: int = 600, vocab_size: int = 20_000,
+                    n_queries: int = 200, batch: int = 32, k: int = 4, seed: int = 0) -> Dict[str, float]:
+    # Ingests a synthetic corpus of 100k+ passages with the hashing embedder, then times single and
+    # batched top-k queries on the memory mapped index. Some files hold a unique sentence, asking for
+    # it has to bring that file's passage back first.
+    from ericchat.util import HashingEmbedder, Retriever, VectorIndex, ingest
+
+    rnd = random.Random(seed)
+    vocab = [f"{rnd.choice('bcdfghjklmnpqrstvwz')}{rnd.choice('aeiou')}{i:x}" for i in range(vocab_size)]
+    needles = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs = Path(tmp) / "docs"
+        docs.mkdir()
+        for f in range(n_files):
+            lines = []
+            for _ in range(chunks_per_file * chunk_chars // 80):
+                lines.append(" ".join(rnd.choices(vocab, k=12)) + "\n")
+            if f % 10 == 0:
+                needle = " ".join(f"{word}{f}" for word in ("zanzibar", "quokka", "marmalade", "tuba",
+                                                             "lantern", "pebble", "saffron", "walrus"))
+                needles[needle] = f"doc{f:05}.txt"
+                lines.insert(rnd.randrange(len(lines)), needle + "\n")
+            (docs / f"doc{f:05}.txt").write_text("".join(lines), encoding="utf-8")
+
+        embedder = HashingEmbedder()
+        index = VectorIndex(Path(tmp) / "index", embedder.dim, embedder=embedder.name)
+        start = time.perf_counter()
+        stats = ingest(index, embedder, [docs], chunk_chars=chunk_chars, overlap_chars=80)
+        ingest_seconds = time.perf_counter() - start
+
+        # a fresh index object: searched from the files, nothing cached from the ingest
+        retriever = Retriever(VectorIndex(Path(tmp) / "index", embedder.dim, embedder=embedder.name), embedder, k=k)
+        queries = [" ".join(rnd.choices(vocab, k=8)) for _ in range(n_queries)]
+        single = []
+        for query in queries:
+            start = time.perf_counter()
+            retriever.search([query])
+            single.append((time.perf_counter() - start) * 1000)
+        single.sort()
+
+        vectors = embedder.embed(queries)
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch):
+            retriever.index.search(vectors[i:i + batch], k)
+        batched_ms = (time.perf_counter() - start) * 1000 / len(vectors)
+
+        found = sum(1 for needle, name in needles.items()
+                    if Path(retriever.search([needle])[0][0].path).name == name)
+
+        index_mb = retriever.index.vectors_path.stat().st_size / (1024 * 1024)
+
+    return {
+        "files": stats["files"],
+        "chunks": stats["chunks"],
+        "ingest_seconds": ingest_seconds,
+        "ingest_chunks_per_second": stats["chunks"] / ingest_seconds,
+        "ingest_mb_per_second": stats["bytes"] / (1024 * 1024) / ingest_seconds,
+        "index_mb": index_mb,
+        "query_p50_ms": single[len(single) // 2],
+        "query_p99_ms": single[min(len(single) - 1, int(len(single) * 0.99))],
+        "batched_ms_per_query": batched_ms,
+        "needles_found": f"{found}/{len(needles)}",
+    }
+
+
+def bench_candidates(prompt_words: int = 3000, answer_words: int = 150, prefill_tps: float = 4000.0,
+                     decode_tps: float = 300.0, batch_cost: float = 0.1, counts: Tuple[int, ...] = (2, 4)) -> Dict[str, float]:
+    # N answers as one batch after one prefill against N plain streams, on the fake backend's cost
+    # model, and the candidates committed as sibling answers through EricUIState.
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend
+    from ericchat.eric_state import EricUIState
+
+    backend = FakeChatBackend(prefill_tps=prefill_tps, decode_tps=decode_tps, thinking="Let me think " * 10,
+                              answer=" ".join(f"word{i}" for i in range(answer_words)), batch_cost=batch_cost)
+    messages = [{"role": "user", "content": " ".join(["word"] * prompt_words)}]
+    args = CHATCallArgs(max_len=answer_words + 64, top_k=0, temp=0.7, top_p=0.8)
+
+    start = time.perf_counter()
+    for _ in backend.stream(messages, args):
+        pass
+    single_seconds = time.perf_counter() - start
+    result = {"single_seconds": single_seconds}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in counts:
+            state = EricUIState(Path(tmp), backend="fake")
+            state.user_input("Question")
+            state.start_candidates(n)
+            start = time.perf_counter()
+            for index, piece in backend.stream_candidates(messages, args, n):
+                state.candidate_step(index, piece)
+            batched_seconds = time.perf_counter() - start
+            tps = [msg.tps for msg in state.candidate_streams]
+            state.finish_chat()
+
+            # the first candidate is the committed answer, the others are its siblings
+            last = len(state.convo_history) - 1
+            assert state.convo_history.siblings(last) == (0, n)
+            answers = {state.convo_history[last].text}
+            while state.switch_branch(last, 1):
+                answers.add(state.convo_history[last].text)
+            assert len(answers) == n
+
+            result[f"n{n}_sequential_seconds"] = single_seconds * n
+            result[f"n{n}_batched_seconds"] = batched_seconds
+            result[f"n{n}_speedup"] = single_seconds * n / batched_seconds
+            result[f"n{n}_tps_per_candidate"] = sum(tps) / n
+    return result
+
+
+def bench_downloads(n_files: int = 3, file_mb: int = 48, limit_mb: float = 50.0, busy_mb: float = 20.0,
+                    decode_tps: float = 400.0) -> Dict[str, float]:
+    # Installs a fake model from a local HTTP server that answers range requests, standing in for the
+    # Hub: full speed, with a limit, paused halfway, cancelled and resumed from the partial file, and
+    # next to a fake generation, where the download drops to its busy rate.
+    import functools
+    import hashlib
+    import http.server
+    import os
+    import shutil
+    import urllib.request
+
+    from erictransformer import CHATCallArgs
+
+    from ericchat.backends import FakeChatBackend
+    from ericchat.util import (CancelToken, DownloadControl, ModelSource,
+                               ModelStore, SourceFile, TaskCancelled,
+                               file_sha256, install_model)
+
+    class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = Path(self.translate_path(self.path))
+            size = path.stat().st_size
+            ranged = self.headers.get("Range")
+            start = int(ranged.split("=")[1].split("-")[0]) if ranged else 0
+            self.send_response(206 if ranged else 200)
+            self.send_header("Content-Length", str(size - start))
+            if ranged:
+                self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.end_headers()
+            with open(path, "rb") as f:
+                f.seek(start)
+                try:
+                    shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    class _ServerSource(ModelSource):
+        name = "local server"
+        resumable = True
+
+        def __init__(self, url: str, root: Path, digests: Dict[str, str]):
+            self.url = url
+            self.root = root
+            self.digests = digests
+
+        def list_files(self, repo_id):
+            # with hashes like the Hub's LFS files, so finished files are found in the store
+            return [SourceFile(p.name, p.stat().st_size, self.digests[p.name]) for p in sorted((self.root / repo_id).iterdir())]
+
+        def open(self, repo_id, file, offset):
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            response = urllib.request.urlopen(urllib.request.Request(f"{self.url}/{repo_id}/{file.name}", headers=headers), timeout=30)
+            return response, offset if response.status == 206 else 0
+
+    mb = 1024 * 1024
+    repo = "bench/model"
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "served" / repo).mkdir(parents=True)
+        digests = {}
+        for i in range(n_files):
+            data = os.urandom(file_mb * mb)
+            (tmp / "served" / repo / f"model-{i}.safetensors").write_bytes(data)
+            digests[f"model-{i}.safetensors"] = hashlib.sha256(data).hexdigest()
+        total = n_files * file_mb * mb
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_RangeHandler, directory=str(tmp / "served")))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        source = _ServerSource(f"http://127.0.0.1:{server.server_address[1]}", tmp / "served", digests)
+        runs = iter(range(100))
+
+        def _install(control: DownloadControl, token=None, on_progress=None) -> Tuple[float, int]:
+            # seconds and the bytes that went over the wire
+            run = next(runs)
+            fetched = []
+
+            def gate(n):
+                fetched.append(n)
+                control.gate(n, token)
+
+            start = time.perf_counter()
+            install_model(source, repo, tmp / f"model{run}", ModelStore(tmp / "store"), on_progress=on_progress, gate=gate)
+            seconds = time.perf_counter() - start
+            installed = {p.name: file_sha256(p) for p in (tmp / f"model{run}").iterdir() if p.suffix == ".safetensors"}
+            assert installed == digests
+            shutil.rmtree(tmp / "store")
+            return seconds, sum(fetched)
+
+        try:
+            seconds, _ = _install(DownloadControl())
+            result = {"mb": total / mb, "full_speed_mb_per_second": total / mb / seconds}
+
+            seconds, _ = _install(DownloadControl(max_bytes_per_second=int(limit_mb * mb)))
+            result["limited_mb_per_second"] = total / mb / seconds
+
+            # paused at a third for a second: nothing may arrive while paused
+            control = DownloadControl(max_bytes_per_second=int(limit_mb * mb))
+            samples = []
+
+            def pause_at_a_third(done, total_bytes):
+                samples.append((time.monotonic(), done))
+                if done >= total_bytes / 3 and not paused_at:
+                    paused_at.append(time.monotonic())
+                    control.pause()
+                    threading.Timer(1.0, control.resume).start()
+
+            paused_at = []
+            _install(control, on_progress=pause_at_a_third)
+            during = [done for t, done in samples if paused_at[0] + 0.05 < t < paused_at[0] + 0.95]
+            result["bytes_while_paused"] = max(during) - min(during) if during else 0
+
+            # cancelled at half, then installed again: only the rest is fetched
+            token = CancelToken()
+
+            def cancel_at_half(done, total_bytes):
+                if done >= total_bytes / 2:
+                    token.cancel()
+                token.raise_if_cancelled()
+
+            try:
+                install_model(source, repo, tmp / "cancelled", ModelStore(tmp / "store"), on_progress=cancel_at_half,
+                              gate=lambda n: DownloadControl().gate(n, token))
+            except TaskCancelled:
+                pass
+            _, fetched = _install(DownloadControl())
+            result["resumed_fetched_share"] = fetched / total
+
+            # a generation next to the download, which is held to busy_mb while it runs
+            backend = FakeChatBackend(prefill_tps=0, decode_tps=decode_tps, answer="word " * 2000)
+            args = CHATCallArgs(max_len=2000, top_k=0, temp=0.7, top_p=0.8)
+
+            def _generation_tps() -> float:
+                start = time.perf_counter()
+                tokens = sum(1 for _ in backend.stream([{"role": "user", "content": "hi"}], args))
+                return tokens / (time.perf_counter() - start)
+
+            result["generation_tps_alone"] = _generation_tps()
+            generating = threading.Event()
+            control = DownloadControl(busy_bytes_per_second=int(busy_mb * mb), is_busy=generating.is_set)
+            download = threading.Thread(target=_install, args=(control,))
+            generating.set()
+            download.start()
+            result["generation_tps_while_downloading"] = _generation_tps()
+            # the rate over the last second of the generation
+            result["download_mb_per_second_while_generating"] = control.speed / mb
+            generating.clear()
+            download.join()
+        finally:
+            server.shutdown()
+    return result
+
+
+def _write_safetensors(path: Path, tensors: Dict[str, Tuple[str, Tuple[int, ...]]], rnd: random.Random):
+    # the safetensors layout: a little endian u64 header length, a JSON header, the tensors' bytes
+    import json
+    import struct
+
+    itemsize = {"F16": 2, "F32": 4}
+    header, offset = {}, 0
+    for name, (dtype, shape) in tensors.items():
+        n = itemsize[dtype]
+        for dim in shape:
+            n *= dim
+        header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + n]}
+        offset += n
+    encoded = json.dumps(header).encode()
+    encoded += b" " * (-len(encoded) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        chunk = rnd.randbytes(16 * 1024 * 1024)
+        while offset > 0:
+            f.write(chunk[:offset])
+            offset -= len(chunk)
+
+
+def _deserialize_safetensors(path: Path) -> dict:
+    # tensors as views into a memory map: nothing but the header is read yet
+    import json
+    import struct
+
+    import numpy as np
+
+    dtypes = {"F16": np.float16, "F32": np.float32}
+    with open(path, "rb") as f:
+        length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(length))
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=8 + length)
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        begin, end = info["data_offsets"]
+        tensors[name] = data[begin:end].view(dtypes[info["dtype"]]).reshape(info["shape"])
+    return tensors
+
+
+def bench_load(n_shards: int = 4, shard_mb: int = 256, tensor_mb: int = 32, workers: int = 4,
+               seed: int = 0) -> Dict[str, float]:
+    # A cold load of a synthetic safetensors model in its three phases: read (the files from disk),
+    # deserialize (the headers, tensors mapped but not read) and materialize (the tensors copied into
+    # memory of their own, what a backend does with the weights). Once reading as part of materialize,
+    # one shard after another, and once with the read phase done first by the Prefetcher's threads.
+    # The files are evicted from the page cache before each cold load, where the platform allows it.
+    import numpy as np
+
+    from ericchat.util import Prefetcher, evict
+
+    rnd = random.Random(seed)
+    mb = 1024 * 1024
+    per_shard = shard_mb // tensor_mb
+    side = int((tensor_mb * mb // 2) ** 0.5)
+
+    def _load(paths):
+        timings = {}
+        start = time.perf_counter()
+        shards = [_deserialize_safetensors(p) for p in paths]
+        timings["deserialize"] = time.perf_counter() - start
+        start = time.perf_counter()
+        weights = [{name: np.array(t) for name, t in shard.items()} for shard in shards]
+        timings["materialize"] = time.perf_counter() - start
+        del shards, weights
+        gc.collect()
+        return timings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(n_shards):
+            path = Path(tmp) / f"model-{i + 1:05d}-of-{n_shards:05d}.safetensors"
+            _write_safetensors(path, {f"layers.{i * per_shard + j}.weight": ("F16", (side, side))
+                                      for j in range(per_shard)}, rnd)
+            paths.append(path)
+        size = sum(p.stat().st_size for p in paths)
+        result = {"gb": size / 1024 ** 3, "evicted": float(evict(paths))}
+
+        sequential = _load(paths)
+        result["cold_sequential_seconds"] = sum(sequential.values())
+        result["cold_sequential_materialize_seconds"] = sequential["materialize"]
+
+        # the read phase alone with one thread, what the threads are measured against
+        evict(paths)
+        result["read_one_thread_seconds"] = Prefetcher(paths, workers=1).run().seconds
+
+        evict(paths)
+        read = Prefetcher(paths, workers=workers).run()
+        prefetched = _load(paths)
+        result["read_seconds"] = read.seconds
+        result["read_gb_per_second"] = read.gb_per_second
+        result["deserialize_seconds"] = prefetched["deserialize"]
+        result["materialize_seconds"] = prefetched["materialize"]
+        result["cold_prefetched_seconds"] = read.seconds + sum(prefetched.values())
+        result["speedup"] = result["cold_sequential_seconds"] / result["cold_prefetched_seconds"]
+
+        # a model that was prefetched when it was picked: the load is all from memory
+        warm = _load(paths)
+        result["warm_seconds"] = sum(warm.values())
+        assert read.done == size
+    return result
+
+
+def _quantize(x, bits: int, group_size: int) -> tuple:
+    # affine quantization in groups along the last axis, as mx.quantize does it: the values back and
+    # the bytes it takes, the packed values plus a float16 scale and bias per group
+    import numpy as np
+
+    groups = x.reshape(*x.shape[:-1], x.shape[-1] // group_size, group_size)
+    low = groups.min(axis=-1, keepdims=True)
+    scale = np.maximum((groups.max(axis=-1, keepdims=True) - low) / (2 ** bits - 1), 1e-8)
+    q = np.round((groups - low) / scale)
+    scale, low = scale.astype(np.float16).astype(np.float32), low.astype(np.float16).astype(np.float32)
+    return (q * scale + low).reshape(x.shape), x.size * bits // 8 + 2 * 2 * x.size // group_size
+
+
+def bench_kv_cache(context: int = 32768, kv_heads: int = 8, head_dim: int = 64, n_queries: int = 32,
+                   n_needles: int = 16, outlier_channels: int = 2, seed: int = 0) -> Dict[str, float]:
+    # What every KV cache setting of the app saves and costs. The memory is kv_cache_bytes() for a model
+    # shaped like gpt-oss-120b at the context length, checked against the bytes the simulated cache takes.
+    # The quality is one attention layer over a synthetic cache of context tokens, whose keys have a few
+    # large channels like real ones: "output_cosine" compares the outputs for queries about recent tokens
+    # with the full cache's, "needle_recall" is the share of early tokens a query for them still finds.
+    import numpy as np
+
+    from ericchat.util import (ATTENTION_SINKS, KV_CACHE_MODES, KV_GROUP_SIZE,
+                               KVShape, kv_cache_bytes)
+
+    rng = np.random.default_rng(seed)
+    content = rng.standard_normal((kv_heads, context, head_dim), dtype=np.float32)
+    # a large offset on the same channels of every key, which widens their quantization groups but
+    # adds the same to every logit
+    keys = content.copy()
+    keys[:, :, rng.choice(head_dim, outlier_channels, replace=False)] += 8
+    keys = keys.astype(np.float16).astype(np.float32)
+    values = rng.standard_normal((kv_heads, context, head_dim), dtype=np.float32).astype(np.float16).astype(np.float32)
+
+    # queries about one of the last 2048 tokens, and about needles in the first half
+    recent = rng.integers(context - 2048, context, n_queries)
+    needles = rng.choice(np.arange(ATTENTION_SINKS, context // 2), n_needles, replace=False)
+    recent_queries = (content[:, recent] + 0.5 * rng.standard_normal((kv_heads, n_queries, head_dim), dtype=np.float32)) * 4
+    needle_queries = content[:, needles] * 6
+
+    def _attend(q, k, v):
+        logits = q @ k.transpose(0, 2, 1) / np.sqrt(head_dim)
+        logits -= logits.max(axis=-1, keepdims=True)
+        weights = np.exp(logits)
+        return (weights / weights.sum(axis=-1, keepdims=True)) @ v
+
+    def _cosine(a, b):
+        return (a * b).sum(-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+    reference = _attend(recent_queries, keys, values)
+    shape_120b = KVShape(layers=36, kv_heads=8, head_dim=64, sliding_layers=18, sliding_window=128)
+    result = {"context": context}
+    for mode, (kv_bits, max_kv_size) in KV_CACHE_MODES.items():
+        name = f"{kv_bits}bit" if kv_bits else f"last{max_kv_size}" if max_kv_size else "full"
+        k, v = keys, values
+        cache_bytes = 2 * keys.size * 2
+        if kv_bits:
+            k, key_bytes = _quantize(keys, kv_bits, KV_GROUP_SIZE)
+            v, value_bytes = _quantize(values, kv_bits, KV_GROUP_SIZE)
+            cache_bytes = key_bytes + value_bytes
+        elif max_kv_size and max_kv_size < context:
+            kept = np.r_[0:ATTENTION_SINKS, context - max_kv_size + ATTENTION_SINKS:context]
+            k, v = keys[:, kept], values[:, kept]
+            cache_bytes = 2 * k.size * 2
+        # one full attention layer of the simulated cache, as kv_cache_bytes counts it
+        one_layer = KVShape(layers=1, kv_heads=kv_heads, head_dim=head_dim)
+        assert abs(kv_cache_bytes(one_layer, context, kv_bits, max_kv_size, prefill_step_size=0) - cache_bytes) <= 0.01 * cache_bytes
+
+        found = _cosine(_attend(needle_queries, k, v), values[:, needles]) > 0.9
+        result[f"{name}_gb_120b"] = kv_cache_bytes(shape_120b, context, kv_bits, max_kv_size) / 1024 ** 3
+        result[f"{name}_output_cosine"] = float(_cosine(_attend(recent_queries, k, v), reference).mean())
+        result[f"{name}_needle_recall"] = float(found.mean())
+    return result
+
+
+def bench_manifests(n_files: int = 12, latency: float = 0.15) -> Dict[str, float]:
+    # Installs from a stand-in for the Hub: an fsspec file system over a local folder of commits whose
+    # find() and model_info() wait latency seconds, like a round trip. Counts the round trips of a first
+    # install, of installing and verifying again, after main moved on (pinned until refreshed or the TTL
+    # ran out) and with refresh.
+    import hashlib
+    import shutil
+    import types
+
+    from fsspec import AbstractFileSystem
+
+    from ericchat.util import (HubSource, ManifestCache, ModelStore,
+                               install_model, installed_revision,
+                               verify_install)
+
+    class _LocalHubFS(AbstractFileSystem):
+        # <root>/<repo>/<commit>/<files>, with the Hub's info: size and the sha256 of LFS files
+        cachable = False
+
+        def __init__(self, root: Path):
+            super().__init__()
+            self.root = root
+
+        def find(self, path, maxdepth=None, withdirs=False, detail=False, revision=None, **kwargs):
+            time.sleep(latency)
+            entries = {}
+            for file in sorted((self.root / path / revision).iterdir()):
+                entries[f"{path}/{file.name}"] = {"name": f"{path}/{file.name}", "size": file.stat().st_size, "type": "file",
+                                                  "lfs": {"sha256": hashlib.sha256(file.read_bytes()).hexdigest()}}
+            return entries if detail else sorted(entries)
+
+    class _LocalHubAPI:
+        def __init__(self, root: Path):
+            self.root = root
+
+        def model_info(self, repo_id, revision=None):
+            time.sleep(latency)
+            return types.SimpleNamespace(sha=(self.root / repo_id / "refs" / revision).read_text())
+
+    class _LocalHub(HubSource):
+        def open(self, repo_id, file, offset):
+            f = open(self.fs.root / repo_id / self.resolved_revision(repo_id) / file.name, "rb")
+            f.seek(offset)
+            return f, offset
+
+    repo = "bench/model"
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        hub = tmp / "hub"
+
+        commits = []
+
+        def _commit(changed: int) -> str:
+            # the next commit of the repo, the first `changed` files differ from the commit before
+            commit = hashlib.sha1(f"commit {len(commits)}".encode()).hexdigest()
+            folder = hub / repo / commit
+            folder.mkdir(parents=True)
+            for i in range(n_files):
+                name = f"model-{i}.safetensors"
+                if i < changed or not commits:
+                    (folder / name).write_bytes(f"weights {i} of {commit}".encode() * 1000)
+                else:
+                    shutil.copyfile(hub / repo / commits[-1] / name, folder / name)
+            (hub / repo / "refs").mkdir(exist_ok=True)
+            (hub / repo / "refs" / "main").write_text(commit)
+            commits.append(commit)
+            return commit
+
+        store = ModelStore(tmp / "store")
+        fs, api = _LocalHubFS(hub), _LocalHubAPI(hub)
+        save_path = tmp / "model"
+
+        def _install(refresh: bool = False, ttl: float = 3600.0) -> Tuple[HubSource, float, dict]:
+            source = _LocalHub(cache=ManifestCache(store.remote, ttl=ttl), refresh=refresh, fs=fs, api=api)
+            start = time.perf_counter()
+            result = install_model(source, repo, save_path, store)
+            return source, time.perf_counter() - start, result
+
+        first = _commit(n_files)
+        source, seconds, _ = _install()
+        result = {"first_install_round_trips": source.requests, "first_install_seconds": seconds}
+        assert installed_revision(save_path) == first
+
+        source, seconds, info = _install()
+        result["repeat_install_round_trips"] = source.requests
+        result["repeat_install_seconds"] = seconds
+        assert info["fetched"] == 0
+
+        # verified against the cached listing
+        source = _LocalHub(cache=ManifestCache(store.remote), fs=fs, api=api)
+        assert not verify_install(save_path, source.list_files(repo), check_hashes=True)
+        result["verify_round_trips"] = source.requests
+
+        # main moves on: still the pinned commit until a refresh or the TTL
+        second = _commit(2)
+        source, _, _ = _install()
+        result["pinned_after_push"] = float(installed_revision(save_path) == first)
+        result["pinned_round_trips"] = source.requests
+        source, _, info = _install(refresh=True)
+        result["refresh_round_trips"] = source.requests
+        result["refresh_fetched_files"] = info["fetched"]
+        assert installed_revision(save_path) == second
+        _commit(1)
+        source, _, _ = _install(ttl=0)
+        result["expired_round_trips"] = source.requests
+    return result
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "journal": bench_journal,
+    "cancel": bench_cancel,
+    "speculative": bench_speculative,
+    "watchdog": bench_watchdog,
+    "replay": bench_replay,
+    "tracing": bench_tracing,
+    "branching": bench_branching,
+    "cache": bench_cache,
+    "tasks": bench_tasks,
+    "retrieval": bench_retrieval,
+    "candidates": bench_candidates,
+    "downloads": bench_downloads,
+    "load": bench_load,
+    "kv": bench_kv_cache,
+    "manifests": bench_manifests,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # from a checkout: python3 -m benchmarks.bench NAME
+    parser = argparse.ArgumentParser(prog="benchmarks.bench", description="run a micro benchmark")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    args = parser.parse_args(argv)
+    result = BENCHMARKS[args.name]()
+    for key, value in result.items():
+        print(f"{key}: {round(value, 3) if isinstance(value, float) else value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1 +1,4 @@
-from ericchat.app import run
\ No newline at end of file
+def run(backend: str = "", record: str = "", trace: str = "", profile: bool = False):
+    # imported lazily so the command line tools don't need a GUI toolkit
+    from ericchat.app import run as run_app
+    run_app(backend, record, trace, profile)
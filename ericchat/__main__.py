@@ -1,9 +1,13 @@
 import os
+import sys
 
 os.environ["HF_XET_HIGH_PERFORMANCE"] = "1"
 os.environ["HF_HUB_DISABLE_TELEMETRY"] = "1"
 
-from ericchat.app import run
-
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from ericchat.cli import main
+        sys.exit(main(sys.argv[1:]))
+
+    from ericchat.app import run
     run()
@@ -1,26 +1,53 @@
 import gc
-import json
+import os
 import threading
+import time
 import webbrowser
 from functools import partial
 from pathlib import Path
 from importlib.metadata import version
+from typing import Optional
 
 import toga
-from erictransformer import CHATCallArgs
-from huggingface_hub import HfFileSystem
 from huggingface_hub.utils import disable_progress_bars
 from toga.constants import WindowState
 from toga.style import Pack
-from toga.style.pack import CENTER, COLUMN, LEFT, ROW
+from toga.style.pack import CENTER, COLUMN, HIDDEN, LEFT, ROW, VISIBLE
 
+from .backends import (BACKEND_ENV, InferenceCancelled, KVCallArgs,
+                       ProcessChatBackend, choose_backend)
 from .eric_state import EricUIState
 from .message_html import render_html
 from .style import EricColours
-from .util import BytesCallback, ModelDetails, get_eric_chat_mlx, get_memory
+from .util import (CHARS_PER_TOKEN, KV_CACHE_MODES, STEER_PROMPT,
+                   ConvoJournal, DownloadControl, GenerationCache, HubSource,
+                   LoopLagMonitor, ModelDetails,
+                   ModelStore, PeakMemory, Prefetcher, PrefillProgress,
+                   ProfileStore, Retriever, SamplingProfiler, SourceFile,
+                   StreamRecorder, StreamSpeed, TaskEvent, TaskManager,
+                   ThinkingServer, Tracer, VectorIndex, fits_in_memory,
+                   get_embedder, get_memory, get_model_source, ingest,
+                   install_model, installed_revision, read_archive,
+                   trimmable_kv_cache, verify_install, weight_files,
+                   write_archive)
+from .util.tasks import (CANCELLED, DOWNLOAD, FAILED, FINISHED, GENERATE, IO,
+                         LOAD, RUNNING, VERIFY)
 
 VERSION = version("ericchat")
 
+# the download limits offered in the settings, bytes per second
+DOWNLOAD_LIMITS = {"No download limit": 0, "100 MB/s": 100 * 1024 * 1024, "50 MB/s": 50 * 1024 * 1024,
+                   "20 MB/s": 20 * 1024 * 1024, "5 MB/s": 5 * 1024 * 1024}
+
+TASK_FAILED = {DOWNLOAD: "Failed to download", VERIFY: "Failed to verify the model", LOAD: "Failed to initialize"}
+
+RECORD_ENV = "ERICCHAT_RECORD"
+# opt-in instrumentation: a Chrome trace is written here on exit, PROFILE_ENV=1 adds stack samples
+TRACE_ENV = "ERICCHAT_TRACE"
+PROFILE_ENV = "ERICCHAT_PROFILE"
+
+WATCHDOG_SEGMENT = 16
+
 class EricChat(toga.App):
     def startup(self):
         self.resources_path = Path(self.paths.app) / "resources"
@@ -28,15 +55,56 @@ class EricChat(toga.App):
 
         self.model_dir = self.paths.data / "models"
         self.model_dir.mkdir(parents=True, exist_ok=True)
+        # every model's files, deduplicated across models and revisions
+        self.model_store = ModelStore(self.model_dir / "store")
 
         self.available_gb = get_memory()
-        self.state = EricUIState(self.model_dir)
+
+        # MLX on Apple silicon, transformers on the CPU elsewhere, or $ERICCHAT_BACKEND
+        try:
+            self.eric_chat_class = choose_backend()
+            backend_error = ""
+        except ValueError as e:
+            self.eric_chat_class = None
+            backend_error = f"ERROR: {e}"
+
+        self.state = EricUIState(self.model_dir, backend=self.eric_chat_class.name if self.eric_chat_class else "mlx")
+        self.state.on_search_ready = lambda: self._with_ui(self._on_search_ready)
+        # restores conversations from the last session, including answers cut off by a crash
+        self.state.attach_journal(ConvoJournal(self.paths.data / "conversations" / "journal.jsonl"))
+        # the transcript only carries the summary of a thinking trace, the trace is fetched from here when opened
+        self.thinking_server = ThinkingServer(self._thinking_text).start()
         self.eric = None
-        self.eric_lock = threading.Lock()
+        # backend, model, revision and draft of the loaded model, part of the generation cache key
+        self.loaded_model_id = ""
+        # (backend, model, revision) the profile of the loaded model is kept under, None with a draft model
+        self.loaded_profile = None
+        # RSS before the loaded model, what the process grew by since is the model's
+        self.rss_before_load = 0
+        # measured load time, memory and speed of every model on this machine, see `ericchat calibrate`
+        self.profiles = ProfileStore(self.paths.data / "model_profiles.json")
+        self.generation_cache = GenerationCache(self.paths.data / "generation_cache")
+        # opened when documents are first used, a transformers embedder takes a while to load
+        self.retriever = None
         self.current_selection = ""
 
         self.ui_loop = None
-        self.cancel_download = False
+        # downloads, loads, generations and archive IO. self.eric is only replaced by a load task, which
+        # shares its single worker with the generate tasks, so a model is never swapped under a stream
+        self.tasks = TaskManager(on_event=lambda event: self._with_ui(self._on_task_event, event))
+        # pause, resume and the rate of the downloads, which are slowed down while the model generates
+        self.downloads = DownloadControl(is_busy=lambda: self.tasks.busy(GENERATE))
+        # reads the weights of the model picked in the list into the page cache, before it's loaded
+        self.prefetch = None
+        # host the model in a child process: unloading returns all of its memory and a crash can't take the GUI down
+        self.isolate_model = True
+        # every generation is written to a trace in this folder when set, see ReplayChatBackend
+        record_dir = os.environ.get(RECORD_ENV, "")
+        self.record_dir = Path(record_dir) if record_dir else None
+        self.trace_path = os.environ.get(TRACE_ENV, "")
+        self.tracer = Tracer(enabled=bool(self.trace_path))
+        self.lag_monitor = None
+        self.profiler = None
 
         self.show_message_count = 32
 
@@ -46,10 +114,22 @@ class EricChat(toga.App):
 
         self.chat_column = toga.Box(direction=COLUMN, style=Pack(flex=1, background_color=EricColours.DARK_RED))
 
+        self.search_query = ""
+        self.search_input = toga.TextInput(placeholder="Search chats", on_change=self.on_search,
+                                           style=Pack(flex=1, margin_left=4, margin_right=4))
+
         self.build_convo_history()
 
         self.left_inner.add(close_button)
 
+        self.left_inner.add(self.search_input)
+
+        export_button = toga.Button("Export", on_press=self.on_export, style=Pack(flex=1, margin_top=8, margin_left=4, margin_right=2,
+                                                                              background_color=EricColours.ERIC_RED))
+        import_button = toga.Button("Import", on_press=self.on_import, style=Pack(flex=1, margin_top=8, margin_left=2, margin_right=4,
+                                                                              background_color=EricColours.ERIC_RED))
+        self.left_inner.add(toga.Box(children=[export_button, import_button], style=Pack(direction=ROW)))
+
         self.left_inner.add(self.chat_column)
 
         self.left_sc = toga.ScrollContainer(
@@ -80,6 +160,17 @@ class EricChat(toga.App):
 
         input_row.add(self.send_btn)
 
+        # Branching: regenerate the last answer or edit the last prompt, the old branch is kept and
+        # the arrows switch between branches
+        branch_style = Pack(flex=1, margin=(4, 2, 4, 2), color=EricColours.LIGHT_RED, background_color=EricColours.ERIC_RED)
+        branch_row = toga.Box(direction=ROW, style=Pack())
+        branch_row.add(toga.Button("Regenerate", on_press=self.on_regenerate, style=branch_style))
+        branch_row.add(toga.Button("Edit last prompt", on_press=self.on_edit_last, style=branch_style))
+        branch_row.add(toga.Button("◀", on_press=partial(self.on_switch_branch, -1), style=branch_style))
+        branch_row.add(toga.Button("▶", on_press=partial(self.on_switch_branch, 1), style=branch_style))
+        # index of the prompt being edited, the next submit forks there
+        self.editing_index = None
+
         self.loaded_model_label = toga.Label(
             "", style=Pack(text_align=LEFT, margin=(8, 8, 4, 8), color=EricColours.LIGHT_RED)
         )
@@ -109,6 +200,16 @@ class EricChat(toga.App):
 
         self.model_column.add(self.status_label)
 
+        # downloads run next to the chat, this row shows the current one and is hidden otherwise
+        self.download_label = toga.Label("", style=Pack(text_align=LEFT, margin=(0, 8, 0, 8), color=EricColours.LIGHT_RED))
+        self.pause_download_btn = toga.Button("Pause", on_press=self.on_pause_download,
+                                              style=Pack(width=80, margin=(0, 4, 0, 0), background_color=EricColours.ERIC_RED, color=EricColours.BG_LIGHT))
+        cancel_download_btn = toga.Button("Cancel", on_press=self.on_cancel_download,
+                                          style=Pack(width=80, margin=0, background_color=EricColours.ERIC_RED, color=EricColours.BG_LIGHT))
+        self.download_row = toga.Box(direction=ROW, style=Pack(margin=(0, 8, 8, 8), visibility=HIDDEN),
+                                     children=[self.pause_download_btn, cancel_download_btn, self.download_label])
+        self.model_column.add(self.download_row)
+
         self.news_label = toga.Label(
             f"Current Version: {VERSION}", style=Pack(text_align=LEFT, margin=(0, 0, 4, 0), color=EricColours.LIGHT_RED)
         )
@@ -185,10 +286,47 @@ class EricChat(toga.App):
 
         length_row = toga.Box(children=[self.token_length_label, token_length_slider], style=Pack(direction=ROW, margin=(0, 16, 16, 16)))
 
+        # sampled answers per prompt, decoded as one batch after a shared prefill
+        candidates_slider = toga.Slider(min=1, max=4, tick_count=4, value=self.state.candidates, flex=10,
+                                        on_change=self.on_candidates_slider)
+        self.candidates_label = toga.Label(
+            f"Candidates: {self.state.candidates}", style=Pack(flex=0, text_align=LEFT, margin=0, color=EricColours.LIGHT_RED)
+        )
+        candidates_row = toga.Box(children=[self.candidates_label, candidates_slider], style=Pack(direction=ROW, margin=(0, 16, 16, 16)))
+
+        # applies on the next model load, the draft model is loaded next to the model
+        speculative_switch = toga.Switch("Speculative decoding (next load)", value=self.state.speculative,
+                                         on_change=self.on_speculative_switch,
+                                         style=Pack(margin=(0, 16, 16, 16), color=EricColours.LIGHT_RED))
+
+        # what the KV cache of the conversation will take with the loaded model, next to the setting
+        kv_cache = toga.Selection(items=list(KV_CACHE_MODES), value=self.state.kv_cache, on_change=self.on_kv_cache,
+                                  enabled=bool(self.eric_chat_class and self.eric_chat_class.supports_kv_cache),
+                                  style=Pack(width=256))
+        self.kv_label = toga.Label("", style=Pack(margin_left=16, color=EricColours.LIGHT_RED))
+        kv_row = toga.Box(children=[kv_cache, self.kv_label], style=Pack(direction=ROW, align_items="center", margin=(0, 16, 16, 16)))
+
+        download_limit = toga.Selection(items=list(DOWNLOAD_LIMITS), on_change=self.on_download_limit,
+                                        style=Pack(margin=(0, 16, 16, 16), width=256))
+
         # cancel button
         model_settings_cancel_btn = toga.Button("Cancel", on_press=self.on_model_settings_btn_press, style=Pack(margin_left=16, width=128,  margin_bottom=8))
 
-        self.model_settings_drop_down =  toga.Box(children=[creativity_row, length_row, model_settings_cancel_btn], style=Pack(direction=COLUMN, margin=0))
+        # only used at the lowest creativity, where the same prompt always gets the same answer
+        cache_switch = toga.Switch("Reuse answers at the lowest creativity", value=self.state.use_cache,
+                                   on_change=self.on_cache_switch,
+                                   style=Pack(margin=(0, 16, 16, 16), color=EricColours.LIGHT_RED))
+
+        # only the excerpts of the added folders that match the question are sent with it
+        self.documents_switch = toga.Switch("Answer from my documents", value=False, on_change=self.on_documents_switch,
+                                            style=Pack(margin=(0, 16, 8, 16), color=EricColours.LIGHT_RED))
+        add_documents_btn = toga.Button("Add a folder of documents", on_press=self.on_add_documents,
+                                        style=Pack(margin=(0, 16, 16, 16), width=256))
+
+        # only offered when one of the models has a draft model
+        speculative_row = [speculative_switch] if any(m.draft_short_name for m in self.state.available_models.values()) else []
+        self.model_settings_drop_down =  toga.Box(children=[creativity_row, length_row, candidates_row, *speculative_row, cache_switch,
+                                                            self.documents_switch, add_documents_btn, kv_row, download_limit, model_settings_cancel_btn], style=Pack(direction=COLUMN, margin=0))
 
         self.progress = toga.Box(direction=COLUMN, style=Pack(margin_right=16, margin_left=24, margin_bottom=8))
 
@@ -205,6 +343,7 @@ class EricChat(toga.App):
         self.right_pane.add(self.button_header_row)
         self.right_pane.add(self.progress)
         self.right_pane.add(self.web)
+        self.right_pane.add(branch_row)
         self.right_pane.add(input_row)
 
         # Container row with sidebar
@@ -223,14 +362,17 @@ class EricChat(toga.App):
 
         self.ui_loop = self.main_window.app.loop
 
-        self._update_webview()
+        if self.tracer.enabled:
+            self.lag_monitor = LoopLagMonitor(self.ui_loop, self.tracer)
+            self.lag_monitor.start()
+            if os.environ.get(PROFILE_ENV, "") not in ("", "0"):
+                self.profiler = SamplingProfiler(self.tracer)
+                self.profiler.start()
 
-        mlx_cls = get_eric_chat_mlx()
+        self._update_webview()
 
-        if mlx_cls is not None:
-            self.eric_chat_class = mlx_cls
-        else:
-            self._set_status("ERROR: EricChatMLX is not compatible. Please ensure you have installed 'mlx-lm'.")
+        if self.eric_chat_class is None:
+            self._set_status(backend_error or "ERROR: No inference backend is available. Please ensure you have installed 'mlx-lm', or 'torch' on other hosts.")
             self._set_buttons(False, False)
 
         self.state.new_tokens = token_length_slider.value
@@ -240,6 +382,24 @@ class EricChat(toga.App):
 
         self.about_window = None
 
+    def on_exit(self):
+        # flush whatever the write-behind journal still holds
+        if self.state.journal is not None:
+            self.state.journal.close()
+        self.thinking_server.close()
+        # stop at the next token or progress report, a load in the middle of reading the model is waited for
+        self.tasks.cancel()
+        self.tasks.wait_idle(timeout=10)
+        self.tasks.shutdown()
+        self._unload_model()
+        if self.tracer.enabled:
+            if self.lag_monitor is not None:
+                self.lag_monitor.stop()
+            if self.profiler is not None:
+                self.profiler.stop()
+            self.tracer.dump(Path(self.trace_path))
+        return True
+
     def _customize_about_command(self):
         try:
             about_cmd = self.commands[toga.Command.ABOUT]
@@ -305,16 +465,18 @@ class EricChat(toga.App):
         about_window.show()
 
     def _render_chat_html(self) -> str:
-        return render_html(self.state)
+        return render_html(self.state, thinking_url=self.thinking_server.url)
 
-    def _update_webview(self):
-        html = self._render_chat_html()
-        self.web.set_content("http://127.0.0.1/", html)
+    def _thinking_text(self, convo_id: int, node_id: int) -> Optional[str]:
+        # on a server thread, committed traces aren't changed anymore
+        return self.state.thinking_text(convo_id, node_id)
 
-    def _run_in_thread(self, target, *args, **kwargs):
-        t = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
-        t.start()
-        return t
+    def _update_webview(self):
+        with self.tracer.span("render_html"):
+            html = self._render_chat_html()
+        with self.tracer.span("set_content", chars=len(html)):
+            # under the thinking server's origin, the page fetches traces from it
+            self.web.set_content(self.thinking_server.origin, html)
 
     def _with_ui(self, fn, *args, **kwargs):
         if self.ui_loop is not None:
@@ -331,7 +493,65 @@ class EricChat(toga.App):
 
     def update_sel_notice(self, widget):
         model_details = self.state.available_models[self.sel.value]
-        self._with_ui(self._set_notice_label, model_details.notice)
+        self._with_ui(self._set_notice_label, self._get_notice(model_details))
+        self._prefetch_model(model_details)
+
+    def _prefetch_model(self, model_details: ModelDetails):
+        # the load of a picked model then finds its weights in memory. Not while the model is busy, and
+        # only when the weights fit twice: in the page cache and loaded
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+            self.prefetch = None
+        if (not model_details.is_downloaded or self.tasks.busy(LOAD, GENERATE)
+                or model_details.short_name == self.state.current_short_name):
+            return
+        files = weight_files(model_details.save_path)
+        if files and fits_in_memory(files):
+            self.prefetch = Prefetcher(files, workers=2).start()
+
+    def _model_profile(self, model_details: ModelDetails):
+        if self.eric_chat_class is None or not model_details.is_downloaded:
+            return None
+        revision = installed_revision(model_details.save_path) or "unknown"
+        return self.profiles.get(self.eric_chat_class.name, model_details.short_name, revision)
+
+    def _model_rss(self) -> int:
+        # the loaded model's memory, not the app's: its worker's RSS, or how much this process grew since the load started
+        if isinstance(self.eric, ProcessChatBackend):
+            return PeakMemory(pid=self.eric.pid).sample()
+        return max(0, PeakMemory().sample() - self.rss_before_load)
+
+    def _required_gb(self, model_details: ModelDetails) -> float:
+        if self.eric_chat_class is None or not model_details.is_downloaded:
+            return model_details.required_memory
+        revision = installed_revision(model_details.save_path) or "unknown"
+        return self.profiles.required_gb(model_details, self.eric_chat_class.name, revision)
+
+    def _recommendation(self) -> str:
+        if self.eric_chat_class is None:
+            return ""
+        models = list(self.state.available_models.values())
+        revisions = {m.short_name: installed_revision(m.save_path) or "unknown" for m in models if m.is_downloaded}
+        best = self.profiles.recommend(models, self.eric_chat_class.name, self.available_gb, revisions)
+        if best is None:
+            return ""
+        return f"Fastest that fits: {best.short_name}, {round(self._model_profile(best).decode_tps, 1)} tokens/s"
+
+    def _get_notice(self, model_details: ModelDetails) -> str:
+        notice = model_details.notice
+        profile = self._model_profile(model_details)
+        if profile is not None and profile.summary():
+            notice = f"\n    Measured on this machine: {profile.summary()}\n" + notice
+        if self.eric_chat_class is not None and model_details.is_downloaded:
+            estimate = self.eric_chat_class.estimate_memory(model_details.save_path)
+            if estimate:
+                notice = f"\n    Estimated memory on this machine: ~{round(estimate, 1)} GB\n" + notice
+        usage = self.model_store.disk_usage().get(model_details.hf_id)
+        if usage:
+            gb = 1024 * 1024 * 1024
+            notice = (f"\n    On disk: {round(usage['bytes'] / gb, 2)} GB, {round(usage['unique_bytes'] / gb, 2)} GB not shared"
+                      f" with other models, {usage['revisions']} revision(s)\n") + notice
+        return notice
 
     def _set_buttons(self, enabled: bool, select_model: bool = False):
         try:
@@ -363,14 +583,28 @@ class EricChat(toga.App):
         self.progress_rest.style.flex = 100
 
     def _apply_stream_piece_ui(self, piece):
-        self.state.stream_step(piece)
+        with self.tracer.span("stream_step"):
+            self.state.stream_step(piece)
+        if self.state.should_update_ui:
+            self._update_webview()
+
+    def _apply_candidate_piece_ui(self, index, piece):
+        with self.tracer.span("stream_step"):
+            self.state.candidate_step(index, piece)
         if self.state.should_update_ui:
             self._update_webview()
 
     def _finish_stream_ui(self):
+        cancelled = self.state.cancel_inference
+        candidates = len(self.state.candidate_streams)
         self.state.finish_chat()
         self._update_webview()
-        self._set_status("Ready.")
+        if cancelled and self.state.last_cancel_latency is not None:
+            self._set_status(f"Cancelled in {round(self.state.last_cancel_latency * 1000)} ms.")
+        elif candidates > 1:
+            self._set_status(f"Ready. {candidates} answers, ◀ and ▶ switch between them.")
+        else:
+            self._set_status("Ready.")
         self._set_buttons(True, True)
         self._with_ui(self._adjust_send_button_text, "Submit")
 
@@ -380,26 +614,80 @@ class EricChat(toga.App):
         self._set_status(f"Error: {e}")
         self._set_buttons(True, True)
 
+    def _on_task_event(self, event: TaskEvent):
+        # the one channel from the background tasks to the UI, called on the UI thread in submission order
+        if event.kind == DOWNLOAD:
+            self._update_download_row(event)
+            if event.state == FAILED:
+                self._set_status(f"{TASK_FAILED[DOWNLOAD]}: {event.error}")
+            return
+
+        if event.state == RUNNING and event.message:
+            self._set_progress(max(event.progress, 0) * 100, event.message)
+
+        if event.kind == GENERATE:
+            if event.state == CANCELLED and not self.state.cancel_inference:
+                # superseded by a model load, not the cancel button
+                self.state.cancel_inference = True
+            if event.state in FINISHED:
+                self._finish_stream_ui()
+            if event.state == FAILED:
+                self._error_ui(event.error)
+            return
+
+        if event.kind in (VERIFY, LOAD):
+            if event.kind == LOAD and event.state == RUNNING:
+                self._set_buttons(False, True)
+            if event.state == CANCELLED:
+                self._set_progress(0, f"Cancelled {event.kind}")
+            elif event.state == FAILED:
+                self._set_status(f"{TASK_FAILED[event.kind]}: {event.error}")
+            # a finished verify hands over to the load, which keeps the buttons off
+            if event.state in (CANCELLED, FAILED) or (event.kind == LOAD and event.state in FINISHED):
+                self._set_buttons(True, True)
+            return
+
+        if event.state == FAILED:
+            self._set_status(f"Failed to {event.name}: {event.error}")
+
+    def _update_download_row(self, event: TaskEvent):
+        active = self.tasks.active(DOWNLOAD)
+        if not active:
+            self.download_row.style.visibility = HIDDEN
+            self.download_label.text = ""
+            # the next download starts running
+            self.downloads.resume()
+            self.pause_download_btn.text = "Pause"
+            if event.state == CANCELLED:
+                self._set_status(f"Cancelled the download of {event.name}.")
+            return
+        self.download_row.style.visibility = VISIBLE
+        if event.state == RUNNING and event.message:
+            queued = f" (+{len(active) - 1} queued)" if len(active) > 1 else ""
+            paused = " Paused." if self.downloads.paused else ""
+            self.download_label.text = f"{event.message}{queued}{paused}"
+
     def remove_button_header_row(self):
         self.button_header_row.remove(self.releases_row)
 
     def _unload_model(self):
         old = self.eric
         self.eric = None
+        self.loaded_model_id = ""
+        self.loaded_profile = None
 
         if old is not None:
             try:
-                old.model = None
-                old.tokenizer = None
-                old.text_streamer_handler = None
+                # for a ProcessChatBackend this ends the child process
+                old.unload()
                 del old
             except Exception as e:
                 self._with_ui(self._error_ui, e)
         gc.collect()
         gc.collect()
 
-    def _do_inference(self, messages_snapshot):
-        # Grab the model pointer safely, then release the lock
+    def _do_inference(self, task, messages_snapshot):
+        # a generate task: on the model worker, so self.eric can't change until it returns
 
         def _remove_releases():
             if self.releases_row in self.button_header_row.children:
@@ -407,168 +695,310 @@ class EricChat(toga.App):
 
         self._with_ui(_remove_releases)
 
-        with self.eric_lock:
-            model = self.eric
-
+        model = self.eric
         if model is None:
-            self._with_ui(self._set_status, "Select a model.")
-            self._with_ui(self._set_buttons, True, True)
-            return
+            raise RuntimeError("Select a model.")
+        # takes effect at the next prefill chunk or token
+        task.token.on_cancel(model.cancel)
+
+        prefill = PrefillProgress()
+        speed = StreamSpeed()
+        kv_note = self._kv_note(messages_snapshot)
+
+        def _on_prefill(processed, total):
+            prefill.update(processed, total)
+            speed.on_prefill(processed, total)
+            if task.token.cancelled:
+                # a cancel that came before stream() started was cleared by it
+                model.cancel()
+            if processed >= total:
+                task.report(1.0, "Generating..." + kv_note)
+            else:
+                task.report(prefill.pct / 100, prefill.status() + kv_note)
+
+        args = self._call_args()
+        # checks for repetition loops on this thread, the UI thread only sees the pieces. Fed a
+        # segment of WATCHDOG_SEGMENT pieces at a time, a loop is caught at most that many pieces later
+        watchdog = self.state.new_watchdog()
+        messages = messages_snapshot
+        steered = False
+
+        recorder = None
+        if self.record_dir is not None:
+            trace_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.state.current_short_name.replace('/', '_')}.jsonl"
+            recorder = StreamRecorder(self.record_dir / trace_name, backend=model.name, model=self.state.current_short_name)
+
+        cache_key = cached = cache_recorder = None
+        if self.state.use_cache and self.loaded_model_id and GenerationCache.is_deterministic(args):
+            cache_key = self.generation_cache.key(self.loaded_model_id, messages_snapshot, args)
+            cached = self.generation_cache.lookup(cache_key)
+            if cached is None:
+                cache_recorder = self.generation_cache.recorder(cache_key, model=self.loaded_model_id)
+            self.tracer.counter("generation cache", **{k: self.generation_cache.stats()[k] for k in ("hits", "misses")})
 
         try:
-            # Do NOT hold eric_lock while streaming; just use the model
-            for piece in model.stream(messages_snapshot, args=CHATCallArgs(max_len=self.state.max_len,
-                                                                           top_k=self.state.top_k,  # always 0. We only adjust temperature and top_p
-                                                                           temp=self.state.temp,
-                                                                           top_p=self.state.top_p
-                                                                           )):
-                if self.state.cancel_inference:
-                    return
-                # Schedule each piece to the UI thread
-                self._with_ui(self._apply_stream_piece_ui, piece)
-
-        except Exception as e:
-            self._with_ui(self._error_ui, e)
+            while True:
+                loop = None
+                segment, segment_marker = [], ""
+                if cached is not None:
+                    stream = self.generation_cache.replay(cached)
+                else:
+                    stream = model.stream(messages, args=args, prefill_step_size=self.state.prefill_step_size,
+                                          on_prefill=_on_prefill)
+                try:
+                    for piece in stream:
+                        task.token.raise_if_cancelled()
+                        if recorder is not None:
+                            recorder.record(piece)
+                        if cache_recorder is not None:
+                            cache_recorder.record(piece)
+                        self.tracer.instant("piece", marker=piece.marker)
+                        speed.on_piece(piece.marker)
+                        # Schedule each piece to the UI thread
+                        self._with_ui(self._apply_stream_piece_ui, piece)
+
+                        if watchdog is not None:
+                            if segment and (piece.marker != segment_marker or len(segment) >= WATCHDOG_SEGMENT):
+                                loop = watchdog.feed_segment(segment, segment_marker)
+                                segment = []
+                                if loop is not None and self.state.watchdog_action(loop) != "off":
+                                    break
+                                loop = None
+                            segment.append(piece.text)
+                            segment_marker = piece.marker
+                finally:
+                    # stops the backend if the watchdog broke out early
+                    stream.close()
+
+                if loop is None:
+                    if cache_recorder is not None and not steered:
+                        # only complete answers to the original messages are reused
+                        self.generation_cache.commit(cache_key, cache_recorder)
+                        cache_recorder = None
+                    if cached is None and self.loaded_profile is not None:
+                        # RSS right after the answer, with the KV cache at its largest
+                        self.profiles.record_generation(*self.loaded_profile, speed, self._model_rss() / (1024 ** 3))
+                    break
+                if self.state.watchdog_action(loop) == "steer" and not steered:
+                    # restart once with a nudge, a second loop is stopped
+                    steered = True
+                    self._with_ui(self.state.steer_for_repetition, loop)
+                    self._with_ui(self._set_status, "Repeating, asking for an answer...")
+                    messages = messages_snapshot + [{"role": "user", "content": STEER_PROMPT}]
+                    watchdog.reset()
+                    continue
+                self._with_ui(self.state.stop_for_repetition, loop)
+                break
+
+        except InferenceCancelled:
             return
+        except Exception as e:
+            if not model.is_alive():
+                self.eric = None
+                raise RuntimeError(f"{e} Please load the model again.") from e
+            raise
         finally:
-            # Always finalize on the UI thread
-            self._with_ui(self._finish_stream_ui)
-
-    def _switch_to_cancel_button(self):
-        self.load_hf_btn.text = "Cancel"
-        self.load_hf_btn.on_press = self.on_cancel_download
-
-    def _switch_to_select_model_button(self):
-        self.load_hf_btn.text = "Model"
-        self.load_hf_btn.on_press = self.on_load_model
-        self.cancel_download = False
-
-    def _load_model(self, model_details: ModelDetails):
-
-        self.state.current_short_name = model_details.short_name
-
-        self._with_ui(self._set_model_name, model_details.short_name)
-
-        self.check_redownload = False # for debugging
-
-        if not model_details.is_downloaded or self.check_redownload:
-
-            fs = HfFileSystem()
-            # list remote files (use a fixed revision if you want determinism)
-            entries = fs.find(model_details.hf_id, revision="main", detail=True)  # dict[rpath] -> info
-
-            exists, missing, wrong_size = [], [], []
-            fetch_total = 0
-
-            for rpath, info in entries.items():
-                base = Path(rpath).name
-                file_path = model_details.save_path / base
-                expected_size = int((info or {}).get("size", 0) or 0)
-
-                if file_path.is_file():
-                    actual_size = file_path.stat().st_size
-                    if expected_size and expected_size != actual_size:
-                        wrong_size.append([rpath, base, expected_size])  # keep remote path for fetch
-                        fetch_total += expected_size
-                    else:
-                        exists.append([rpath, base, expected_size])
-                else:
-                    missing.append([rpath, base, expected_size])
-                    fetch_total += expected_size
-
-            fetch_files = missing + wrong_size
-
-            fetch_total_gb = round(fetch_total/(1024*1024*1024), 3)
-            try:
-                self._with_ui(self._switch_to_cancel_button)
-                disable_progress_bars()
-                self._with_ui(self._reset_progress)
-                self._with_ui(self._set_status, "Downloading: ")
-
-                lock = threading.Lock()
-                download_state = {"downloaded": 0}
-                per_file_prev = {}
-
-                for rpath, base, size in fetch_files:
-                    lpath = str(model_details.save_path / base)
-
-                    per_file_prev[base] = 0  # reset per-file cursor
-
-                    def set_progress(n, total, label=base):
-                        if self.cancel_download:
-                            self._with_ui(self._set_progress, 0, "Cancelled download")
-                            raise Exception("")
-
-                        # accumulate deltas across all files
-                        with lock:
-                            prev = per_file_prev.get(label, 0)
-                            delta = n - prev if n >= prev else n  # guard if n resets
-                            per_file_prev[label] = n
-                            download_state["downloaded"] += delta
-
-                            pct = int(download_state["downloaded"] * 100 / fetch_total) if fetch_total else 0
-
-                            gb = round(download_state["downloaded"]/(1024*1024*1024), 3)
-
-                        self._with_ui(self._set_progress, pct, f"Downloading: {pct}%. {gb} GB / {fetch_total_gb} GB")
-
-                    fs.get_file(
-                        rpath=rpath,  # full remote path
-                        lpath=lpath,  # local file (basename)
-                        callback=BytesCallback(partial(set_progress, label=base)),
-                        revision="main",
-                        chunk_size=8 * 1024 * 1024,
-                    )
-
-                # Ensure progress bar reaches 100%
-                if fetch_total and not self.cancel_download:
-                    self._with_ui(
-                        self._set_progress, 100,
-                        f"Downloading: 100% — {fetch_total_gb} GB / {fetch_total_gb} GB"
-                    )
-
-            except Exception as e:
-                if self.cancel_download:
-                    self._with_ui(self._set_status, "Cancelled Download")
-                else:
-                    self._with_ui(self._set_status, f"Failed to download: {e}")
-
-                self._with_ui(self._set_buttons, True, True)
-
-                return
-            finally:
-                self._with_ui(self._switch_to_select_model_button)
-                pass
-        else:
-            pass
-
+            if recorder is not None:
+                recorder.close()
+            if cache_recorder is not None:
+                self.generation_cache.discard(cache_recorder)
+
+    def _do_candidates(self, task, messages):
+        # a generate task like _do_inference, for state.candidates answers at once. Without the
+        # watchdog, recording and cache: candidates are sampled, a loop in one doesn't stop the others.
+        model = self.eric
+        if model is None:
+            raise RuntimeError("Select a model.")
+        task.token.on_cancel(model.cancel)
+        n = len(self.state.candidate_streams)
+
+        prefill = PrefillProgress()
+        # the prompt's cache is repeated for every answer
+        kv_note = self._kv_note(messages, n)
+
+        def _on_prefill(processed, total):
+            prefill.update(processed, total)
+            if task.token.cancelled:
+                model.cancel()
+            if processed >= total:
+                task.report(1.0, f"Generating {n} answers..." + kv_note)
+            else:
+                task.report(prefill.pct / 100, prefill.status() + kv_note)
 
+        args = self._call_args()
+        stream = model.stream_candidates(messages, args, n, prefill_step_size=self.state.prefill_step_size,
+                                         on_prefill=_on_prefill)
         try:
-            self._set_buttons(False, True)
-
-            with self.eric_lock:
-                self._with_ui(self._set_status, "Initializing...")
-
-                self._unload_model()
-                self.eric = self.eric_chat_class(model_name=str(model_details.save_path))
-
-                if not model_details.is_downloaded:
-                    details_payload = {"model_name": model_details.hf_id}
-                    model_details.details_path.write_text(json.dumps(details_payload, ensure_ascii=False, indent=2), encoding="utf-8")
-                    self.state.update_available_models_datasets()
-
-            self.state.chosen_hf_model = model_details.name.replace("🔗", "💾")
-            self._with_ui(self._set_progress, 100, "Ready")
-
-
+            for index, piece in stream:
+                task.token.raise_if_cancelled()
+                self.tracer.instant("piece", marker=piece.marker)
+                self._with_ui(self._apply_candidate_piece_ui, index, piece)
+        except InferenceCancelled:
+            return
         except Exception as e:
-            self._with_ui(self._set_status, f"Failed to initialize: {e}")
+            if not model.is_alive():
+                self.eric = None
+                raise RuntimeError(f"{e} Please load the model again.") from e
+            raise
         finally:
-            self._with_ui(self._set_buttons, True, True)
+            stream.close()
+
+    def _download_model(self, task, model_details: ModelDetails):
+        disable_progress_bars()
+        # what the Hub's main branch resolved to is reused for a day, a retried download gets the same files
+        source = get_model_source(store=self.model_store)
+        verb = "Downloading" if isinstance(source, HubSource) else f"Installing from {source.describe()}"
+        task.report(0, f"{verb}: ")
+
+        def set_progress(done, total):
+            # raising here is how a fetch in the middle of a file stops
+            task.token.raise_if_cancelled()
+            pct = int(done * 100 / total) if total else 0
+            gb = round(done/(1024*1024*1024), 3)
+            total_gb = round(total/(1024*1024*1024), 3)
+            speed = f", {round(self.downloads.speed / (1024 * 1024), 1)} MB/s" if self.downloads.speed else ""
+            task.report(done / total if total else 0,
+                        f"{verb} {model_details.short_name}: {pct}%. {gb} GB / {total_gb} GB{speed}")
+
+        # the details file is only written once every file is verified. Paused and throttled in the gate,
+        # a cancelled download continues where it stopped the next time
+        self.downloads.start()
+        try:
+            with self.tracer.span("install model", model=model_details.short_name, source=source.name):
+                install_model(source, model_details.hf_id, model_details.save_path, self.model_store, on_progress=set_progress,
+                              gate=lambda n: self.downloads.gate(n, task.token))
+        finally:
+            self.downloads.finish()
+        self.state.update_available_models_datasets()
+        # only loaded right away when that doesn't replace a model that is in use
+        if self.eric is None and not self.tasks.busy(VERIFY, LOAD):
+            self.tasks.submit(LOAD, self._load_model, model_details, name=model_details.short_name)
+        else:
+            self._with_ui(self._set_status, f"{model_details.short_name} is downloaded, select it to load it.")
+
+    def _verify_model(self, task, model_details: ModelDetails):
+        # an installed model whose files went missing (a cleaned store, a moved folder) fails here instead of in the backend
+        task.report(0, "Checking model files...")
+        revision = installed_revision(model_details.save_path)
+        manifest = self.model_store.read_manifest(model_details.hf_id, revision) if revision else None
+        if manifest is not None:
+            files = [SourceFile(name, f["size"], f["sha256"]) for name, f in manifest["files"].items()]
+            problems = verify_install(model_details.save_path, files)
+            if problems:
+                raise RuntimeError("; ".join(problems) + ". Please install the model again.")
+        task.token.raise_if_cancelled()
+        self.tasks.submit(LOAD, self._load_model, model_details, name=model_details.short_name)
+
+    def _load_model(self, task, model_details: ModelDetails):
+        # a load task: on the model worker, the generate tasks before it have finished and none runs until it returns
+        self.state.current_short_name = model_details.short_name
+        self._with_ui(self._set_model_name, model_details.short_name)
+        task.report(-1, "Initializing...")
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+
+        with self.tracer.span("unload model"):
+            self._unload_model()
+        task.token.raise_if_cancelled()
+        backend_kwargs = self._draft_kwargs(model_details)
+        start = time.perf_counter()
+        # read: the weights go into the page cache on several threads, the backend reads them one file
+        # after another and this way reads from memory. Fast when the model was prefetched when picked
+        files = weight_files(model_details.save_path)
+        if backend_kwargs:
+            files += weight_files(backend_kwargs["draft_model_name"])
+        read = None
+        if files and fits_in_memory(files):
+            gb = 1024 ** 3
+
+            def read_progress(done, total):
+                task.report(done / total, f"Reading {model_details.short_name}: {round(done / gb, 2)} GB / {round(total / gb, 2)} GB")
+
+            read = Prefetcher(files, on_progress=read_progress)
+            task.token.on_cancel(read.cancel)
+            with self.tracer.span("read weights", model=model_details.short_name, bytes=read.total):
+                read.run()
+            task.token.raise_if_cancelled()
+        read_seconds = time.perf_counter() - start
+
+        # initialize: the backend deserializes the weights and materializes them in its own memory
+        task.report(-1, "Initializing...")
+        with self.tracer.span("load model", model=model_details.short_name), PeakMemory() as memory:
+            if self.isolate_model:
+                self.eric = ProcessChatBackend(self.eric_chat_class, model_name=str(model_details.save_path), **backend_kwargs)
+            else:
+                self.eric = self.eric_chat_class(model_name=str(model_details.save_path), **backend_kwargs)
+        load_seconds = time.perf_counter() - start
+        revision = installed_revision(model_details.save_path) or "unknown"
+        draft = backend_kwargs.get("draft_model_name", "")
+        self.loaded_model_id = f"{self.eric_chat_class.name}:{model_details.short_name}@{revision}" + (f"+{Path(draft).name}" if draft else "")
+        if not draft:
+            # with a draft model the numbers would describe the pair, not the model
+            self.loaded_profile = (self.eric_chat_class.name, model_details.short_name, revision)
+            self.profiles.record_load(*self.loaded_profile, load_seconds, memory.growth / (1024 ** 3))
+        self.rss_before_load = memory.start
+
+        self.state.chosen_hf_model = model_details.name.replace("🔗", "💾")
+        phases = f"initialize {round(load_seconds - read_seconds, 1)} s"
+        if read is not None:
+            phases = f"read {round(read_seconds, 1)} s at {round(read.gb_per_second, 1)} GB/s, " + phases
+        task.report(1.0, f"Ready. Loaded in {round(load_seconds, 1)} s ({phases})")
+
+    def _draft_kwargs(self, model_details: ModelDetails) -> dict:
+        if not (self.state.speculative and self.eric_chat_class.supports_draft and model_details.draft_short_name):
+            return {}
+        for draft in self.state.available_models.values():
+            if draft.short_name == model_details.draft_short_name and draft.is_downloaded:
+                # a pair that would never decode speculatively isn't worth the draft's memory
+                if not (trimmable_kv_cache(model_details.save_path) and trimmable_kv_cache(draft.save_path)):
+                    return {}
+                return {"draft_model_name": str(draft.save_path)}
+        return {}
+
+    def _call_args(self) -> KVCallArgs:
+        kv_bits, max_kv_size = KV_CACHE_MODES[self.state.kv_cache]
+        if not (self.eric_chat_class and self.eric_chat_class.supports_kv_cache):
+            kv_bits = max_kv_size = None
+        return KVCallArgs(max_len=self.state.max_len,
+                          top_k=self.state.top_k,  # always 0. We only adjust temperature and top_p
+                          temp=self.state.temp,
+                          top_p=self.state.top_p,
+                          kv_bits=kv_bits,
+                          max_kv_size=max_kv_size)
+
+    def _kv_estimate(self, messages=None) -> float:
+        # GB of KV cache for the conversation and a full length answer with the loaded model, 0 when unknown
+        if self.eric is None or self.eric_chat_class is None:
+            return 0.0
+        if messages is None:
+            chars = sum(len(m.text) for m in self.state.convo_history)
+        else:
+            chars = sum(len(str(m.get("content", ""))) for m in messages)
+        for model_details in self.state.available_models.values():
+            if model_details.short_name == self.state.current_short_name:
+                return self.eric_chat_class.estimate_kv_memory(model_details.save_path, chars // CHARS_PER_TOKEN + self.state.max_len,
+                                                               self._call_args())
+        return 0.0
+
+    def _kv_note(self, messages, n: int = 1) -> str:
+        # added to the prefill and generating status, a cache that won't fit is what makes a big model swap
+        gb = self._kv_estimate(messages) * n
+        if gb < 0.05:
+            return ""
+        if gb > get_memory():
+            return f". KV cache up to ~{round(gb, 1)} GB, more than the free memory: a smaller KV cache setting avoids swapping"
+        return f". KV cache up to ~{round(gb, 1)} GB"
+
+    def _update_kv_label(self):
+        gb = self._kv_estimate() * self.state.candidates
+        self.kv_label.text = f"~{round(gb, 2)} GB for this conversation" if gb else ""
 
     def on_submit(self, widget):
         if self.state.in_inference:
-            self.state.cancel_inference = True
+            self.state.request_cancel()
+            # the token cancels the backend, which stops at the next prefill chunk or token
+            self.tasks.cancel(GENERATE)
+            self._set_status("Cancelling...")
             return
 
         text = (self.input_field.value or "").strip()
@@ -583,10 +1013,18 @@ class EricChat(toga.App):
             self._set_status("Please select a model.")
 
         # Update UI (UI thread)
-        messages = self.state.user_input(text)  # build stable snapshot
+        messages = None
+        if self.editing_index is not None and self.editing_index < len(self.state.convo_history):
+            messages = self.state.edit_message(self.editing_index, text)
+        self.editing_index = None
+        if messages is None:
+            messages = self.state.user_input(text)  # build stable snapshot
         self.build_convo_history()
         self.input_field.value = ""
 
+        self._start_inference(messages)
+
+    def _start_inference(self, messages):
         self._update_webview()
         if self.eric is None:
             self._set_status("Error: no model loaded")
@@ -594,15 +1032,68 @@ class EricChat(toga.App):
 
         self._set_status("Generating...")
         self._set_buttons(False, True)
+        # a prefetch would compete with the model for the disk and memory
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+
+        # the task only does model.stream, the pieces and its events come back to the UI thread
+        if self.state.candidates > 1:
+            self.state.start_candidates(self.state.candidates)
+            self.tasks.submit(GENERATE, self._do_candidates, messages)
+            return
+        self.tasks.submit(GENERATE, self._do_inference, messages)
 
-        # Background thread only does model.stream, not UI
-        self._run_in_thread(self._do_inference, messages)
+    def on_regenerate(self, widget):
+        if self.state.in_inference:
+            return
+        if self.eric is None:
+            self._set_status("Please select a model.")
+            return
+        messages = self.state.regenerate()
+        if messages is None:
+            self._set_status("Nothing to regenerate.")
+            return
+        self._with_ui(self._adjust_send_button_text, "Cancel")
+        self.state.in_inference = True
+        self._start_inference(messages)
+
+    def on_edit_last(self, widget):
+        if self.state.in_inference:
+            return
+        index = self.state.last_index("user")
+        if index is None:
+            return
+        self.editing_index = index
+        self.input_field.value = self.state.convo_history[index].text
+        self._set_status("Editing the last prompt, submit to branch.")
+
+    def on_switch_branch(self, step, widget):
+        if self.state.in_inference:
+            return
+        index = self.state.branch_point()
+        if index is not None and self.state.switch_branch(index, step):
+            self.editing_index = None
+            self.build_convo_history()
+            self._update_webview()
 
     def on_cancel_download(self, widget):
-        self.cancel_download = True
+        # the running download and the queued ones, what was downloaded is kept for the next time
+        self.tasks.cancel(DOWNLOAD)
+
+    def on_pause_download(self, widget):
+        if self.downloads.paused:
+            self.downloads.resume()
+            self.pause_download_btn.text = "Pause"
+            self.download_label.text = self.download_label.text.replace(" Paused.", "")
+        else:
+            self.downloads.pause()
+            self.pause_download_btn.text = "Resume"
+            self.download_label.text += " Paused."
+
+    def on_download_limit(self, selection):
+        self.downloads.max_bytes_per_second = DOWNLOAD_LIMITS.get(selection.value, 0)
 
     def _load_model_press(self, widget):
-        self.cancel_download = False
         self._with_ui(lambda: self.on_load_model(""))
 
         model_name = self.sel.value
@@ -615,15 +1106,21 @@ class EricChat(toga.App):
             return
 
         model_details = self.state.available_models[model_name]
+
+        self.check_redownload = False # for debugging
+        # download (when needed) -> verify or load: each step submits the next one when it's done.
+        # Downloads queue up on their own lane and leave the loaded model and the buttons alone.
+        if not model_details.is_downloaded or self.check_redownload:
+            if any(task.name == model_details.short_name for task in self.tasks.active(DOWNLOAD)):
+                self._set_status(f"{model_details.short_name} is already downloading.")
+                return
+            self.tasks.submit(DOWNLOAD, self._download_model, model_details, name=model_details.short_name)
+            self._set_status(f"Downloading {model_details.short_name}, you can keep chatting.")
+            return
+
         self._with_ui(self._set_progress, 0, f"Loading model: {model_name}...")
         self._set_buttons(False, False)
-
-        def _run():
-            try:
-                self._load_model(model_details)
-            finally:
-                pass
-        threading.Thread(target=_run, daemon=True).start()
+        self.tasks.submit(VERIFY, self._verify_model, model_details, name=model_details.short_name)
 
 
     def on_load_model(self, widget):
@@ -634,14 +1131,16 @@ class EricChat(toga.App):
         models = self.state.available_models
         model_names = []
 
+        # a model that ran here before needs what it took then, see ProfileStore.required_gb
+        required = {model_name: self._required_gb(model_details) for model_name, model_details in models.items()}
         for model_name, model_details in models.items():
-            if model_details.required_memory < self.available_gb:
+            if required[model_name] < self.available_gb:
                 model_names.append(model_name)
             else:
                 pass
 
         if len(model_names) == 0:
-            minimal_required_gb = min(md.required_memory for md in models.values())
+            minimal_required_gb = round(min(required.values()), 1)
             self._set_status(f"Not enough memory. Only {round(self.available_gb, 2)} GB are available. {minimal_required_gb} GB are required.")
             return
 
@@ -652,7 +1151,7 @@ class EricChat(toga.App):
 
         self.sel.value = self.state.chosen_hf_model
 
-        notice = self.state.available_models[self.state.chosen_hf_model].notice
+        notice = self._get_notice(self.state.available_models[self.state.chosen_hf_model])
         self._with_ui(self._set_notice_label, notice)
 
 
@@ -660,10 +1159,12 @@ class EricChat(toga.App):
 
         if self.eric is None:
             self.available_gb = get_memory()
-            self.memory_label.text = f"{round(self.available_gb, 2)} GB of available memory"
+        recommendation = self._recommendation()
+        if self.eric is None:
+            self.memory_label.text = f"{round(self.available_gb, 2)} GB of available memory" + (f". {recommendation}" if recommendation else "")
         else:
-            # no longer accurate after changes the model
-            self.memory_label.text = ""
+            # no longer accurate after changes the model, the recommendation uses the last value without a model
+            self.memory_label.text = recommendation
 
 
         self._change_header("")
@@ -700,6 +1201,7 @@ class EricChat(toga.App):
 
         # bring up model settings
         else:
+            self._update_kv_label()
             self.right_pane.insert(0, self.model_settings_drop_down)
             self.right_pane.remove(self.button_header_row)
             self.right_pane.remove(self.progress)
@@ -709,7 +1211,16 @@ class EricChat(toga.App):
         webbrowser.open_new_tab(url)
 
     def build_convo_history(self):
+        with self.tracer.span("build_convo_history", convos=len(self.state.convo_histories)):
+            self._build_convo_history()
+
+    def _build_convo_history(self):
         self.chat_column.clear()
+
+        if self.search_query:
+            self.build_search_results()
+            return
+
         self.chat_column.add(toga.Button("New Convo", on_press=self.new_convo, style=Pack(flex=1, margin_top=8, margin_bottom=8, margin_left=4, margin_right=4,
                                                                                           background_color=EricColours.ERIC_RED)))
         buttons = []
@@ -744,12 +1255,52 @@ class EricChat(toga.App):
                                                                                                background_color=EricColours.ERIC_DARK_SILVER))
             self.chat_column.add(increase_count_button)
 
+    def build_search_results(self):
+        results = self.state.search(self.search_query, limit=self.show_message_count)
+        if not self.state.search_ready.is_set():
+            self.chat_column.add(toga.Label("Still indexing older chats…", style=Pack(margin=8, color=EricColours.LIGHT_RED)))
+        if self.state.search_truncated:
+            words = ", ".join(f'"{token}"' for token in self.state.search_truncated)
+            self.chat_column.add(toga.Label(f"Only the most common words starting with {words} were searched, type more letters",
+                                            style=Pack(margin=8, color=EricColours.LIGHT_RED)))
+        if not results:
+            self.chat_column.add(toga.Label("No matches", style=Pack(margin=8, color=EricColours.LIGHT_RED)))
+            return
+
+        for convo_index, node_id, snippet in results:
+            current_chat = self.state.current_convo_index == convo_index
+            result_button = toga.Button(snippet[:24] or "…", on_press=partial(self.open_search_result, convo_index, node_id),
+                                        style=Pack(flex=1, margin_top=8, margin_left=4, margin_right=4,
+                                                   background_color=EricColours.ERIC_RED if not current_chat else EricColours.DARK_RED_L))
+            self.chat_column.add(result_button)
+
+    def _on_search_ready(self):
+        # the restored chats are searchable now, redo a search typed before that
+        if self.search_query:
+            self.build_convo_history()
+
+    def on_search(self, widget):
+        self.search_query = (widget.value or "").strip()
+        self.build_convo_history()
+
+    def open_search_result(self, index, node_id, widget):
+        self.state.change_convo(index, node_id)
+        self.build_convo_history()
+        self._with_ui(self._jump_webview)
+
+    def _jump_webview(self):
+        self._update_webview()
+        # only the first render after a search result scrolls to the match
+        self.state.jump_to_message = None
+
     def new_convo(self, widget):
+        self.editing_index = None
         self.state.new_convo()
         self.build_convo_history()
         self._with_ui(self._update_webview)
 
     def change_convo(self, index, widget):
+        self.editing_index = None
         self.state.change_convo(index)
         self.build_convo_history()
         self._with_ui(self._update_webview)
@@ -764,6 +1315,50 @@ class EricChat(toga.App):
         self.build_convo_history()
         self._with_ui(self._update_webview)
 
+    def _archive_progress(self, task, verb: str, count: int, done: int, total: int):
+        task.report(done / total if total else 0, f"{verb}: {count} messages")
+
+    async def on_export(self, widget):
+        path = await self.main_window.dialog(toga.SaveFileDialog("Export conversations", suggested_filename="ericchat_conversations.jsonl",
+                                                                 file_types=["jsonl", "zst"]))
+        if path is None:
+            return
+
+        def _export(task):
+            count = write_archive(path, self.state.iter_messages(), progress=partial(self._archive_progress, task, "Exporting"))
+            task.report(1.0, f"Exported {count} messages")
+
+        self.tasks.submit(IO, _export, name="export")
+
+    async def on_import(self, widget):
+        path = await self.main_window.dialog(toga.OpenFileDialog("Import conversations", file_types=["jsonl", "zst"]))
+        if path is None:
+            return
+
+        key_map = {}
+        # at most two parsed chunks wait for the UI thread, so memory stays bounded for any archive size
+        in_flight = threading.Semaphore(2)
+
+        def _apply(chunk):
+            try:
+                self.state.import_messages(chunk, key_map)
+            finally:
+                in_flight.release()
+
+        def _import(task):
+            try:
+                # chunks are parsed here and appended on the UI thread
+                for chunk in read_archive(path, progress=partial(self._archive_progress, task, "Importing"),
+                                          thinking_max_chars=self.state.thinking_max_chars,
+                                          thinking_strategy=self.state.thinking_strategy):
+                    in_flight.acquire()
+                    self._with_ui(_apply, chunk)
+                task.report(1.0, f"Imported {len(key_map)} conversations")
+            finally:
+                self._with_ui(self.build_convo_history)
+
+        self.tasks.submit(IO, _import, name="import")
+
     def see_more(self, widget):
         self.show_message_count += 32
         self.build_convo_history()
@@ -772,9 +1367,58 @@ class EricChat(toga.App):
         self.state.set_creativity(slider.value)
         self.creativity_label.text = f"Creativity: {round(slider.value)}"
 
+    def on_candidates_slider(self, slider):
+        self.state.candidates = int(round(slider.value))
+        self.candidates_label.text = f"Candidates: {self.state.candidates}"
+        self._update_kv_label()
+
+    def on_kv_cache(self, widget):
+        self.state.kv_cache = widget.value
+        self._update_kv_label()
+
+    def on_speculative_switch(self, switch):
+        self.state.speculative = bool(switch.value)
+
+    def on_cache_switch(self, switch):
+        self.state.use_cache = bool(switch.value)
+
+    def _get_retriever(self) -> Retriever:
+        if self.retriever is None:
+            embedder = get_embedder()
+            index = VectorIndex(self.paths.data / "documents", embedder.dim, embedder=embedder.name)
+            self.retriever = Retriever(index, embedder)
+        return self.retriever
+
+    def on_documents_switch(self, switch):
+        if not switch.value:
+            self.state.retriever = None
+            return
+        retriever = self._get_retriever()
+        if not len(retriever.index):
+            self._set_status("Add a folder of documents first.")
+        self.state.retriever = retriever
+
+    async def on_add_documents(self, widget):
+        path = await self.main_window.dialog(toga.SelectFolderDialog("Add a folder of documents"))
+        if path is None:
+            return
+        retriever = self._get_retriever()
+
+        def _ingest(task):
+            def progress(files, chunks):
+                task.report(-1, f"Reading documents: {files} files, {chunks} passages")
+
+            stats = ingest(retriever.index, retriever.embedder, [Path(path)], progress=progress,
+                           should_stop=lambda: task.token.cancelled)
+            task.report(1.0, f"Added {stats['files']} files ({stats['chunks']} passages), {stats['skipped']} unchanged")
+
+        self.tasks.submit(IO, _ingest, name="add documents")
+        self.documents_switch.value = True
+
     def on_token_length_slider(self, slider):
         self.state.set_token_length(slider.value)
         self.token_length_label.text = f"Length: {self.state.max_len}" +  " " * self.token_length_spaces
+        self._update_kv_label()
 
     def _adjust_send_button_text(self, text: str):
         self.send_btn.text = text
@@ -787,7 +1431,15 @@ def main():
     )
 
 
-def run():
+def run(backend: str = "", record: str = "", trace: str = "", profile: bool = False):
+    if backend:
+        os.environ[BACKEND_ENV] = backend
+    if record:
+        os.environ[RECORD_ENV] = record
+    if trace:
+        os.environ[TRACE_ENV] = trace
+    if profile:
+        os.environ[PROFILE_ENV] = "1"
     main().main_loop()
 
 
@@ -0,0 +1,8 @@
+from .base import ChatBackend, InferenceCancelled, KVCallArgs
+from .cpu import CPUChatBackend
+from .fake import FakeChatBackend
+from .mlx import MLXChatBackend
+from .process import ProcessChatBackend
+from .replay import REPLAY_SPEED_ENV, ReplayChatBackend
+from .registry import (BACKEND_ENV, BACKENDS, available_backends,
+                       choose_backend, register_backend)
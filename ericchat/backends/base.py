@@ -0,0 +1,101 @@
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from ..util import (KV_GROUP_SIZE, WEIGHT_SUFFIXES, kv_cache_bytes,
+                    read_kv_shape)
+
+PrefillCallback = Callable[[int, int], None]  # (prompt tokens processed, prompt tokens total)
+
+
+class InferenceCancelled(Exception):
+    pass
+
+
+@dataclass(kw_only=True)
+class KVCallArgs(CHATCallArgs):
+    # CHATCallArgs with the KV cache options of the backends that have them (supports_kv_cache), one or the other:
+    #   kv_bits      keys and values quantized to 8 or 4 bits in groups of kv_group_size
+    #   max_kv_size  a rotating cache of the first ATTENTION_SINKS and the last tokens, the ones between are dropped
+    kv_bits: Optional[int] = None
+    kv_group_size: int = KV_GROUP_SIZE
+    max_kv_size: Optional[int] = None
+
+
+class ChatBackend:
+    # Base class for everything _do_inference can stream from:
+    #   load()             construct the backend for a model folder (the constructor does the work)
+    #   stream()           CHATStreamResult pieces for a list of chat messages
+    #   stream_candidates() (candidate index, piece) for n sampled answers to the same messages
+    #   cancel()           may be called from any thread, stream() raises InferenceCancelled at the next
+    #                      cancel point: between prefill chunks and between generated tokens
+    #   unload()           release the model
+    #   estimate_memory()  GB needed to run a downloaded model, before loading it
+    #   estimate_kv_memory() GB of KV cache a generation of that many tokens needs with these args
+    # Pieces may carry numbers for the TPS chip in payload["telemetry"], e.g. draft acceptance.
+    name = "base"
+    # True when the constructor takes a draft_model_name for speculative decoding
+    supports_draft = False
+    # multiplier on the size of the weights for activations, KV cache and runtime overhead
+    memory_overhead = 1.15
+    # True when stream() applies the options of KVCallArgs
+    supports_kv_cache = False
+
+    def __init__(self):
+        self.cancel_event = threading.Event()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return False
+
+    @classmethod
+    def load(cls, model_name: str, **kwargs) -> "ChatBackend":
+        return cls(model_name=model_name, **kwargs)
+
+    @classmethod
+    def estimate_memory(cls, model_path: Path) -> float:
+        model_path = Path(model_path)
+        if not model_path.is_dir():
+            return 0.0
+        weights = sum(f.stat().st_size for f in model_path.iterdir() if f.suffix in WEIGHT_SUFFIXES)
+        return weights * cls.memory_overhead / (1024 * 1024 * 1024)
+
+    @classmethod
+    def estimate_kv_memory(cls, model_path: Path, tokens: int, args: Optional[CHATCallArgs] = None) -> float:
+        # 0 when the model's config doesn't say. Without supports_kv_cache the options don't apply
+        shape = read_kv_shape(model_path)
+        if shape is None:
+            return 0.0
+        if not cls.supports_kv_cache or args is None:
+            return kv_cache_bytes(shape, tokens) / (1024 * 1024 * 1024)
+        return kv_cache_bytes(shape, tokens, kv_bits=getattr(args, "kv_bits", None),
+                              max_kv_size=getattr(args, "max_kv_size", None),
+                              group_size=getattr(args, "kv_group_size", KV_GROUP_SIZE)) / (1024 * 1024 * 1024)
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        raise NotImplementedError
+
+    def stream_candidates(self, messages: List[dict], args: CHATCallArgs, n: int, prefill_step_size: int = 512,
+                          on_prefill: Optional[PrefillCallback] = None) -> Iterator[Tuple[int, CHATStreamResult]]:
+        # one after another, backends that can decode a batch share the prefill and step all n together
+        for index in range(n):
+            for piece in self.stream(messages, args, prefill_step_size=prefill_step_size,
+                                     on_prefill=on_prefill if index == 0 else None):
+                yield index, piece
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise InferenceCancelled()
+
+    def is_alive(self) -> bool:
+        return True
+
+    def unload(self):
+        pass
@@ -0,0 +1,120 @@
+import importlib.util
+import threading
+from typing import Iterator, List, Optional
+
+import psutil
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from .base import ChatBackend, PrefillCallback
+
+
+def _get_cancel_criteria(cancel_event: threading.Event):
+    from transformers import StoppingCriteria
+
+    class CancelCriteria(StoppingCriteria):
+        # checked by generate() after every token
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancel_event.is_set()
+
+    return CancelCriteria()
+
+
+class CPUChatBackend(ChatBackend):
+    # transformers on the CPU through erictransformer's EricChat, for hosts without MLX.
+    # num_threads defaults to the number of physical cores, hyper-threads rarely help matmuls.
+    name = "cpu"
+    memory_overhead = 1.3
+
+    def __init__(self, model_name: str, num_threads: Optional[int] = None):
+        super().__init__()
+        import torch
+        from erictransformer import EricChat
+
+        self.num_threads = num_threads or psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+        torch.set_num_threads(self.num_threads)
+
+        self.eric = EricChat(model_name=model_name)
+        self.eric.model.to("cpu")
+        self.eric.model.eval()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return all(importlib.util.find_spec(name) is not None for name in ("torch", "transformers"))
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        import torch
+        from erictransformer.eric_tasks.chat_templates import map_chat_roles
+        from erictransformer.eric_tasks.misc import format_messages, generate_gen_kwargs
+        from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+        self.cancel_event.clear()
+        eric = self.eric
+
+        mapped_messages = map_chat_roles(messages=format_messages(messages),
+                                         model_name=eric.eric_args.model_name,
+                                         model_type=eric.model_type)
+        prompt = eric.tokenizer.apply_chat_template(mapped_messages, add_generation_prompt=True, tokenize=False)
+        if eric.model_type == "gpt_oss":
+            # always think, same as EricChatMLX
+            prompt += "<|channel|>analysis<|message|>"
+            for token in ("<|channel|>", "analysis", "<|message|>"):
+                stream_result = eric.text_streamer_handler.step(token)
+                if stream_result:
+                    yield stream_result
+
+        input_ids = eric.tokenizer(prompt, return_tensors="pt").input_ids
+        total = int(input_ids.shape[-1])
+        # transformers prefills in one pass, so progress can only be reported at the start and the end
+        if on_prefill is not None:
+            on_prefill(0, total)
+
+        streamer = TextIteratorStreamer(eric.tokenizer, skip_prompt=True, skip_special_tokens=False)
+        gen_kwargs = generate_gen_kwargs(input_ids=input_ids,
+                                         attention_mask=torch.ones_like(input_ids),
+                                         streamer=streamer,
+                                         args=args,
+                                         eos_token_id=eric.eos_token_id,
+                                         pad_token_id=eric.pad_token_id)
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList([_get_cancel_criteria(self.cancel_event)])
+
+        error = []
+
+        def _generate():
+            try:
+                with torch.inference_mode():
+                    eric.model.generate(**gen_kwargs)
+            except Exception as e:
+                error.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=_generate, daemon=True)
+        thread.start()
+        first = True
+        try:
+            for text in streamer:
+                if first and on_prefill is not None:
+                    on_prefill(total, total)
+                first = False
+                self.check_cancelled()
+                # the stream handlers work on single tokens, same as EricChat.stream
+                for token in eric.tokenizer.encode(text, add_special_tokens=False):
+                    stream_result = eric.text_streamer_handler.step(eric.tokenizer.decode(token))
+                    if stream_result:
+                        yield stream_result
+        finally:
+            if thread.is_alive():
+                # stops generate() at the next token when the caller stopped early
+                self.cancel_event.set()
+            thread.join()
+
+        if error:
+            raise error[0]
+
+    def unload(self):
+        eric = self.eric
+        self.eric = None
+        if eric is not None:
+            eric.model = None
+            eric.tokenizer = None
+            eric.text_streamer_handler = None
@@ -0,0 +1,89 @@
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from .base import ChatBackend, PrefillCallback
+
+
+class FakeChatBackend(ChatBackend):
+    # Deterministic stand-in for a model: counts one prompt token per word, sleeps to simulate
+    # prefill and decode speed, then streams a fixed thinking trace and answer.
+    # Decoding is bound by reading the weights, so a step of a batch of n candidates costs
+    # 1 + batch_cost * (n - 1) single steps.
+    name = "fake"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @classmethod
+    def estimate_memory(cls, model_path) -> float:
+        return 0.0
+
+    def __init__(self, model_name: str = "fake", prefill_tps: float = 4000.0, decode_tps: float = 200.0,
+                 thinking: str = "Let me think about this.", answer: str = "This is a fake answer.",
+                 batch_cost: float = 0.1):
+        super().__init__()
+        self.model_name = model_name
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.thinking = thinking
+        self.answer = answer
+        self.batch_cost = batch_cost
+
+    def prompt_tokens(self, messages: List[dict]) -> int:
+        return sum(len(str(m.get("content", "")).split()) + 4 for m in messages)
+
+    def _sleep(self, seconds: float):
+        # not interruptible, like a prefill chunk running on the GPU, cancel is only seen afterwards
+        if seconds > 0:
+            time.sleep(seconds)
+        self.check_cancelled()
+
+    def _prefill(self, messages: List[dict], prefill_step_size: int, on_prefill: Optional[PrefillCallback]):
+        total = self.prompt_tokens(messages)
+        processed = 0
+        if on_prefill is not None:
+            on_prefill(processed, total)
+        while processed < total:
+            step = min(prefill_step_size, total - processed)
+            self._sleep(step / self.prefill_tps if self.prefill_tps else 0)
+            processed += step
+            if on_prefill is not None:
+                on_prefill(processed, total)
+
+    def _pieces(self, candidate: int = 0) -> List[CHATStreamResult]:
+        # candidate n answers with the words rotated by n, same length, different text
+        words = self.answer.split()
+        if words:
+            shift = candidate % len(words)
+            words = words[shift:] + words[:shift]
+        pieces = [CHATStreamResult(text="", marker="think_start", payload={})]
+        pieces += [CHATStreamResult(text=word + " ", marker="thinking", payload={}) for word in self.thinking.split()]
+        pieces.append(CHATStreamResult(text="", marker="think_end", payload={}))
+        pieces += [CHATStreamResult(text=word + " ", marker="text", payload={}) for word in words]
+        return pieces
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        self.cancel_event.clear()
+        self._prefill(messages, prefill_step_size, on_prefill)
+
+        for piece in self._pieces()[:args.max_len]:
+            self._sleep(1 / self.decode_tps if self.decode_tps else 0)
+            yield piece
+
+    def stream_candidates(self, messages: List[dict], args: CHATCallArgs, n: int, prefill_step_size: int = 512,
+                          on_prefill: Optional[PrefillCallback] = None) -> Iterator[Tuple[int, CHATStreamResult]]:
+        # one prefill, then every step decodes one token of each candidate
+        self.cancel_event.clear()
+        self._prefill(messages, prefill_step_size, on_prefill)
+
+        candidates = [self._pieces(index)[:args.max_len] for index in range(n)]
+        step_seconds = (1 + self.batch_cost * (n - 1)) / self.decode_tps if self.decode_tps else 0
+        for step in range(max(len(pieces) for pieces in candidates)):
+            self._sleep(step_seconds)
+            for index, pieces in enumerate(candidates):
+                if step < len(pieces):
+                    yield index, pieces[step]
@@ -0,0 +1,284 @@
+import copy
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from ..util import (ATTENTION_SINKS, DraftController, SpeculativeModel,
+                    get_eric_chat_mlx, speculative_generate)
+from .base import ChatBackend, PrefillCallback
+
+
+def _make_cache(model, args: Optional[CHATCallArgs] = None) -> list:
+    # The model's prompt cache with the KV options of args (KVCallArgs) applied to its full attention
+    # layers. Built here rather than by mlx-lm, which ignores max_kv_size for models with their own
+    # make_cache (gpt-oss) and can't quantize the rotating caches of their sliding window layers.
+    from mlx_lm.models import cache
+
+    prompt_cache = cache.make_prompt_cache(model)
+    kv_bits = getattr(args, "kv_bits", None)
+    max_kv_size = getattr(args, "max_kv_size", None)
+    if kv_bits and max_kv_size:
+        raise ValueError("A KV cache can be quantized or bounded, not both.")
+    if not kv_bits and not max_kv_size:
+        return prompt_cache
+    for i, layer_cache in enumerate(prompt_cache):
+        if type(layer_cache) is not cache.KVCache:
+            continue
+        if kv_bits:
+            prompt_cache[i] = cache.QuantizedKVCache(group_size=args.kv_group_size, bits=kv_bits)
+        else:
+            prompt_cache[i] = cache.RotatingKVCache(max_size=max_kv_size, keep=ATTENTION_SINKS)
+    return prompt_cache
+
+
+def _can_trim_after(prompt_cache: list, n: int) -> bool:
+    # True while every layer can still drop positions after n more are fed. A rotating cache (e.g.
+    # gpt-oss's sliding window layers) can't once it holds max_size, trimming it would silently do nothing
+    from mlx_lm.models import cache
+
+    for layer_cache in prompt_cache:
+        if isinstance(layer_cache, cache.RotatingKVCache):
+            if layer_cache.offset + n >= layer_cache.max_size:
+                return False
+        elif not layer_cache.is_trimmable():
+            return False
+    return True
+
+
+class _MLXSpeculativeModel(SpeculativeModel):
+    # an mlx-lm model and its KV cache as one side of speculative_generate()
+    def __init__(self, model, sampler, prefill_step_size: int = 512,
+                 on_chunk: Optional[Callable[[int, int], None]] = None, prompt_cache: Optional[list] = None):
+        self.model = model
+        self.sampler = sampler
+        self.prefill_step_size = prefill_step_size
+        self.on_chunk = on_chunk
+        self.cache = prompt_cache if prompt_cache is not None else _make_cache(model)
+
+    def prefill(self, tokens: Sequence[int]):
+        import mlx.core as mx
+
+        y = mx.array(list(tokens), mx.uint32)
+        total = y.size
+        processed = 0
+        while y.size:
+            n = min(self.prefill_step_size, y.size)
+            self.model(y[:n][None], cache=self.cache)
+            mx.eval([c.state for c in self.cache])
+            y = y[n:]
+            processed += n
+            mx.clear_cache()
+            if self.on_chunk is not None:
+                self.on_chunk(processed, total)
+
+    def step(self, tokens: Sequence[int], n_predict: int = 1) -> List[int]:
+        import mlx.core as mx
+
+        logits = self.model(mx.array(list(tokens), mx.uint32)[None], cache=self.cache)
+        logits = logits[0, -n_predict:, :]
+        logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+        return self.sampler(logprobs).tolist()
+
+    def can_trim(self, n: int) -> bool:
+        return _can_trim_after(self.cache, n)
+
+    def trim(self, n: int):
+        from mlx_lm.models import cache
+
+        if n > 0:
+            trimmed = cache.trim_prompt_cache(self.cache, n)
+            if trimmed != n:
+                raise RuntimeError(f"Trimmed {trimmed} of {n} positions from the KV cache")
+
+
+class MLXChatBackend(ChatBackend):
+    # EricChatMLX, streamed through mlx-lm directly so the prompt is prefilled in
+    # prefill_step_size chunks with a progress/cancel point after each one.
+    # With a draft model the answer is decoded speculatively, see util/speculative.py.
+    # Candidates share one prefill: the prompt's KV cache is repeated n times and decoded as a batch.
+    # The KV options of KVCallArgs apply to plain and candidate streams, speculative decoding trims
+    # its caches and keeps them full.
+    name = "mlx"
+    supports_draft = True
+    supports_kv_cache = True
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return bool(get_eric_chat_mlx())
+
+    def __init__(self, model_name: str, draft_model_name: Optional[str] = None):
+        super().__init__()
+        eric_chat_class = get_eric_chat_mlx()
+        if not eric_chat_class:
+            raise RuntimeError("EricChatMLX is not compatible. Please ensure you have installed 'mlx-lm'.")
+        self.eric = eric_chat_class(model_name=model_name)
+
+        self.draft_model = None
+        self.draft_controller = DraftController()
+        if draft_model_name:
+            from mlx_lm import load
+
+            draft_model, draft_tokenizer = load(draft_model_name)
+            # drafts are checked token by token, so both models have to share a vocabulary
+            if draft_tokenizer.get_vocab() != self.eric.tokenizer.get_vocab():
+                raise ValueError("The draft model uses a different tokenizer than the model.")
+            self.draft_model = draft_model
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        from erictransformer.eric_tasks.misc import format_messages
+        from mlx_lm import stream_generate
+
+        self.cancel_event.clear()
+        eric = self.eric
+
+        sampler, prompt = eric._get_streamer_prompt(messages=format_messages(messages), args=args)
+
+        # tokens EricChatMLX injects itself, e.g. gpt-oss's analysis channel
+        while eric.to_stream_tokens:
+            stream_result = eric.to_stream_tokens.pop(0)
+            if stream_result:
+                yield stream_result
+
+        def _progress(processed: int, total: int):
+            # called by mlx-lm between prefill chunks, raising here aborts the prefill
+            self.check_cancelled()
+            if on_prefill is not None:
+                on_prefill(processed, total)
+
+        speculating = self.draft_model is not None and self._can_speculate(prompt, args.max_len)
+        if speculating:
+            segments = self._speculative_segments(prompt, sampler, args.max_len, prefill_step_size, _progress)
+        else:
+            segments = (resp.text for resp in stream_generate(eric.model,
+                                                              eric.tokenizer,
+                                                              prompt,
+                                                              max_tokens=args.max_len,
+                                                              sampler=sampler,
+                                                              prompt_cache=_make_cache(eric.model, args),
+                                                              prefill_step_size=prefill_step_size,
+                                                              prompt_progress_callback=_progress))
+
+        for text in segments:
+            self.check_cancelled()
+            stream_result = eric.text_streamer_handler.step(text)
+            if stream_result:
+                if speculating:
+                    stream_result.payload["telemetry"] = self.draft_controller.telemetry()
+                yield stream_result
+
+    def _prompt_tokens(self, prompt: str) -> List[int]:
+        tokenizer = self.eric.tokenizer
+        add_special_tokens = tokenizer.bos_token is None or not prompt.startswith(tokenizer.bos_token)
+        return tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+
+    def _can_speculate(self, prompt: str, max_tokens: int) -> bool:
+        # Rejected drafts are trimmed from both caches, which has to work until the last token. Models
+        # with sliding window layers (gpt-oss) can't once the context passes the window, they decode plainly.
+        n = len(self._prompt_tokens(prompt)) + max_tokens
+        return _can_trim_after(_make_cache(self.eric.model), n) and _can_trim_after(_make_cache(self.draft_model), n)
+
+    def _speculative_segments(self, prompt: str, sampler, max_tokens: int, prefill_step_size: int,
+                              progress: PrefillCallback) -> Iterator[str]:
+        # the same text segments stream_generate would yield, decoded with the draft model
+        eric = self.eric
+        tokenizer = eric.tokenizer
+        tokens = self._prompt_tokens(prompt)
+
+        # only the target's prefill is reported, the draft's chunks are cancel points
+        target = _MLXSpeculativeModel(eric.model, sampler, prefill_step_size, on_chunk=progress)
+        draft = _MLXSpeculativeModel(self.draft_model, sampler, prefill_step_size,
+                                     on_chunk=lambda processed, total: self.check_cancelled())
+
+        self.draft_controller.reset_stats()
+        detokenizer = tokenizer.detokenizer
+        detokenizer.reset()
+        for token, _ in speculative_generate(target, draft, tokens, max_tokens, self.draft_controller,
+                                             check_cancelled=self.check_cancelled):
+            if token in tokenizer.eos_token_ids:
+                break
+            detokenizer.add_token(token)
+            yield detokenizer.last_segment
+        detokenizer.finalize()
+        yield detokenizer.last_segment
+
+    def stream_candidates(self, messages: List[dict], args: CHATCallArgs, n: int, prefill_step_size: int = 512,
+                          on_prefill: Optional[PrefillCallback] = None) -> Iterator[Tuple[int, CHATStreamResult]]:
+        import mlx.core as mx
+        from erictransformer.eric_tasks.misc import format_messages
+        from mlx.utils import tree_map
+
+        self.cancel_event.clear()
+        eric = self.eric
+        tokenizer = eric.tokenizer
+
+        sampler, prompt = eric._get_streamer_prompt(messages=format_messages(messages), args=args)
+        injected = []
+        while eric.to_stream_tokens:
+            stream_result = eric.to_stream_tokens.pop(0)
+            if stream_result:
+                injected.append(stream_result)
+        # every candidate parses its own text, the handlers start where the prompt left eric's one
+        handlers = [copy.deepcopy(eric.text_streamer_handler, memo={id(tokenizer): tokenizer}) for _ in range(n)]
+        for index in range(n):
+            for stream_result in injected:
+                yield index, stream_result
+
+        def _progress(processed: int, total: int):
+            self.check_cancelled()
+            if on_prefill is not None:
+                on_prefill(processed, total)
+
+        add_special_tokens = tokenizer.bos_token is None or not prompt.startswith(tokenizer.bos_token)
+        tokens = tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+        target = _MLXSpeculativeModel(eric.model, sampler, prefill_step_size, on_chunk=_progress,
+                                      prompt_cache=_make_cache(eric.model, args))
+        target.prefill(tokens[:-1])
+        for layer_cache in target.cache:
+            # keys and values, or their quantized parts, scales and biases
+            layer_cache.state = tree_map(lambda x: mx.repeat(x, n, axis=0), layer_cache.state)
+
+        detokenizers = []
+        for _ in range(n):
+            detokenizer = copy.copy(tokenizer.detokenizer)
+            detokenizer.reset()
+            detokenizers.append(detokenizer)
+
+        # finished candidates stay in the batch until the last one ends, their tokens are dropped
+        active = [True] * n
+        y = mx.array([[tokens[-1]]] * n, mx.uint32)
+        for _ in range(args.max_len):
+            self.check_cancelled()
+            logits = eric.model(y, cache=target.cache)[:, -1, :]
+            logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+            sampled = sampler(logprobs)
+            y = sampled[:, None]
+            for index, token in enumerate(sampled.tolist()):
+                if not active[index]:
+                    continue
+                detokenizer = detokenizers[index]
+                if token in tokenizer.eos_token_ids:
+                    active[index] = False
+                    detokenizer.finalize()
+                else:
+                    detokenizer.add_token(token)
+                stream_result = handlers[index].step(detokenizer.last_segment)
+                if stream_result:
+                    yield index, stream_result
+            if not any(active):
+                return
+        for index in range(n):
+            if active[index]:
+                detokenizers[index].finalize()
+                stream_result = handlers[index].step(detokenizers[index].last_segment)
+                if stream_result:
+                    yield index, stream_result
+
+    def unload(self):
+        eric = self.eric
+        self.eric = None
+        self.draft_model = None
+        if eric is not None:
+            eric.model = None
+            eric.tokenizer = None
+            eric.text_streamer_handler = None
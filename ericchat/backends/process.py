@@ -0,0 +1,182 @@
+import multiprocessing
+import traceback
+from typing import Iterator, List, Optional, Tuple, Type
+
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from .base import ChatBackend, InferenceCancelled, PrefillCallback
+
+# Pipe protocol, every message is a small tuple.
+#   parent -> child: ("stream", messages, args, prefill_step_size, candidates) | ("exit",)
+#   child -> parent: ("ready", pid) | ("error", text) | ("prefill", processed, total)
+#                    | ("p", marker, text, telemetry, candidate) | ("done",) | ("cancelled",)
+# candidates is 0 for a plain stream(), n for stream_candidates().
+# Cancel doesn't go through the pipe: the child's backend uses a shared Event as its cancel_event,
+# so it is seen at the next cancel point even while the child is busy streaming.
+
+
+def _worker_main(conn, backend_class: Type[ChatBackend], model_name: str, backend_kwargs: dict, cancel_event):
+    try:
+        backend = backend_class(model_name=model_name, **backend_kwargs)
+        backend.cancel_event = cancel_event
+    except Exception as e:
+        conn.send(("error", f"{e}"))
+        return
+
+    conn.send(("ready", multiprocessing.current_process().pid))
+
+    def _on_prefill(processed, total):
+        conn.send(("prefill", processed, total))
+
+    while True:
+        try:
+            command = conn.recv()
+        except EOFError:
+            return
+
+        if command[0] == "exit":
+            return
+
+        if command[0] == "stream":
+            _, messages, args, prefill_step_size, candidates = command
+            try:
+                if candidates:
+                    pieces = backend.stream_candidates(messages, args, candidates, prefill_step_size=prefill_step_size,
+                                                       on_prefill=_on_prefill)
+                else:
+                    pieces = ((0, piece) for piece in backend.stream(messages, args, prefill_step_size=prefill_step_size,
+                                                                     on_prefill=_on_prefill))
+                for index, piece in pieces:
+                    # only the telemetry numbers cross the pipe, not the whole payload
+                    telemetry = piece.payload.get("telemetry") if isinstance(piece.payload, dict) else None
+                    conn.send(("p", piece.marker, piece.text, telemetry, index))
+                conn.send(("done",))
+            except InferenceCancelled:
+                conn.send(("cancelled",))
+            except Exception as e:
+                conn.send(("error", f"{e}\n{traceback.format_exc()}"))
+
+
+class ProcessChatBackend(ChatBackend):
+    # Runs another backend in a child process. Unloading terminates the process, so the OS gets every
+    # byte of the weights back, and a crash in the model takes down the child instead of the GUI.
+    name = "process"
+
+    def __init__(self, backend_class: Type[ChatBackend], model_name: str, load_timeout: Optional[float] = None, **backend_kwargs):
+        super().__init__()
+        self.backend_class = backend_class
+        self.name = f"{backend_class.name} (process)"
+        self.supports_draft = backend_class.supports_draft
+
+        ctx = multiprocessing.get_context("spawn")
+        # the child's cancel_event, shared so cancel() works without a round trip
+        self.cancel_event = ctx.Event()
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(child_conn, backend_class, model_name, backend_kwargs, self.cancel_event),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        message = self._recv(timeout=load_timeout)
+        if message[0] == "error":
+            self._stop()
+            raise RuntimeError(message[1])
+        self.pid = message[1]
+
+    def _recv(self, timeout: Optional[float] = None):
+        # poll in short steps so a dead child is noticed instead of blocking forever
+        waited = 0.0
+        while not self.conn.poll(0.25):
+            waited += 0.25
+            if not self.process.is_alive():
+                raise self._exited_error()
+            if timeout is not None and waited >= timeout:
+                raise TimeoutError("The model process did not respond in time.")
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            raise self._exited_error()
+
+    def _exited_error(self) -> RuntimeError:
+        self.process.join(1)
+        return RuntimeError(f"The model process exited unexpectedly (exit code {self.process.exitcode}).")
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        pieces = self._pieces(messages, args, 0, prefill_step_size, on_prefill)
+        try:
+            for _, piece in pieces:
+                yield piece
+        finally:
+            pieces.close()
+
+    def stream_candidates(self, messages: List[dict], args: CHATCallArgs, n: int, prefill_step_size: int = 512,
+                          on_prefill: Optional[PrefillCallback] = None) -> Iterator[Tuple[int, CHATStreamResult]]:
+        return self._pieces(messages, args, n, prefill_step_size, on_prefill)
+
+    def _pieces(self, messages: List[dict], args: CHATCallArgs, candidates: int, prefill_step_size: int,
+                on_prefill: Optional[PrefillCallback]) -> Iterator[Tuple[int, CHATStreamResult]]:
+        self.cancel_event.clear()
+        try:
+            self.conn.send(("stream", messages, args, prefill_step_size, candidates))
+        except OSError:
+            raise self._exited_error()
+
+        finished = False
+        try:
+            while True:
+                message = self._recv()
+                kind = message[0]
+                if kind == "p":
+                    payload = {"telemetry": message[3]} if message[3] else {}
+                    yield message[4], CHATStreamResult(text=message[2], marker=message[1], payload=payload)
+                elif kind == "prefill":
+                    if on_prefill is not None:
+                        on_prefill(message[1], message[2])
+                elif kind == "done":
+                    finished = True
+                    return
+                elif kind == "cancelled":
+                    finished = True
+                    raise InferenceCancelled()
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(message[1])
+        finally:
+            if not finished and self.process.is_alive():
+                self._drain()
+
+    def _drain(self):
+        # the caller stopped reading early: stop the child and drop what it already sent
+        # so the next stream() starts from a clean pipe
+        self.cancel_event.set()
+        try:
+            while self._recv(timeout=30)[0] not in ("done", "cancelled", "error"):
+                pass
+        except (RuntimeError, TimeoutError):
+            pass
+
+    def is_alive(self) -> bool:
+        # False once the child crashed, the GUI then asks for the model to be loaded again
+        return self.process.is_alive()
+
+    def _stop(self, timeout: float = 5.0):
+        if self.process.is_alive():
+            try:
+                self.conn.send(("exit",))
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def unload(self):
+        # a streaming child only reads the pipe between generations, so stop the stream first
+        self.cancel_event.set()
+        self._stop()
@@ -0,0 +1,43 @@
+import os
+from typing import Dict, List, Optional, Type
+
+from .base import ChatBackend
+from .cpu import CPUChatBackend
+from .fake import FakeChatBackend
+from .mlx import MLXChatBackend
+from .replay import ReplayChatBackend
+
+BACKENDS: Dict[str, Type[ChatBackend]] = {}
+
+# tried in this order when no backend is asked for, fake and replay are only used when named
+AUTO_ORDER = ("mlx", "cpu")
+
+BACKEND_ENV = "ERICCHAT_BACKEND"
+
+
+def register_backend(backend_class: Type[ChatBackend]):
+    BACKENDS[backend_class.name] = backend_class
+
+
+def available_backends() -> List[str]:
+    return [name for name, backend_class in BACKENDS.items() if backend_class.is_available()]
+
+
+def choose_backend(override: Optional[str] = None) -> Optional[Type[ChatBackend]]:
+    # override, then $ERICCHAT_BACKEND, then the first available backend of AUTO_ORDER
+    name = override or os.environ.get(BACKEND_ENV, "")
+    if name:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+        return BACKENDS[name]
+
+    for name in AUTO_ORDER:
+        if BACKENDS[name].is_available():
+            return BACKENDS[name]
+    return None
+
+
+register_backend(MLXChatBackend)
+register_backend(CPUChatBackend)
+register_backend(FakeChatBackend)
+register_backend(ReplayChatBackend)
@@ -0,0 +1,60 @@
+import os
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from erictransformer import CHATCallArgs, CHATStreamResult
+
+from ..util import read_trace
+from .base import ChatBackend, PrefillCallback
+
+REPLAY_SPEED_ENV = "ERICCHAT_REPLAY_SPEED"
+
+
+class ReplayChatBackend(ChatBackend):
+    # Streams recorded traces (see util/stream_trace.py) instead of running a model, so the UI and
+    # state pipeline can be tuned on machines that can't run the real one.
+    # model_name is a trace file or a folder of them, each stream() plays the next trace in name order.
+    # speed 1 keeps the recorded timing, 2 plays twice as fast, 0 as fast as possible.
+    name = "replay"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @classmethod
+    def estimate_memory(cls, model_path) -> float:
+        return 0.0
+
+    def __init__(self, model_name: str, speed: Optional[float] = None):
+        super().__init__()
+        path = Path(model_name)
+        if path.is_dir():
+            self.traces = sorted(p for p in path.iterdir() if p.name.endswith((".jsonl", ".jsonl.zst")))
+        else:
+            self.traces = [path]
+        if not self.traces:
+            raise ValueError(f"No traces in {path}. Record some with ERICCHAT_RECORD set.")
+        self.speed = float(os.environ.get(REPLAY_SPEED_ENV, 1.0)) if speed is None else speed
+        self.next_trace = 0
+
+    def stream(self, messages: List[dict], args: CHATCallArgs, prefill_step_size: int = 512,
+               on_prefill: Optional[PrefillCallback] = None) -> Iterator[CHATStreamResult]:
+        self.cancel_event.clear()
+        trace = self.traces[self.next_trace % len(self.traces)]
+        self.next_trace += 1
+
+        if on_prefill is not None:
+            on_prefill(0, 1)
+        # sleep towards the recorded schedule rather than dt by dt, so sleep overshoot doesn't add up
+        due = time.monotonic()
+        for i, (dt, piece) in enumerate(read_trace(trace)):
+            if self.speed > 0:
+                due += dt / self.speed
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.cancel_event.wait(wait)
+            self.check_cancelled()
+            if i == 0 and on_prefill is not None:
+                on_prefill(1, 1)
+            yield piece
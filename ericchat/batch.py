@@ -0,0 +1,185 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from erictransformer import CHATCallArgs
+
+from .backends import ChatBackend, KVCallArgs
+from .util import PeakMemory
+
+# Runs a file of prompts through a backend without the GUI. One prompt per line:
+#   {"id": "q1", "prompt": "..."}  or  {"id": "q2", "messages": [{"role": "user", "content": "..."}]}
+# "id" defaults to the line number, "max_len", "temp" and "top_p" override the defaults per prompt.
+# Every result is appended to the output as soon as it's done, so a rerun skips what's already there.
+
+
+def read_prompts(path: Path) -> Iterator[Tuple[str, dict]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield str(record.get("id", line_number)), record
+
+
+def _messages(record: dict) -> List[dict]:
+    if "messages" in record:
+        return record["messages"]
+    return [{"role": "user", "content": record["prompt"]}]
+
+
+def finished_ids(output_path: Path) -> Set[str]:
+    # ids that already have a result. A line cut off by a crash is dropped so new results start on
+    # their own line, and failed prompts are run again.
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return set()
+
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+    done = set()
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in record:
+            done.add(str(record["id"]))
+    return done
+
+
+def _generate(backend: ChatBackend, record: dict, args: CHATCallArgs) -> dict:
+    start = time.perf_counter()
+    first = last = 0.0
+    tokens = 0
+    text, thinking = [], []
+    for piece in backend.stream(_messages(record), args):
+        now = time.perf_counter()
+        if piece.marker in ("text", "thinking"):
+            if tokens == 0:
+                first = now
+            last = now
+            tokens += 1
+            (text if piece.marker == "text" else thinking).append(piece.text)
+
+    seconds = time.perf_counter() - start
+    result = {
+        "text": "".join(text),
+        "tokens": tokens,
+        "ttft_s": first - start if tokens else None,
+        "seconds": seconds,
+        # decode speed: the first token is paid by the prefill
+        "tps": (tokens - 1) / (last - first) if tokens > 1 and last > first else 0.0,
+    }
+    if thinking:
+        result["thinking"] = "".join(thinking)
+    if tokens >= args.max_len:
+        result["stop_reason"] = "max_len"
+    return result
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def run_batch(backend_factory: Callable[[], ChatBackend], prompts_path: Path, output_path: Path, concurrency: int = 1,
+              max_len: int = 2048, temp: float = 0.7, top_p: float = 0.8, kv_bits: Optional[int] = None,
+              max_kv_size: Optional[int] = None, progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, float]:
+    # backend_factory is called once per worker. Each worker owns a backend, so concurrency > 1
+    # holds that many copies of the model: meant for small models and the fake backend.
+    done = finished_ids(output_path)
+    todo: "queue.Queue[Optional[Tuple[str, dict]]]" = queue.Queue(maxsize=concurrency * 2)
+    write_lock = threading.Lock()
+    stop = threading.Event()
+    results: List[dict] = []
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+
+    def feed():
+        # prompts are read as the workers need them, a big file is never held in memory
+        for prompt_id, record in read_prompts(prompts_path):
+            if prompt_id in done:
+                counts["skipped"] += 1
+                continue
+            todo.put((prompt_id, record))
+        for _ in range(concurrency):
+            todo.put(None)
+
+    def work(backend: ChatBackend, out):
+        while not stop.is_set():
+            item = todo.get()
+            if item is None:
+                return
+            prompt_id, record = item
+            args = KVCallArgs(max_len=int(record.get("max_len", max_len)), top_k=0,
+                              temp=float(record.get("temp", temp)), top_p=float(record.get("top_p", top_p)),
+                              kv_bits=kv_bits, max_kv_size=max_kv_size)
+            try:
+                result = dict(id=prompt_id, **_generate(backend, record, args))
+            except Exception as e:
+                if stop.is_set():
+                    return
+                result = {"id": prompt_id, "error": f"{type(e).__name__}: {e}"}
+
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                if "error" in result:
+                    counts["failed"] += 1
+                else:
+                    counts["done"] += 1
+                    results.append(result)
+                if progress is not None:
+                    progress(counts["done"] + counts["failed"], counts["skipped"])
+
+    backends = [backend_factory() for _ in range(concurrency)]
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with PeakMemory() as memory, open(output_path, "a", encoding="utf-8") as out:
+        start = time.perf_counter()
+        feeder = threading.Thread(target=feed, name="batch reader", daemon=True)
+        feeder.start()
+        workers = [threading.Thread(target=work, args=(backend, out), name=f"batch worker {i}", daemon=True)
+                   for i, backend in enumerate(backends)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # stop at the next token, the results written so far are kept for the next run
+            stop.set()
+            for backend in backends:
+                backend.cancel()
+            for worker in workers:
+                worker.join()
+            raise
+        feeder.join()
+        wall_seconds = time.perf_counter() - start
+    for backend in backends:
+        backend.unload()
+
+    tokens = sum(r["tokens"] for r in results)
+    ttfts = sorted(r["ttft_s"] * 1000 for r in results if r["ttft_s"] is not None)
+    tps = sorted(r["tps"] for r in results if r["tps"])
+    return {
+        "prompts": counts["done"],
+        "failed": counts["failed"],
+        "skipped": counts["skipped"],
+        "tokens": tokens,
+        "wall_seconds": wall_seconds,
+        "tokens_per_second": tokens / wall_seconds if wall_seconds else 0.0,
+        "decode_tps_p50": _percentile(tps, 0.5),
+        "ttft_p50_ms": _percentile(ttfts, 0.5),
+        "ttft_p90_ms": _percentile(ttfts, 0.9),
+        "ttft_p99_ms": _percentile(ttfts, 0.99),
+        "ttft_max_ms": ttfts[-1] if ttfts else 0.0,
+        "peak_rss_mb": memory.peak / (1024 * 1024),
+    }
+
@@ -0,0 +1,35 @@
+import gc
+import time
+from typing import Callable
+
+from erictransformer import CHATCallArgs
+
+from .backends import ChatBackend
+from .util import ModelProfile, PeakMemory, StreamSpeed
+
+# A short run that fills in a model's profile without waiting for normal use: one load, a prompt
+# long enough for a few prefill chunks and a fixed number of new tokens at the lowest creativity.
+CALIBRATION_PROMPT = ("Summarize the following notes in three sentences. "
+                      + " ".join(f"Note {i}: the meeting moved the release by {i % 7} days." for i in range(120)))
+
+
+def calibrate(load: Callable[[], ChatBackend], backend: str, model: str, revision: str,
+              max_len: int = 128, prefill_step_size: int = 512) -> ModelProfile:
+    gc.collect()
+    messages = [{"role": "user", "content": CALIBRATION_PROMPT}]
+    args = CHATCallArgs(max_len=max_len, top_k=0, temp=0.7, top_p=0)
+
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        chat = load()
+        load_seconds = time.perf_counter() - start
+        try:
+            speed = StreamSpeed()
+            for piece in chat.stream(messages, args, prefill_step_size=prefill_step_size, on_prefill=speed.on_prefill):
+                speed.on_piece(piece.marker)
+        finally:
+            chat.unload()
+
+    return ModelProfile(backend=backend, model=model, revision=revision, load_seconds=load_seconds,
+                        peak_rss_gb=memory.growth / (1024 ** 3), prefill_tps=speed.prefill_tps,
+                        decode_tps=speed.decode_tps, loads=1, generations=1)
@@ -0,0 +1,334 @@
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from .util import (ConvoJournal, DownloadControl, ModelStore, ProfileStore,
+                   available_model_factory, find_model, get_data_dir,
+                   get_journal_path, get_model_source, install_model,
+                   installed_revision, read_archive, write_archive)
+
+
+def _print_progress(count: int, done: int, total: int):
+    pct = f" {int(done * 100 / total)}%" if total else ""
+    print(f"\r{count} messages{pct}", end="", file=sys.stderr, flush=True)
+
+
+def _journal(args) -> ConvoJournal:
+    return ConvoJournal(get_journal_path(args.data_dir))
+
+
+def _run_export(args) -> int:
+    journal = _journal(args)
+    count = write_archive(args.path, journal.iter_messages(), progress=_print_progress)
+    print(f"\nExported {count} messages to {args.path}", file=sys.stderr)
+    return 0
+
+
+def _run_import(args) -> int:
+    journal = _journal(args)
+    next_id = journal.max_convo_id() + 1
+    key_map = {}
+    lengths = {}
+    count = 0
+
+    journal.start()
+    try:
+        for chunk in read_archive(args.path, chunk_size=args.chunk_size, progress=_print_progress):
+            for key, msg in chunk:
+                if key not in key_map:
+                    key_map[key] = next_id
+                    lengths[next_id] = 0
+                    journal.record_new(next_id)
+                    next_id += 1
+                convo_id = key_map[key]
+                journal.record_message(convo_id, lengths[convo_id], msg)
+                lengths[convo_id] += 1
+                count += 1
+    finally:
+        journal.close()
+
+    print(f"\nImported {count} messages in {len(key_map)} conversations", file=sys.stderr)
+    return 0
+
+
+def _run_replay(args) -> int:
+    from .replay import replay_trace
+
+    result = replay_trace(args.path, speed=args.speed, render=not args.no_render)
+    for key, value in result.items():
+        print(f"{key}: {round(value, 3) if isinstance(value, float) else value}")
+    return 0
+
+
+def _run_install(args) -> int:
+    models, _ = available_model_factory(args.data_dir / "models", backend=args.backend)
+    model_details = find_model(models, args.model)
+    if model_details is None or model_details.hf_id is None:
+        names = ", ".join(m.short_name for m in models.values() if m.hf_id)
+        print(f"Unknown model '{args.model}'. Choose one of: {names}", file=sys.stderr)
+        return 1
+
+    def progress(done: int, total: int):
+        pct = f" {int(done * 100 / total)}%" if total else ""
+        print(f"\r{round(done / 1024**3, 2)} GB{pct}", end="", file=sys.stderr, flush=True)
+
+    store = ModelStore(args.data_dir / "models" / "store")
+    source = get_model_source(args.source, store=store, refresh=args.refresh)
+    control = DownloadControl(max_bytes_per_second=int(args.limit_mb * 1024 * 1024))
+    result = install_model(source, model_details.hf_id, model_details.save_path, store,
+                           on_progress=progress, check_hashes=args.check_hashes, gate=control.gate)
+    print(f"\nInstalled {model_details.short_name} from {source.describe()} into {model_details.save_path}", file=sys.stderr)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+def _run_store(args) -> int:
+    store = ModelStore(args.data_dir / "models" / "store")
+    if args.gc:
+        try:
+            result = store.gc(dry_run=args.dry_run)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+        verb = "Would free" if args.dry_run else "Freed"
+        print(f"{verb} {round(result['bytes'] / 1024**3, 2)} GB: {result['blobs']} blobs, {result['revisions']} old revisions")
+    for repo_id, usage in store.disk_usage().items():
+        if repo_id:
+            print(f"{repo_id}: {round(usage['bytes'] / 1024**3, 2)} GB, {round(usage['unique_bytes'] / 1024**3, 2)} GB not shared, "
+                  f"{usage['revisions']} revision(s)")
+    total = store.disk_usage()[""]
+    print(f"total: {round(total['bytes'] / 1024**3, 2)} GB, {round(total['reclaimable_bytes'] / 1024**3, 2)} GB reclaimable with --gc")
+    return 0
+
+
+def _backend_and_model(args):
+    # the backend class and the installed ModelDetails for --backend and --model, (None, None) after printing why not
+    from .backends import choose_backend
+
+    backend_class = choose_backend(args.backend)
+    if backend_class is None:
+        print("No inference backend is available", file=sys.stderr)
+        return None, None
+    model_dir = args.data_dir / "models"
+    models, _ = available_model_factory(model_dir, backend=backend_class.name)
+    model_details = find_model(models, args.model)
+    if model_details is None:
+        print(f"Unknown model '{args.model}'. Choose one of: {', '.join(m.short_name for m in models.values())}", file=sys.stderr)
+        return None, None
+
+    if not model_details.is_downloaded:
+        store = ModelStore(model_dir / "store")
+        source = get_model_source(args.source, store=store)
+        print(f"Installing {model_details.short_name} from {source.describe()}", file=sys.stderr)
+        install_model(source, model_details.hf_id, model_details.save_path, store)
+    return backend_class, model_details
+
+
+def _run_batch(args) -> int:
+    from .batch import run_batch
+
+    backend_class, model_details = _backend_and_model(args)
+    if backend_class is None:
+        return 1
+
+    def progress(finished: int, skipped: int):
+        skipped_note = f", {skipped} already done" if skipped else ""
+        print(f"\r{finished} prompts{skipped_note}", end="", file=sys.stderr, flush=True)
+
+    output = args.output or args.prompts.with_name(args.prompts.stem + ".results.jsonl")
+    try:
+        result = run_batch(lambda: backend_class.load(model_name=str(model_details.save_path)), args.prompts, output,
+                           concurrency=args.concurrency, max_len=args.max_len, temp=args.temp, top_p=args.top_p,
+                           kv_bits=args.kv_bits, max_kv_size=args.max_kv_size, progress=progress)
+    except KeyboardInterrupt:
+        print("\nInterrupted, run the same command again to continue where it stopped", file=sys.stderr)
+        return 130
+    print(f"\nWrote {output}", file=sys.stderr)
+    for key, value in result.items():
+        print(f"{key}: {round(value, 3) if isinstance(value, float) else value}")
+    return 0
+
+
+def _run_leaks(args) -> int:
+    from .backends import ProcessChatBackend
+    from .leaks import model_cycles, session_cycles
+
+    backend_class, model_details = _backend_and_model(args)
+    if backend_class is None:
+        return 1
+    model_name = str(model_details.save_path)
+
+    def load():
+        # --isolate hosts the model in a child process like the app does, its RSS is counted too
+        if args.isolate:
+            return ProcessChatBackend(backend_class, model_name=model_name)
+        return backend_class.load(model_name=model_name)
+
+    limits = {"warmup": args.warmup, "max_growth_mb": args.max_growth_mb, "max_traced_mb": args.max_traced_mb}
+    reports = []
+    if args.model_cycles:
+        reports.append(model_cycles(load, cycles=args.model_cycles, **limits))
+    if args.session_cycles:
+        reports.append(session_cycles(cycles=args.session_cycles, **limits))
+
+    for report in reports:
+        print(f"{report.name}: {'ok' if report.passed else 'FAILED'}")
+        print(f"  cycles: {report.cycles}")
+        print(f"  rss: {round(report.rss_start_mb, 1)} MB -> {round(report.rss_end_mb, 1)} MB "
+              f"({round(report.rss_mb_per_cycle * 1024, 1)} KB per cycle)")
+        print(f"  python heap growth: {round(report.traced_growth_mb * 1024, 1)} KB")
+        if report.device_growth_mb is not None:
+            print(f"  mlx memory growth: {round(report.device_growth_mb, 1)} MB")
+        for site, size, count in report.top_sites:
+            print(f"    {round(size / 1024, 1)} KB in {count} blocks: {site}")
+    return 0 if all(report.passed for report in reports) else 1
+
+
+def _run_calibrate(args) -> int:
+    from .backends import ProcessChatBackend
+    from .calibrate import calibrate
+
+    backend_class, model_details = _backend_and_model(args)
+    if backend_class is None:
+        return 1
+    model_name = str(model_details.save_path)
+
+    def load():
+        if args.isolate:
+            return ProcessChatBackend(backend_class, model_name=model_name)
+        return backend_class.load(model_name=model_name)
+
+    revision = installed_revision(model_details.save_path) or "unknown"
+    profile = calibrate(load, backend_class.name, model_details.short_name, revision, max_len=args.max_len)
+    ProfileStore(args.data_dir / "model_profiles.json").record_calibration(profile)
+    print(f"{model_details.short_name} on {backend_class.name}: {profile.summary()}")
+    return 0
+
+
+def _run_docs(args) -> int:
+    from .util import Retriever, VectorIndex, get_embedder, ingest
+
+    embedder = get_embedder(args.embedder)
+    index = VectorIndex(args.data_dir / "documents", embedder.dim, embedder=embedder.name)
+    if args.action == "clear":
+        index.clear()
+        index.save()
+        print("Removed every document from the index", file=sys.stderr)
+        return 0
+
+    if args.action == "add":
+        def progress(files: int, chunks: int):
+            print(f"\r{files} files, {chunks} passages", end="", file=sys.stderr, flush=True)
+
+        stats = ingest(index, embedder, [Path(p) for p in args.args], progress=progress)
+        print(file=sys.stderr)
+        for key, value in stats.items():
+            print(f"{key}: {value}")
+        print(f"passages in the index: {len(index)}")
+        return 0
+
+    retriever = Retriever(index, embedder, k=args.k, min_score=0.0)
+    for hit in retriever.search([" ".join(args.args)])[0]:
+        print(f"{round(hit.score, 3)}  {hit.path}:{hit.line}")
+        print("    " + hit.text.strip()[:200].replace("\n", "\n    "))
+    return 0
+
+
+def _run_app(args) -> int:
+    from .app import run
+    run(args.backend, str(args.record or ""), str(args.trace or ""), args.profile)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m ericchat", description="Eric Chat command line tools. Run without arguments to open the app.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    app_parser = commands.add_parser("app", help="open the app with a specific inference backend")
+    app_parser.add_argument("--backend", default="", help="mlx, cpu, fake or replay. Picked automatically by default")
+    app_parser.add_argument("--record", type=Path, default=None, help="write a trace of every generation to this folder")
+    app_parser.add_argument("--trace", type=Path, default=None, help="write UI timings and loop lag to this Chrome trace file on exit")
+    app_parser.add_argument("--profile", action="store_true", help="add stack samples of the UI thread to --trace")
+    app_parser.set_defaults(func=_run_app)
+
+    data_dir = argparse.ArgumentParser(add_help=False)
+    data_dir.add_argument("--data-dir", type=Path, default=get_data_dir(), help="Eric Chat's data folder")
+
+    export_parser = commands.add_parser("export", parents=[data_dir], help="export all conversations to a .jsonl or .jsonl.zst archive")
+    export_parser.add_argument("path", type=Path)
+    export_parser.set_defaults(func=_run_export)
+
+    import_parser = commands.add_parser("import", parents=[data_dir], help="import an archive, close the app first")
+    import_parser.add_argument("path", type=Path)
+    import_parser.add_argument("--chunk-size", type=int, default=512)
+    import_parser.set_defaults(func=_run_import)
+
+    install_parser = commands.add_parser("install", parents=[data_dir], help="install a model from the Hub, a local folder, a Hugging Face cache or a mirror")
+    install_parser.add_argument("model", help="a model label such as 20B, or its repo id")
+    install_parser.add_argument("--source", default=None, help="hub, a folder, hf-cache[:path] or a mirror URL. Defaults to $ERICCHAT_MODEL_SOURCE, then hub")
+    install_parser.add_argument("--backend", default="mlx", help="which backend's models to install (mlx or cpu)")
+    install_parser.add_argument("--check-hashes", action="store_true", help="also check the sha256 of files linked from a folder or cache, downloads are always checked")
+    install_parser.add_argument("--refresh", action="store_true", help="check the Hub for a newer revision now, instead of using what it resolved to in the last day")
+    install_parser.add_argument("--limit-mb", type=float, default=0, help="download at most this many MB per second, 0 for no limit")
+    install_parser.set_defaults(func=_run_install)
+
+    batch_parser = commands.add_parser("batch", parents=[data_dir], help="run a .jsonl file of prompts without the app and report throughput")
+    batch_parser.add_argument("prompts", type=Path, help='one {"id": ..., "prompt": ...} or {"id": ..., "messages": [...]} per line')
+    batch_parser.add_argument("--model", required=True, help="a model label such as 20B, or its repo id. Downloaded first if needed")
+    batch_parser.add_argument("--backend", default="", help="mlx, cpu, fake or replay. Picked automatically by default")
+    batch_parser.add_argument("--source", default=None, help="where to install the model from, see install --source")
+    batch_parser.add_argument("--output", type=Path, default=None, help="results .jsonl, appended to and resumed. Defaults to <prompts>.results.jsonl")
+    batch_parser.add_argument("--concurrency", type=int, default=1, help="prompts run at once, each worker loads its own copy of the model")
+    batch_parser.add_argument("--max-len", type=int, default=2048)
+    batch_parser.add_argument("--temp", type=float, default=0.7)
+    batch_parser.add_argument("--top-p", type=float, default=0.8)
+    batch_parser.add_argument("--kv-bits", type=int, choices=[8, 4], default=None, help="quantize the KV cache (mlx)")
+    batch_parser.add_argument("--max-kv-size", type=int, default=None, help="a rotating KV cache of at most this many tokens, the oldest are dropped (mlx)")
+    batch_parser.set_defaults(func=_run_batch)
+
+    leaks_parser = commands.add_parser("leaks", parents=[data_dir], help="repeat model switches and conversations, fail if memory keeps growing")
+    leaks_parser.add_argument("--model", default="Fake", help="model short name, e.g. 20B with --backend mlx")
+    leaks_parser.add_argument("--backend", default="fake", help="mlx, cpu or fake (the default)")
+    leaks_parser.add_argument("--source", default=None, help="where to install the model from if it isn't installed yet")
+    leaks_parser.add_argument("--isolate", action="store_true", help="host the model in a child process, like the app")
+    leaks_parser.add_argument("--model-cycles", type=int, default=20, help="load, stream, unload this many times, 0 to skip")
+    leaks_parser.add_argument("--session-cycles", type=int, default=200, help="new conversation, answer, delete this many times, 0 to skip")
+    leaks_parser.add_argument("--warmup", type=int, default=5, help="cycles run before measuring")
+    leaks_parser.add_argument("--max-growth-mb", type=float, default=20.0, help="fail when RSS or MLX memory grows more than this")
+    leaks_parser.add_argument("--max-traced-mb", type=float, default=2.0, help="fail when the Python heap grows more than this")
+    leaks_parser.set_defaults(func=_run_leaks)
+
+    calibrate_parser = commands.add_parser("calibrate", parents=[data_dir], help="measure a model's load time, memory and speed on this machine for the model picker")
+    calibrate_parser.add_argument("--model", required=True, help="a model label such as 20B, or its repo id. Downloaded first if needed")
+    calibrate_parser.add_argument("--backend", default="", help="mlx, cpu or fake. Picked automatically by default")
+    calibrate_parser.add_argument("--source", default=None, help="where to install the model from if it isn't installed yet")
+    calibrate_parser.add_argument("--isolate", action="store_true", help="host the model in a child process, like the app")
+    calibrate_parser.add_argument("--max-len", type=int, default=128, help="new tokens to generate")
+    calibrate_parser.set_defaults(func=_run_calibrate)
+
+    docs_parser = commands.add_parser("docs", parents=[data_dir], help="add folders to the documents the app answers from, or search them")
+    docs_parser.add_argument("action", choices=["add", "search", "clear"])
+    docs_parser.add_argument("args", nargs="*", help="folders or files to add, or the search query")
+    docs_parser.add_argument("--embedder", default=None, help="hashing (default) or a transformers embedding model, must match the app's $ERICCHAT_EMBEDDER")
+    docs_parser.add_argument("-k", type=int, default=5, help="number of passages to show for search")
+    docs_parser.set_defaults(func=_run_docs)
+
+    store_parser = commands.add_parser("store", parents=[data_dir], help="show how much disk the models use, and clean up old revisions")
+    store_parser.add_argument("--gc", action="store_true", help="delete old revisions and the files no current revision uses")
+    store_parser.add_argument("--dry-run", action="store_true", help="with --gc, only report what would be deleted")
+    store_parser.set_defaults(func=_run_store)
+
+    replay_parser = commands.add_parser("replay", help="play a recorded trace through the chat state and renderer, and time it")
+    replay_parser.add_argument("path", type=Path, help="a .jsonl or .jsonl.zst trace")
+    replay_parser.add_argument("--speed", type=float, default=0.0, help="1 for the recorded timing, 2 for twice as fast, 0 (default) as fast as possible")
+    replay_parser.add_argument("--no-render", action="store_true", help="skip render_html")
+    replay_parser.set_defaults(func=_run_replay)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
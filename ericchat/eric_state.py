@@ -1,16 +1,23 @@
+import threading
+import time
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 from erictransformer import CHATStreamResult
 
-from .util import ChatMessage, TPSTracker, available_model_factory
+from .util import (THINKING_STRATEGIES, WATCHDOG_ACTIONS, ChatMessage,
+                   ConvoJournal, ConvoSearchIndex, ConvoTree, RepetitionLoop,
+                   RepetitionWatchdog, Retriever, ThinkingTrace, TPSTracker,
+                   available_model_factory)
 
 
 class EricUIState:
-    def __init__(self, model_dir: Path):
+    def __init__(self, model_dir: Path, backend: str = "mlx"):
         self.model_dir = model_dir
+        # name of the ChatBackend in use, decides which models are offered
+        self.backend = backend
 
-        self.available_models, self.chosen_hf_model = available_model_factory(model_dir)
+        self.available_models, self.chosen_hf_model = available_model_factory(model_dir, backend=backend)
         self.current_short_name = ""
 
         self.available_models_names = self.available_models.keys()
@@ -18,19 +25,51 @@ class EricUIState:
         self.tps_tracker = TPSTracker()
         self.tps = 0
         self.model_ready = False
+        # decode with the model's draft model (ModelDetails.draft_short_name) when it has one
+        self.speculative = False
+        self.draft_acceptance = 0.0
+        # answer deterministic prompts from the generation cache, see GenerationCache
+        self.use_cache = False
+        self.from_cache = False
+        # set to a Retriever to answer from local documents, see util/retrieval.py
+        self.retriever: Optional[Retriever] = None
 
         self.previous_marker_type = ""
         self.current_marker_stream: ChatMessage = ChatMessage()
+        # answers sampled side by side for one prompt, see start_candidates()
+        self.candidates = 1
+        self.candidate_streams: List[ChatMessage] = []
+        self.candidate_trackers: List[TPSTracker] = []
 
-        # example data for now
-        self.convo_history: List[ChatMessage] = []
+        # the current convo, reads like the list of messages on its active branch
+        self.convo_history: ConvoTree = ConvoTree()
         self.stream_marker_i = 0
 
         self.should_update_ui = False
         self.in_inference = False
         self.cancel_inference = False
-
-        self.convo_histories: List[List[ChatMessage]]= []
+        # time from pressing Cancel until the stream has actually stopped
+        self.cancel_requested_at = 0.0
+        self.last_cancel_latency: Optional[float] = None
+
+        self.convo_histories: List[ConvoTree]= []
+
+        # stable ids for convo_histories, positions shift when a convo is deleted
+        self.convo_ids: List[int] = []
+        self._next_convo_id = 0
+        self.search_index = ConvoSearchIndex()
+        # The index of restored conversations is built on a thread, see attach_journal(). Until it's
+        # ready changes go to a small index that only holds them and to a backlog replayed onto the
+        # full one. on_search_ready is called on that thread when it's done.
+        self.search_lock = threading.Lock()
+        self.search_ready = threading.Event()
+        self.search_ready.set()
+        self.on_search_ready: Optional[Callable[[], None]] = None
+        self._search_backlog: Optional[List[Tuple[int, Optional[int], str]]] = None
+        # message to scroll to on the next render, set by change_convo()
+        self.jump_to_message: Optional[int] = None
+        # optional write-behind persistence, see attach_journal()
+        self.journal: Optional[ConvoJournal] = None
 
         self.current_convo_index = 0
 
@@ -41,22 +80,42 @@ class EricUIState:
         self.top_p = 0.8
         self.temp = 0.7
         self.top_k = 0 # we don't adjust this
+        # a name of KV_CACHE_MODES: full, quantized or bounded, for long conversations on big models
+        self.kv_cache = "Full KV cache"
+        # long prompts are prefilled in chunks of this many tokens, with progress and a cancel check after each
+        self.prefill_step_size = 512
+
+        # thinking traces are kept apart from the visible text and capped in memory
+        self.thinking_max_chars = 200_000
+        self.thinking_strategy = "head_tail" # see ThinkingTrace for "head" and "tail"
+        self.compress_thinking = True # committed traces are zlib compressed
+
+        # what to do when the model loops, per marker: "off", "stop" or "steer" (ask it to answer, once)
+        self.watchdog_actions = {"thinking": "steer", "text": "stop"}
+        # set when the watchdog ends a generation, recorded on the message by _submit_chat
+        self.stop_reason = ""
 
 
     def update_available_models_datasets(self):
-        self.available_models, _ = available_model_factory(self.model_dir)
+        self.available_models, _ = available_model_factory(self.model_dir, backend=self.backend)
         self.available_models_names = self.available_models.keys()
 
     def _reset_state(self):
         self.current_marker_stream = ChatMessage()
         self.previous_marker_type = ""
         self.stream_marker_i = 0
+        self.candidate_streams = []
+        self.candidate_trackers = []
 
     def user_input(self, text: str):
         # reset current_messages again just in-case finish_chat() is skipped due to an error
         self._reset_state()
         self.convo_history.append(ChatMessage(text=text, marker="", expanded_text="", role="user"))
+        self._commit_message(self.current_convo_index, len(self.convo_history) - 1, self.convo_history[-1])
+        return self._model_messages()
 
+    def _model_messages(self) -> List[dict]:
+        # walks the active branch only, other branches never reach the model
         out = []
         for msg in self.convo_history:
             if msg.role == "assistant" and msg.marker == "text":
@@ -64,36 +123,154 @@ class EricUIState:
             elif msg.role == "user":
                 out.append({"role": "user", "content": msg.text})
 
+        # Only the prompt being answered gets the best excerpts of the user's files. They aren't kept
+        # on the message, earlier turns go as they were written instead of growing the prompt every turn.
+        if self.retriever is not None and out and out[-1]["role"] == "user":
+            out[-1]["content"] = self.retriever.augment(out[-1]["content"]) or out[-1]["content"]
         return out
 
+    def regenerate(self, index: Optional[int] = None) -> Optional[List[dict]]:
+        # Fork before an answer (the last one by default) so the next answer becomes its sibling.
+        # Returns the messages to generate from, None when there is no answer to regenerate.
+        if index is None:
+            index = self.last_index("assistant")
+        if index is None or self.convo_history[index].role != "assistant":
+            return None
+        self._reset_state()
+        self.convo_history.fork(index)
+        return self._model_messages()
 
-    def _submit_chat(self):
-        if self.cancel_inference:
-            if self.current_marker_stream.marker in ("thinking", "think_start", "think_end", "special"):
-                self.current_marker_stream.text = f"**Cancelled. Thinking tokens:**\n\n {self.current_marker_stream.expanded_text}"
+    def edit_message(self, index: int, text: str) -> Optional[List[dict]]:
+        # Fork before a prompt and add the edited one as its sibling, the old branch is kept.
+        if self.convo_history[index].role != "user":
+            return None
+        self._reset_state()
+        self.convo_history.fork(index)
+        return self.user_input(text)
+
+    def switch_branch(self, index: int, step: int) -> bool:
+        # show the previous (-1) or next (+1) sibling of the message at index, with the rest of its branch
+        if not self.convo_history.switch_sibling(index, step):
+            return False
+        if self.journal is not None:
+            self.journal.record_leaf(self.convo_ids[self.current_convo_index], self.convo_history.leaf)
+        return True
+
+    def branch_point(self) -> Optional[int]:
+        # the last message on the active branch that has siblings, where the branch buttons switch
+        for i in range(len(self.convo_history) - 1, -1, -1):
+            if self.convo_history.siblings(i)[1] > 1:
+                return i
+        return None
+
+    def last_index(self, role: str) -> Optional[int]:
+        for i in range(len(self.convo_history) - 1, -1, -1):
+            if self.convo_history[i].role == role:
+                return i
+        return None
+
+
+    def _new_thinking_trace(self) -> ThinkingTrace:
+        return ThinkingTrace(max_chars=self.thinking_max_chars, strategy=self.thinking_strategy)
+
+    def _close_message(self, msg: ChatMessage):
+        # the thinking trace stays on msg.thinking and is rendered collapsed, never inlined into text
+        in_thinking = msg.marker in ("thinking", "think_start", "think_end", "special")
+        if self.stop_reason:
+            msg.stop_reason = self.stop_reason
+            if in_thinking:
+                msg.text = "**Stopped: the model was repeating itself while thinking.**"
             else:
-                self.current_marker_stream.text = self.current_marker_stream.text
+                msg.text += "\n\n**Stopped: the answer was repeating itself.**"
+
+        elif self.cancel_inference:
+            msg.stop_reason = "cancelled"
+            if in_thinking:
+                msg.text = "**Cancelled while thinking.**"
 
-        elif self.current_marker_stream.marker == "thinking":
-            self.current_marker_stream.text = f"**Ran out of tokens while thinking:**\n\n {self.current_marker_stream.expanded_text}"
+        elif msg.marker == "thinking":
+            msg.stop_reason = "max_len"
+            msg.text = "**Ran out of tokens while thinking.**"
 
+        if self.compress_thinking and msg.thinking is not None:
+            msg.thinking.compress()
+
+    def _submit_chat(self):
+        self._close_message(self.current_marker_stream)
         self.convo_history.append(self.current_marker_stream)
+        self._commit_message(self.current_convo_index, len(self.convo_history) - 1, self.convo_history[-1])
+        self._reset_state()
+
+    def start_candidates(self, n: int):
+        # n answers stream side by side instead of current_marker_stream
+        self.candidate_streams = [ChatMessage(text="...", role="assistant") for _ in range(n)]
+        self.candidate_trackers = [TPSTracker() for _ in range(n)]
+
+    def candidate_step(self, index: int, step: CHATStreamResult):
+        # a piece of one candidate, each has its own message and TPS
+        msg = self.candidate_streams[index]
+        msg.tps = self.candidate_trackers[index].step()
+        if step.marker in ("think_start", "thinking"):
+            if msg.thinking is None:
+                msg.thinking = self._new_thinking_trace()
+            if msg.marker != "thinking":
+                msg.text = "Thinking..."
+                msg.marker = "thinking"
+            if step.marker == "thinking":
+                msg.thinking.append(step.text)
+        elif step.marker == "text":
+            if msg.marker != "text":
+                msg.text = ""
+                msg.marker = "text"
+            msg.text += step.text
+
+        # the whole batch advances together, so redraw about as often as for a single answer
+        self.should_update_ui = self.stream_marker_i % (32 * len(self.candidate_streams)) == 0
+        self.stream_marker_i += 1
+
+    def _submit_candidates(self):
+        # Every candidate that started becomes a sibling answer, the first one that finished on its
+        # own stays on the active branch. The branch buttons switch to the others.
+        started = [msg for msg in self.candidate_streams if msg.marker]
+        for msg in started:
+            self._close_message(msg)
+        for i, msg in enumerate(started):
+            if i > 0:
+                self.convo_history.fork(len(self.convo_history) - 1)
+            self.convo_history.append(msg)
+            self._commit_message(self.current_convo_index, len(self.convo_history) - 1, msg)
+
+        chosen = next((msg for msg in started if not msg.stop_reason), None)
+        if chosen is not None and chosen is not started[-1]:
+            self.convo_history.select(chosen.node_id)
+            if self.journal is not None:
+                self.journal.record_leaf(self.convo_ids[self.current_convo_index], self.convo_history.leaf)
         self._reset_state()
 
     def stream_step(self, step: CHATStreamResult):
         update_ui_marker = False
         self.tps = self.tps_tracker.step()
+        telemetry = step.payload.get("telemetry") if isinstance(step.payload, dict) else None
+        if telemetry:
+            self.draft_acceptance = telemetry.get("draft_acceptance", 0.0)
+            self.from_cache = telemetry.get("cache_hit", 0.0) > 0
 
         if step.marker == "think_start":
             self.current_marker_stream.text="Thinking..."
             self.current_marker_stream.marker="thinking"
-            self.current_marker_stream.expanded_text+=""
+            if self.current_marker_stream.thinking is None:
+                self.current_marker_stream.thinking = self._new_thinking_trace()
             self.current_marker_stream.role="assistant"
             self.current_marker_stream.tps = self.tps
             update_ui_marker = True
 
         elif step.marker == "thinking":
-            self.current_marker_stream.expanded_text += step.text
+            if self.current_marker_stream.thinking is None:
+                self.current_marker_stream.thinking = self._new_thinking_trace()
+            self.current_marker_stream.thinking.append(step.text)
+            if self.journal is not None:
+                self.journal.record_partial(self.convo_ids[self.current_convo_index], thinking=step.text,
+                                            parent_id=self.convo_history.leaf)
             self.current_marker_stream.tps = self.tps
 
         elif step.marker == "think_end":
@@ -101,19 +278,27 @@ class EricUIState:
             self.current_marker_stream.tps = self.tps
 
         elif step.marker == "text":
+            if self.journal is not None:
+                self.journal.record_partial(self.convo_ids[self.current_convo_index], text=step.text,
+                                            parent_id=self.convo_history.leaf)
             if self.previous_marker_type != "text":
                 self.should_update_ui = True
                 self.current_marker_stream = ChatMessage(text=step.text,
                                                          marker="text",
                                                          expanded_text="",
-                                                         role="assistant")
+                                                         role="assistant",
+                                                         thinking=self.current_marker_stream.thinking)
             else:
                 self.current_marker_stream.text += step.text
                 self.current_marker_stream.tps = self.tps
+            self.current_marker_stream.draft_acceptance = self.draft_acceptance
 
         elif step.marker == "think_end":
             update_ui_marker = True
 
+        if self.from_cache:
+            self.current_marker_stream.cached = True
+
         if update_ui_marker or (self.stream_marker_i % 32 ==0):
             self.should_update_ui = True
         else:
@@ -124,27 +309,198 @@ class EricUIState:
 
     def finish_chat(self):
 
-        self._submit_chat()
+        if self.candidate_streams:
+            self._submit_candidates()
+        else:
+            self._submit_chat()
         self.tps_tracker.reset() # this way if text or thinking are first we have a fresh state
+        self.draft_acceptance = 0.0
+        self.from_cache = False
+        if self.cancel_inference and self.cancel_requested_at:
+            self.last_cancel_latency = time.monotonic() - self.cancel_requested_at
+        self.cancel_requested_at = 0.0
         self.cancel_inference = False
+        self.stop_reason = ""
         self.in_inference = False
 
+    def new_watchdog(self) -> Optional[RepetitionWatchdog]:
+        if all(action == "off" for action in self.watchdog_actions.values()):
+            return None
+        return RepetitionWatchdog()
+
+    def watchdog_action(self, loop: RepetitionLoop) -> str:
+        return self.watchdog_actions.get(loop.marker, "stop")
+
+    def stop_for_repetition(self, loop: RepetitionLoop):
+        self.stop_reason = loop.reason()
+
+    def steer_for_repetition(self, loop: RepetitionLoop):
+        # the generation restarts with a nudge, leave a mark where the loop was cut
+        if self.current_marker_stream.thinking is not None:
+            self.current_marker_stream.thinking.append(f"\n\n[Stopped a loop: {loop.reason()}.]\n\n")
+
+    def set_watchdog_action(self, marker: str, action: str):
+        if action not in WATCHDOG_ACTIONS:
+            raise ValueError(f"Unknown watchdog action: {action}")
+        self.watchdog_actions[marker] = action
+
+    def _append_convo(self) -> int:
+        self.convo_histories.append(ConvoTree())
+        self.convo_ids.append(self._next_convo_id)
+        if self.journal is not None:
+            self.journal.record_new(self._next_convo_id)
+        self._next_convo_id += 1
+        return len(self.convo_histories) - 1
+
+    def request_cancel(self):
+        self.cancel_inference = True
+        self.cancel_requested_at = time.monotonic()
+
     def new_convo(self):
-        self.convo_histories.append([])
-        self.current_convo_index = len(self.convo_histories) - 1
+        self.current_convo_index = self._append_convo()
         self.convo_history = self.convo_histories[self.current_convo_index]
 
     def delete_convo(self, index: int):
         self.convo_histories.pop(index)
+        convo_id = self.convo_ids.pop(index)
+        self._index_remove(convo_id)
+        if self.journal is not None:
+            self.journal.record_delete(convo_id)
         if self.current_convo_index >= index:
             self.current_convo_index -= 1
 
-    def change_convo(self, index: int):
+    def change_convo(self, index: int, node_id: Optional[int] = None):
+        # node_id (e.g. a search hit) switches to its branch and scrolls to it on the next render
         self.convo_history = self.convo_histories[index]
         self.current_convo_index = index
+        self.jump_to_message = None
+        if node_id is not None:
+            leaf = self.convo_history.leaf
+            self.jump_to_message = self.convo_history.index_of(node_id)
+            if self.journal is not None and self.convo_history.leaf != leaf:
+                self.journal.record_leaf(self.convo_ids[index], self.convo_history.leaf)
+
+    def thinking_text(self, convo_id: int, node_id: int) -> Optional[str]:
+        # any convo's, the transcript may still show the one that was open before a switch
+        ids, trees = list(self.convo_ids), list(self.convo_histories)
+        if convo_id not in ids or len(ids) != len(trees):
+            return None
+        msg = trees[ids.index(convo_id)].nodes.get(node_id)
+        if msg is None or msg.thinking is None:
+            return None
+        return msg.thinking.text()
 
     def update_convo(self, index: int, convo: ChatMessage):
-        self.convo_histories[index].append(convo)
+        tree = self.convo_histories[index]
+        if convo.node_id >= 0:
+            # keeps the branches of an imported convo
+            tree.add(convo)
+        else:
+            tree.append(convo)
+        self._commit_message(index, len(tree) - 1, convo)
+
+    def _commit_message(self, convo_index: int, message_index: int, msg: ChatMessage):
+        convo_id = self.convo_ids[convo_index]
+        if msg.role and msg.text:
+            self._index_add(convo_id, msg.node_id, msg.text)
+        if self.journal is not None:
+            self.journal.record_message(convo_id, message_index, msg)
+
+    def _index_add(self, convo_id: int, node_id: int, text: str):
+        with self.search_lock:
+            self.search_index.add(convo_id, node_id, text)
+            if self._search_backlog is not None:
+                self._search_backlog.append((convo_id, node_id, text))
+
+    def _index_remove(self, convo_id: int):
+        with self.search_lock:
+            self.search_index.remove_convo(convo_id)
+            if self._search_backlog is not None:
+                self._search_backlog.append((convo_id, None, ""))
+
+    def _build_search_index(self, docs: List[Tuple[int, int, str]]):
+        index = ConvoSearchIndex()
+        for convo_id, node_id, text in docs:
+            index.add(convo_id, node_id, text)
+        with self.search_lock:
+            # what changed while it was built, in order
+            for convo_id, node_id, text in self._search_backlog:
+                if node_id is None:
+                    index.remove_convo(convo_id)
+                else:
+                    index.add(convo_id, node_id, text)
+            self.search_index = index
+            self._search_backlog = None
+        self.search_ready.set()
+        if self.on_search_ready is not None:
+            self.on_search_ready()
+
+    def attach_journal(self, journal: ConvoJournal):
+        # Restore every conversation from the journal (including answers that were cut off by a crash),
+        # compact it, then keep it up to date from here on. Starts a fresh convo like a normal launch.
+        # Search covers the restored conversations once search_ready is set.
+        restored = journal.replay(thinking_max_chars=self.thinking_max_chars, thinking_strategy=self.thinking_strategy)
+        restored = [(convo_id, tree) for convo_id, tree in restored if tree.nodes]
+        journal.compact(restored)
+
+        self.convo_histories = []
+        self.convo_ids = []
+        docs = []
+        for convo_id, tree in restored:
+            self.convo_histories.append(tree)
+            self.convo_ids.append(convo_id)
+            # every branch is searchable
+            for msg in tree.iter_nodes():
+                if msg.role and msg.text:
+                    docs.append((convo_id, msg.node_id, msg.text))
+        with self.search_lock:
+            self.search_index = ConvoSearchIndex()
+            self._search_backlog = []
+        self.search_ready.clear()
+        # seconds for thousands of conversations, the window shows up in the meantime
+        threading.Thread(target=self._build_search_index, args=(docs,), daemon=True,
+                         name="ericchat-search-index").start()
+        self._next_convo_id = max(self.convo_ids, default=-1) + 1
+
+        self.journal = journal
+        journal.start()
+        self.new_convo()
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[int, int, str]]:
+        # (convo index, node id, snippet) ranked best first, see change_convo()
+        positions = {convo_id: i for i, convo_id in enumerate(self.convo_ids)}
+        results = []
+        with self.search_lock:
+            hits = self.search_index.search(query, limit=limit)
+        for hit in hits:
+            convo_index = positions.get(hit.convo_id)
+            if convo_index is not None:
+                results.append((convo_index, hit.node_id, hit.snippet))
+        return results
+
+    @property
+    def search_truncated(self) -> List[str]:
+        # words of the last search that only matched their most common completions
+        return self.search_index.truncated_prefixes
+
+    def iter_messages(self) -> Iterator[Tuple[int, ChatMessage]]:
+        # (convo id, message) for every committed message of every branch, for export
+        for convo_id, convo in list(zip(self.convo_ids, self.convo_histories)):
+            for msg in list(convo.iter_nodes()):
+                yield convo_id, msg
+
+    def import_messages(self, chunk: List[Tuple[int, ChatMessage]], key_map: Dict[int, int]):
+        # Append one chunk of an archive. key_map maps archive convo keys to convo ids and is shared
+        # between chunks, so a convo that spans two chunks stays one convo.
+        positions = {convo_id: i for i, convo_id in enumerate(self.convo_ids)}
+        for key, msg in chunk:
+            convo_id = key_map.get(key)
+            index = positions.get(convo_id) if convo_id is not None else None
+            if index is None:
+                index = self._append_convo()
+                key_map[key] = self.convo_ids[index]
+                positions[self.convo_ids[index]] = index
+            self.update_convo(index, msg)
 
     def set_token_length(self, max_len: float):
         # back-load from 1 to 8096
@@ -156,6 +512,8 @@ class EricUIState:
         c = max(1.0, min(100.0, float(creativity)))
 
         if c <= 1.0:
+            # greedy: always the most likely token, so the same conversation gets the same answer
+            self.temp = 0
             self.top_p = 0
             self.top_k = 0
 
@@ -171,3 +529,10 @@ class EricUIState:
             # safety clamps
             self.top_p = min(max(self.top_p, 0.0), 1.0)
 
+    def set_thinking_limits(self, max_chars: int, strategy: str = "head_tail"):
+        # only applies to traces started after the call
+        if strategy not in THINKING_STRATEGIES:
+            raise ValueError(f"Unknown thinking strategy: {strategy}")
+        self.thinking_max_chars = max(0, int(max_chars))
+        self.thinking_strategy = strategy
+
@@ -0,0 +1,172 @@
+import gc
+import linecache
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import psutil
+from erictransformer import CHATCallArgs
+
+from .backends import ChatBackend
+from .util import PeakMemory
+
+# Repeats what a long session does (switching models, starting and deleting conversations) and
+# checks that memory comes back. A few warmup cycles fill caches and lazy imports first, then the
+# growth over the measured cycles is attributed to the lines that allocated it with tracemalloc.
+
+
+@dataclass
+class LeakReport:
+    name: str
+    cycles: int
+    rss_start_mb: float
+    rss_end_mb: float
+    # least squares slope of RSS over the cycles, steadier than end minus start
+    rss_mb_per_cycle: float
+    traced_growth_mb: float
+    # Metal memory MLX holds in this process, not all of it shows up in RSS. None without MLX
+    device_growth_mb: Optional[float] = None
+    # allocation sites that grew the most: ("file.py:123", bytes, allocations)
+    top_sites: List[Tuple[str, int, int]] = field(default_factory=list)
+    passed: bool = True
+
+    @property
+    def rss_growth_mb(self) -> float:
+        return self.rss_end_mb - self.rss_start_mb
+
+
+def _collect():
+    # the same as _unload_model: a second pass frees what the first one's finalizers released
+    gc.collect()
+    gc.collect()
+
+
+def _device_memory() -> Optional[int]:
+    # only when a backend already imported MLX, the harness never loads it by itself
+    mx = sys.modules.get("mlx.core")
+    if mx is None:
+        return None
+    get_active_memory = getattr(mx, "get_active_memory", None) or mx.metal.get_active_memory
+    return get_active_memory()
+
+
+def _slope(values: List[float]) -> float:
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    num = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    den = sum((x - mean_x) ** 2 for x in range(n))
+    return num / den
+
+
+# the harness's own allocations: snapshots, RSS samples and psutil's caches
+_IGNORED = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, str(Path(psutil.__file__).parent / "*"))]
+
+
+def _top_sites(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, limit: int) -> List[Tuple[str, int, int]]:
+    diff = after.compare_to(before, "lineno")
+    sites = []
+    for stat in diff:
+        if stat.size_diff <= 0:
+            continue
+        frame = stat.traceback[0]
+        sites.append((f"{frame.filename}:{frame.lineno}", stat.size_diff, stat.count_diff))
+        if len(sites) == limit:
+            break
+    return sites
+
+
+def measure_cycles(name: str, cycle: Callable[[int], None], cycles: int = 50, warmup: int = 5,
+                   max_growth_mb: float = 20.0, max_traced_mb: float = 2.0, top: int = 10) -> LeakReport:
+    # cycle(i) runs one cycle. Fails when RSS (this process and its children) or MLX's memory grows
+    # by more than max_growth_mb, or the Python heap by more than max_traced_mb, over the measured cycles.
+    memory = PeakMemory()
+    for i in range(warmup):
+        cycle(i)
+    _collect()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        device_start = _device_memory()
+        rss = [memory.sample()]
+        for i in range(warmup, warmup + cycles):
+            cycle(i)
+            _collect()
+            rss.append(memory.sample())
+        after = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        device_end = _device_memory()
+    finally:
+        tracemalloc.stop()
+
+    mb = 1024 * 1024
+    traced = sum(t.size for t in after.traces) - sum(t.size for t in before.traces)
+    report = LeakReport(name=name, cycles=cycles, rss_start_mb=rss[0] / mb, rss_end_mb=rss[-1] / mb,
+                        rss_mb_per_cycle=_slope(rss) / mb, traced_growth_mb=traced / mb,
+                        top_sites=_top_sites(before, after, top))
+    if device_start is not None and device_end is not None:
+        report.device_growth_mb = (device_end - device_start) / mb
+    report.passed = (report.rss_growth_mb <= max_growth_mb and report.traced_growth_mb <= max_traced_mb
+                     and (report.device_growth_mb or 0.0) <= max_growth_mb)
+    return report
+
+
+def _drain(backend: ChatBackend, messages: List[dict], max_len: int) -> int:
+    tokens = 0
+    for _ in backend.stream(messages, CHATCallArgs(max_len=max_len, top_k=0, temp=0.7, top_p=0.8)):
+        tokens += 1
+    return tokens
+
+
+def model_cycles(backend_factory: Callable[[], ChatBackend], cycles: int = 20, max_len: int = 64,
+                 **kwargs) -> LeakReport:
+    # load -> stream -> unload, the way the app switches models
+    messages = [{"role": "user", "content": "Say something about memory."}]
+
+    def cycle(i: int):
+        backend = backend_factory()
+        try:
+            _drain(backend, messages, max_len)
+        finally:
+            backend.unload()
+        del backend
+
+    return measure_cycles("model load/stream/unload", cycle, cycles=cycles, **kwargs)
+
+
+def session_cycles(cycles: int = 200, kept_convos: int = 5, answer_words: int = 400,
+                   backend: Optional[ChatBackend] = None, **kwargs) -> LeakReport:
+    # new convo -> prompt -> streamed answer -> switch -> delete the oldest, on EricUIState with a
+    # journal, so the number of live conversations stays at kept_convos
+    from .backends import FakeChatBackend
+    from .eric_state import EricUIState
+    from .util import ConvoJournal
+
+    backend = backend or FakeChatBackend(prefill_tps=0, decode_tps=0, thinking="Let me think " * 20,
+                                         answer=" ".join(f"word{i % 97}" for i in range(answer_words)))
+    with tempfile.TemporaryDirectory() as tmp:
+        state = EricUIState(Path(tmp) / "models", backend="fake")
+        state.attach_journal(ConvoJournal(Path(tmp) / "journal.jsonl"))
+
+        def cycle(i: int):
+            state.new_convo()
+            messages = state.user_input(f"Question {i} about topic {i % 13}")
+            for piece in backend.stream(messages, CHATCallArgs(max_len=answer_words + 64, top_k=0, temp=0.7, top_p=0.8)):
+                state.stream_step(piece)
+            state.finish_chat()
+            state.change_convo(0)
+            while len(state.convo_histories) > kept_convos:
+                state.delete_convo(0)
+            state.change_convo(len(state.convo_histories) - 1)
+
+        try:
+            return measure_cycles("conversation new/stream/delete", cycle, cycles=cycles, **kwargs)
+        finally:
+            state.journal.close()
@@ -27,48 +27,93 @@ def _render_markdown_to_html(text: str) -> str:
     )
     return clean_html
 
-def _get_item(msg: ChatMessage) -> str:
+def _get_thinking_html(msg: ChatMessage, streaming: bool, thinking_url: str = "") -> str:
+    trace = msg.thinking
+    if trace is None or len(trace) == 0 or streaming:
+        return ""
+
+    summary = f"Thinking · {len(trace):,} characters"
+    if trace.is_truncated:
+        summary += f" ({trace.dropped_chars:,} dropped)"
+
+    # only the summary is rendered, the trace is fetched from thinking_url when the block is opened
+    if not thinking_url or msg.node_id < 0:
+        return f'<div class="thinking">{summary}</div>'
+    return (f'<details class="thinking" data-src="{thinking_url}/{msg.node_id}">'
+            f'<summary>{summary}</summary><pre></pre></details>')
+
+def _get_item(msg: ChatMessage, streaming: bool = False, anchor: str = "", branch: str = "",
+              thinking_url: str = "") -> str:
     if not msg.role:
         return ""
 
     who_map = {"user": "You", "assistant": "Eric"}
 
     cls = msg.role
+    anchor_attr = f' id="{anchor}"' if anchor else ""
     who = who_map[msg.role]
     html_msg = _render_markdown_to_html(msg.text)
 
-    expanded_html = ""
+    expanded_html = _get_thinking_html(msg, streaming, thinking_url)
 
     tps_value = msg.tps
     tps_chip = ""
-    if msg.role == "assistant" and tps_value > 0:
-        tps_chip = f'<div class="tps-chip">TPS:<span class="value">{round(tps_value, 1)}</span></div>'
+    if msg.role == "assistant" and msg.cached:
+        # replayed, its TPS would only measure the renderer
+        tps_chip = '<div class="tps-chip">Cached</div>'
+    elif msg.role == "assistant" and tps_value > 0:
+        # with a draft model the TPS is the effective rate, the share of accepted drafts goes next to it
+        draft = ""
+        if msg.draft_acceptance > 0:
+            draft = f' Draft:<span class="value">{round(msg.draft_acceptance * 100)}%</span>'
+        tps_chip = f'<div class="tps-chip">TPS:<span class="value">{round(tps_value, 1)}</span>{draft}</div>'
+
+    # "2/3" when the message was edited or regenerated, the branch buttons switch between them
+    branch_chip = f'<span class="branch-chip">{branch}</span>' if branch else ""
 
     return f"""
-       <div class="row {cls}">
+       <div class="row {cls}"{anchor_attr}>
            {tps_chip}
-           <div class="who">{who}</div>
+           <div class="who">{who}{branch_chip}</div>
            <div class="msg">{html_msg}{expanded_html}</div>
        </div>
     """
 
 
-def render_html(eric_state: EricUIState):
+def render_html(eric_state: EricUIState, thinking_url: str = ""):
+    # thinking_url is where a ThinkingServer serves the traces, without one only their summaries are shown
     items = []
-    for msg in eric_state.convo_history:
-        item = _get_item(msg)
+    convo = eric_state.convo_history
+    if thinking_url and eric_state.convo_ids:
+        # node ids are per convo, the convo's id keeps the URLs (and their open state) apart
+        thinking_url = f"{thinking_url}/{eric_state.convo_ids[eric_state.current_convo_index]}"
+    for i, msg in enumerate(convo):
+        position, count = convo.siblings(i)
+        branch = f"{position + 1}/{count}" if count > 1 else ""
+        item = _get_item(msg, anchor=f"msg-{i}", branch=branch, thinking_url=thinking_url)
         if item:
             items.append(item)
 
-    item = _get_item(eric_state.current_marker_stream)
+    item = _get_item(eric_state.current_marker_stream, streaming=True)
     if item:
         items.append(item)
 
+    # candidates stream in columns, numbered like the sibling answers they become
+    candidates = eric_state.candidate_streams
+    if candidates:
+        columns = "".join(_get_item(msg, streaming=True, branch=f"{i + 1}/{len(candidates)}")
+                          for i, msg in enumerate(candidates))
+        items.append(f'<div class="candidates" style="grid-template-columns: repeat({len(candidates)}, 1fr)">{columns}</div>')
+
     transcript = "\n".join(items) or """"""
 
-    return get_html(transcript)
+    jump_id = ""
+    if eric_state.jump_to_message is not None:
+        jump_id = f"msg-{eric_state.jump_to_message}"
 
-def get_html(transcript):
+    return get_html(transcript, jump_id)
+
+def get_html(transcript, jump_id: str = ""):
     message_html = f"""<!doctype html>
     <html lang="en">
     <meta charset="utf-8">
@@ -133,6 +178,8 @@ def get_html(transcript):
       .who {{
         font-weight: 600; font-size: 10px; opacity: .7; color: {EricColours.BLACK};
       }}
+      .branch-chip {{ margin-left: 6px; font-weight: 400; }}
+      .candidates {{ display: grid; gap: 10px; align-items: start; }}
       .msg {{
         font-size: 14px; line-height: 1.45; white-space: normal; word-wrap: break-word; color: {EricColours.BLACK};
       }}
@@ -140,6 +187,10 @@ def get_html(transcript):
       .msg th, .msg td {{ border: 1px solid var(--bubble-border); padding: 6px 8px; text-align: left; }}
       .msg thead th {{ background: #fff8; }}
 
+      .thinking {{ margin-top: 8px; font-size: 12px; opacity: .8; }}
+      .thinking summary {{ cursor: pointer; font-weight: 600; }}
+      .thinking pre {{ white-space: pre-wrap; word-wrap: break-word; margin: 6px 0 0 0; font-family: inherit; }}
+
       footer {{ height: 24px; }}
     </style>
     <body>
@@ -191,9 +242,37 @@ def get_html(transcript):
           setTimeout(() => ro.disconnect(), 800);
         }}
 
+        // thinking traces are fetched when opened, and opened again after the page is re-rendered
+        const OPEN_KEY = 'eric-chat-open-thinking';
+        function openThinking() {{
+          return new Set(JSON.parse(sessionStorage.getItem(OPEN_KEY) || '[]'));
+        }}
+        function loadThinking(details) {{
+          if (!details.open || details.dataset.loaded) return;
+          details.dataset.loaded = '1';
+          fetch(details.dataset.src).then(r => r.ok ? r.text() : Promise.reject())
+            .then(text => {{ details.querySelector('pre').textContent = text; }})
+            .catch(() => {{ delete details.dataset.loaded; }});
+        }}
+        document.addEventListener('toggle', (e) => {{
+          const details = e.target;
+          if (!details.dataset || !details.dataset.src) return;
+          const open = openThinking();
+          if (details.open) open.add(details.dataset.src); else open.delete(details.dataset.src);
+          sessionStorage.setItem(OPEN_KEY, JSON.stringify([...open]));
+          loadThinking(details);
+        }}, true);
+
         document.addEventListener('DOMContentLoaded', () => {{
+          const open = openThinking();
+          document.querySelectorAll('details.thinking').forEach(details => {{
+            if (open.has(details.dataset.src)) details.open = true;
+          }});
           const stored = sessionStorage.getItem(SCROLL_KEY);
-          if (stored !== null) {{
+          const jumpTo = '{jump_id}' ? document.getElementById('{jump_id}') : null;
+          if (jumpTo) {{
+            whenLayoutReady().finally(() => jumpTo.scrollIntoView({{ block: 'center', behavior: 'auto' }}));
+          }} else if (stored !== null) {{
             const y = parseInt(stored, 10) || 0;
             whenLayoutReady().finally(() => robustRestore(y));
           }} else {{
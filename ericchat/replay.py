@@ -0,0 +1,51 @@
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+from erictransformer import CHATCallArgs
+
+from .backends import ReplayChatBackend
+from .eric_state import EricUIState
+
+
+def replay_trace(path: Path, speed: float = 0.0, render: bool = True) -> Dict[str, float]:
+    # Plays a trace through ReplayChatBackend, EricUIState.stream_step and render_html the way
+    # _do_inference and _apply_stream_piece_ui do, without a window, and times each stage.
+    render_html = None
+    if render:
+        from .message_html import render_html
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = EricUIState(Path(tmp), backend="replay")
+        backend = ReplayChatBackend(str(path), speed=speed)
+
+        messages = state.user_input("Replay")
+        state.in_inference = True
+        step_ms, render_ms = [], []
+        pieces = 0
+        start = time.perf_counter()
+        for piece in backend.stream(messages, CHATCallArgs()):
+            t = time.perf_counter()
+            state.stream_step(piece)
+            step_ms.append((time.perf_counter() - t) * 1000)
+            pieces += 1
+            if render_html is not None and state.should_update_ui:
+                t = time.perf_counter()
+                render_html(state)
+                render_ms.append((time.perf_counter() - t) * 1000)
+        state.finish_chat()
+        seconds = time.perf_counter() - start
+
+    step_ms.sort()
+    render_ms.sort()
+    return {
+        "pieces": pieces,
+        "seconds": seconds,
+        "pieces_per_second": pieces / seconds if seconds else 0.0,
+        "stream_step_p50_ms": step_ms[len(step_ms) // 2] if step_ms else 0.0,
+        "stream_step_p99_ms": step_ms[int(len(step_ms) * 0.99)] if step_ms else 0.0,
+        "renders": len(render_ms),
+        "render_p50_ms": render_ms[len(render_ms) // 2] if render_ms else 0.0,
+        "render_max_ms": render_ms[-1] if render_ms else 0.0,
+    }
@@ -1,6 +1,41 @@
-from .available_memory import get_memory
-from .available_models import ModelDetails, available_model_factory
-from .chat_message import ChatMessage
+from .app_paths import get_data_dir, get_journal_path
+from .available_memory import PeakMemory, get_memory
+from .available_models import (ModelDetails, available_model_factory,
+                               find_model)
+from .chat_message import ChatMessage, message_from_dict, message_to_dict
+from .convo_archive import read_archive, write_archive
+from .convo_journal import ConvoJournal
+from .convo_tree import ConvoTree
 from .download_model import BytesCallback
+from .downloads import BUSY_BYTES_PER_SECOND, DownloadControl, set_io_priority
+from .generation_cache import CACHE_HIT_TELEMETRY, GenerationCache
 from .get_mlx import get_eric_chat_mlx
+from .kv_cache import (ATTENTION_SINKS, CHARS_PER_TOKEN, KV_CACHE_MODES,
+                       KV_GROUP_SIZE, KVShape, kv_cache_bytes, read_kv_shape,
+                       trimmable_kv_cache)
+from .model_profiles import ModelProfile, ProfileStore, StreamSpeed
+from .model_store import ModelStore, file_sha256
+from .model_source import (MANIFEST_TTL, MODEL_SOURCE_ENV, DirectorySource,
+                           HFCacheSource, HubSource, ManifestCache,
+                           ModelSource, SourceFile, get_model_source,
+                           install_model, installed_revision, place_file,
+                           verify_install)
+from .prefetch import (PREFETCH_WORKERS, WEIGHT_SUFFIXES, Prefetcher, evict,
+                       fits_in_memory, weight_files)
+from .prefill import PrefillProgress
+from .profiling import LoopLagMonitor, SamplingProfiler, Tracer
+from .repetition import (STEER_PROMPT, WATCHDOG_ACTIONS, RepetitionLoop,
+                         RepetitionWatchdog)
+from .retrieval import (EMBEDDER_ENV, HashingEmbedder, RetrievedChunk,
+                        Retriever, TransformersEmbedder, VectorIndex,
+                        chunk_lines, get_embedder, ingest, iter_files)
+from .search_index import ConvoSearchIndex, SearchHit
+from .speculative import (DraftController, FakeDraftModel, FakeTargetModel,
+                          SimClock, SpeculativeModel, speculative_generate)
+from .stream_trace import (StreamRecorder, read_trace,
+                           read_trace_header)
+from .tasks import (CancelToken, Task, TaskCancelled, TaskEvent,
+                    TaskManager)
+from .thinking_server import ThinkingServer
+from .thinking_trace import THINKING_STRATEGIES, ThinkingTrace
 from .tps import TPSTracker
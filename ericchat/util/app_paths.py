@@ -0,0 +1,16 @@
+import os
+import sys
+from pathlib import Path
+
+APP_ID = "com.ericchat.app"
+
+
+def get_data_dir() -> Path:
+    # Same folder as toga's App.paths.data, for tools that run without the GUI.
+    if sys.platform == "darwin":
+        return Path.home() / f"Library/Application Support/{APP_ID}"
+    return Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local/share")) / "ericchat"
+
+
+def get_journal_path(data_dir: Path) -> Path:
+    return Path(data_dir) / "conversations" / "journal.jsonl"
@@ -1,3 +1,6 @@
+import threading
+from typing import Optional
+
 import psutil
 
 def get_memory():
@@ -6,3 +9,47 @@ def get_memory():
     available_gb = available/(1024*1024*1024)
 
     return available_gb
+
+
+class PeakMemory:
+    # RSS of a process (this one by default) and its children (a ProcessChatBackend worker), sampled
+    # from a thread. growth is how far the peak rose over the first sample: what a model loaded in
+    # between takes, without the memory the app already used.
+    def __init__(self, interval: float = 0.05, pid: Optional[int] = None):
+        self.interval = interval
+        self.pid = pid
+        self.start: Optional[int] = None
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="peak memory", daemon=True)
+
+    def sample(self) -> int:
+        process = psutil.Process(self.pid)
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, rss)
+        if self.start is None:
+            self.start = rss
+        return rss
+
+    @property
+    def growth(self) -> int:
+        return max(0, self.peak - (self.start or 0))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
@@ -2,7 +2,10 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Optional, Tuple
 
-from .notices import (get_gpt_oss_20b_notice, get_gpt_oss_120b_notice,
+from .model_source import DETAILS_FILE
+from .notices import (get_fake_notice, get_gpt_oss_20b_cpu_notice,
+                      get_gpt_oss_20b_notice, get_gpt_oss_120b_notice,
+                      get_replay_notice, get_smol_3b_cpu_notice,
                       get_smol_3b_notice)
 
 
@@ -17,6 +20,9 @@ class ModelDetails:
     is_downloaded: bool
     details_path: Optional[Path]
     notice: str
+    backend: str = "mlx"
+    # short_name of a smaller model with the same tokenizer, used as the draft for speculative decoding
+    draft_short_name: Optional[str] = None
 
 def _make_model(
     model_dir: Path,
@@ -26,13 +32,18 @@ def _make_model(
     subdir: str,
     check_redownload: bool,
     memory: int,
-    notice: str
+    notice: str,
+    backend: str = "mlx"
 ) -> ModelDetails:
     path = Path(model_dir) / f"default/{subdir}"
+    if path.is_symlink() and not path.exists():
+        # its snapshot in the model store was removed
+        path.unlink()
     path.mkdir(parents=True, exist_ok=True)
 
-    details_path = path / "erictransformer_details.json"
-    is_downloaded = details_path.exists()
+    details_path = path / DETAILS_FILE
+    # models without an hf_id have nothing to download
+    is_downloaded = details_path.exists() or hf_id is None
 
     prefix = "💾" if (is_downloaded or check_redownload) else "🔗"
     display_name = f"{prefix} {label}: {short_name}"
@@ -46,13 +57,14 @@ def _make_model(
         save_path=path,
         is_downloaded=is_downloaded,
         details_path=details_path,
-        notice=notice
+        notice=notice,
+        backend=backend
     )
 
 
-def available_model_factory(model_dir: Path, check_redownload: bool = False) -> Tuple[Dict[str, ModelDetails], str]:
+def available_model_factory(model_dir: Path, check_redownload: bool = False, backend: str = "mlx") -> Tuple[Dict[str, ModelDetails], str]:
     # Define once; easy to extend with new sizes.
-    configs = [
+    mlx_configs = [
 
         # We set required_memory to 0 for each model.
         # This is okay because we show recommended memory for each model at the top of the notice.
@@ -64,13 +76,47 @@ def available_model_factory(model_dir: Path, check_redownload: bool = False) ->
         ("120B", "EricFillion/gpt-oss-120b-mlx", "EricFillion/gpt-oss-120b-mlx", "ericfillion_gpt_oss_120b_mlx", 0, get_gpt_oss_120b_notice()),
     ]
 
+    # the MLX weights can't be loaded by transformers, so the CPU backend uses the original checkpoints
+    cpu_configs = [
+        ("3B", "HuggingFaceTB/SmolLM3-3B", "HuggingFaceTB/SmolLM3-3B", "huggingfacetb_smollm3_3b", 0, get_smol_3b_cpu_notice()),
+        ("20B", "openai/gpt-oss-20b", "openai/gpt-oss-20b", "openai_gpt_oss_20b", 0, get_gpt_oss_20b_cpu_notice()),
+    ]
+
+    fake_configs = [
+        ("Fake", "fake", None, "fake", 0, get_fake_notice()),
+    ]
+
+    # the model folder holds the traces to replay
+    replay_configs = [
+        ("Replay", "replay", None, "replay", 0, get_replay_notice(Path(model_dir) / "default/replay")),
+    ]
+
+    configs = {"mlx": mlx_configs, "cpu": cpu_configs, "fake": fake_configs, "replay": replay_configs}[backend]
+
     models = [
-        _make_model(model_dir, label, short_name, hf_id, subdir, check_redownload, memory, notice)
+        _make_model(model_dir, label, short_name, hf_id, subdir, check_redownload, memory, notice, backend)
         for (label, short_name, hf_id, subdir, memory, notice) in configs
     ]
 
+    # Speculative decoding checks the draft token by token, so the draft needs the target's tokenizer,
+    # and drops rejected drafts from both KV caches, which needs caches that can be trimmed (see
+    # trimmable_kv_cache). gpt-oss-20b shares 120B's tokenizer, but their sliding window layers keep
+    # 128 tokens in rotating caches: no answer would ever be decoded speculatively. No pair for now.
+    drafts: Dict[str, str] = {}
+    for m in models:
+        m.draft_short_name = drafts.get(m.short_name)
+
     # Keep return shape: keys are the user-facing names, value is ModelDetails.
     model_map = {m.name: m for m in models}
     default_name = models[0].name  # The smallest is the default
 
     return model_map, default_name
+
+
+def find_model(models: Dict[str, ModelDetails], name: str) -> Optional[ModelDetails]:
+    # by label ("20B") or short name ("EricFillion/gpt-oss-20b-mlx"), for the command line tools
+    for m in models.values():
+        label = m.name.split(" ", 1)[1].split(":")[0]
+        if name in (m.short_name, label):
+            return m
+    return None
@@ -1,4 +1,7 @@
 from dataclasses import dataclass
+from typing import Optional
+
+from .thinking_trace import ThinkingTrace
 
 
 @dataclass
@@ -9,3 +12,54 @@ class ChatMessage:
     expanded_text: str = ""
     expanded_role: str = ""
     tps: float = 0
+    # share of draft tokens the model accepted, 0 without speculative decoding
+    draft_acceptance: float = 0
+    # why generation ended early: "cancelled", "max_len" or a repetition the watchdog caught
+    stop_reason: str = ""
+    # replayed from the generation cache instead of generated
+    cached: bool = False
+    thinking: Optional[ThinkingTrace] = None
+    # position in the convo's ConvoTree, -1 until the message is added to one
+    node_id: int = -1
+    parent_id: int = -1
+
+
+def message_to_dict(msg: ChatMessage) -> dict:
+    out = {"text": msg.text, "role": msg.role, "marker": msg.marker, "tps": msg.tps}
+    if msg.expanded_text:
+        out["expanded_text"] = msg.expanded_text
+        out["expanded_role"] = msg.expanded_role
+    if msg.node_id >= 0:
+        out["n"] = msg.node_id
+        out["p"] = msg.parent_id
+    if msg.stop_reason:
+        out["stop_reason"] = msg.stop_reason
+    if msg.draft_acceptance:
+        out["draft_acceptance"] = msg.draft_acceptance
+    if msg.cached:
+        out["cached"] = True
+    if msg.thinking is not None and len(msg.thinking):
+        out["thinking"] = msg.thinking.text()
+        out["thinking_chars"] = msg.thinking.total_chars
+    return out
+
+
+def message_from_dict(data: dict, thinking_max_chars: int = 200_000, thinking_strategy: str = "head_tail") -> ChatMessage:
+    thinking = None
+    if data.get("thinking"):
+        # keep the original length so the "dropped" count survives a round trip
+        thinking = ThinkingTrace.from_text(data["thinking"], total_chars=data.get("thinking_chars", 0),
+                                           max_chars=thinking_max_chars, strategy=thinking_strategy)
+
+    return ChatMessage(text=data.get("text", ""),
+                       role=data.get("role", ""),
+                       marker=data.get("marker", ""),
+                       expanded_text=data.get("expanded_text", ""),
+                       expanded_role=data.get("expanded_role", ""),
+                       tps=float(data.get("tps", 0) or 0),
+                       draft_acceptance=float(data.get("draft_acceptance", 0) or 0),
+                       stop_reason=data.get("stop_reason", ""),
+                       cached=bool(data.get("cached", False)),
+                       thinking=thinking,
+                       node_id=int(data.get("n", -1)),
+                       parent_id=int(data.get("p", -1)))
@@ -0,0 +1,121 @@
+import importlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .chat_message import ChatMessage, message_from_dict, message_to_dict
+
+# An archive is JSON lines, optionally zstd compressed when the file name ends in ".zst":
+#   {"ericchat_archive": 1}                 header
+#   {"c": convo_key, "m": {...}}            one line per message, in order within a convo
+# Convos may interleave, the key only has to be unique inside one archive.
+ARCHIVE_VERSION = 1
+
+ProgressCallback = Callable[[int, int, int], None]  # (messages, bytes done, total bytes)
+
+
+def get_zstd():
+    try:
+        return importlib.import_module("zstandard")
+    except Exception:
+        return None
+
+
+def _is_zstd(path: Path) -> bool:
+    return Path(path).suffix == ".zst"
+
+
+def _require_zstd():
+    zstd = get_zstd()
+    if zstd is None:
+        raise ValueError("Compressed archives need the 'zstandard' package. Install it or use a .jsonl file.")
+    return zstd
+
+
+def write_archive(path: Path, messages: Iterable[Tuple[int, ChatMessage]],
+                  progress: Optional[ProgressCallback] = None, progress_every: int = 256) -> int:
+    # Writes one message at a time. Nothing but the current line is held in memory.
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".part")
+    count = 0
+
+    with open(tmp_path, "wb") as raw:
+        out = _require_zstd().ZstdCompressor(level=10).stream_writer(raw, closefd=False) if _is_zstd(path) else raw
+        try:
+            out.write(json.dumps({"ericchat_archive": ARCHIVE_VERSION}).encode("utf-8") + b"\n")
+            for convo_key, msg in messages:
+                line = json.dumps({"c": convo_key, "m": message_to_dict(msg)}, ensure_ascii=False)
+                out.write(line.encode("utf-8") + b"\n")
+                count += 1
+                if progress is not None and count % progress_every == 0:
+                    progress(count, raw.tell(), 0)
+        finally:
+            if out is not raw:
+                out.close()
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    os.replace(tmp_path, path)
+    if progress is not None:
+        progress(count, path.stat().st_size, path.stat().st_size)
+    return count
+
+
+def read_archive(path: Path, chunk_size: int = 512, progress: Optional[ProgressCallback] = None,
+                 **message_kwargs) -> Iterator[List[Tuple[int, ChatMessage]]]:
+    # Yields lists of at most chunk_size (convo_key, ChatMessage), reading the file as a stream.
+    path = Path(path)
+    total = path.stat().st_size
+
+    with open(path, "rb") as raw:
+        source = _require_zstd().ZstdDecompressor().stream_reader(raw, closefd=False) if _is_zstd(path) else raw
+        lines = _iter_lines(source)
+
+        header = json.loads(next(lines, b"{}") or b"{}")
+        version = header.get("ericchat_archive")
+        if version is None:
+            raise ValueError(f"{path.name} is not an Eric Chat archive")
+        if version > ARCHIVE_VERSION:
+            raise ValueError(f"{path.name} was written by a newer version of Eric Chat")
+
+        chunk = []
+        count = 0
+        broken = None
+        for line in lines:
+            if not line.strip():
+                continue
+            if broken is not None:
+                raise broken
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # only allowed as the last line: a copy that was cut off keeps the messages before it
+                broken = ValueError(f"{path.name} has a broken line after {count} messages")
+                continue
+            chunk.append((record["c"], message_from_dict(record["m"], **message_kwargs)))
+            count += 1
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+                if progress is not None:
+                    progress(count, raw.tell(), total)
+        if chunk:
+            yield chunk
+        if progress is not None:
+            progress(count, total, total)
+
+
+def _iter_lines(source, block_size: int = 1024 * 1024) -> Iterator[bytes]:
+    # zstd stream readers don't support readline(), so split blocks ourselves
+    rest = b""
+    while True:
+        block = source.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        parts = block.split(b"\n")
+        rest = parts.pop()
+        yield from parts
+    if rest:
+        yield rest
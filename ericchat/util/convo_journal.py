@@ -0,0 +1,352 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .chat_message import ChatMessage, message_from_dict, message_to_dict
+from .convo_tree import ROOT, ConvoTree
+from .thinking_trace import ThinkingTrace
+
+RECOVERED_NOTE = "\n\n**Recovered after an unexpected exit.**"
+
+
+class ConvoJournal:
+    # Write-behind, append-only journal of conversation changes.
+    #
+    # EricUIState calls the record_* methods from the UI thread. They only touch an in-memory queue,
+    # a background thread turns the queue into JSON lines and writes it with a single fsync when
+    # flush_interval has passed or max_pending records are waiting. Streamed tokens are coalesced into
+    # one "partial" record per message so a crash mid-generation can be recovered by replay(). The
+    # committed answer drops the partial records that haven't been written yet.
+    #
+    # Record types, one JSON object per line:
+    #   {"op": "new", "c": convo_id}
+    #   {"op": "msg", "c": convo_id, "i": message_index, "m": {...}}   committed message, drops the partial
+    #   {"op": "partial", "c": convo_id, "p": parent_id, "t": text_delta, "k": thinking_delta}
+    #   {"op": "leaf", "c": convo_id, "n": node_id}                    switched to another branch
+    #   {"op": "delete", "c": convo_id}
+    # "m" carries the message's node and parent ids ("n", "p"), replay rebuilds each convo's ConvoTree.
+    def __init__(self, path: Path, flush_interval: float = 1.0, max_pending: int = 256, fsync: bool = True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+
+        self.pending: List[dict] = []
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.closed = False
+
+        # write amplification counters: payload is what the user/model produced, counted once even when
+        # it's written as partial records and again in its message, written is what hit the disk
+        self.records_submitted = 0
+        self.records_written = 0
+        self.payload_bytes = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        # payload of the partial records of each convo's answer in progress
+        self.streamed: Dict[int, int] = {}
+
+        self.file = None
+        self.thread = None
+
+    def _drop_torn_tail(self):
+        # a record cut off by a crash would swallow the first record appended after it
+        if not self.path.exists():
+            return
+        with open(self.path, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - 65536)
+                f.seek(start)
+                block = f.read(pos - start)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def start(self):
+        self._drop_torn_tail()
+        self.file = open(self.path, "ab")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                deadline = time.monotonic() + self.flush_interval
+                while not self.closed and len(self.pending) < self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.wake.wait(remaining)
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+    def _submit(self, record: dict, payload: int = 0):
+        with self.lock:
+            self.records_submitted += 1
+            self.payload_bytes += payload
+            self.pending.append(record)
+            if len(self.pending) >= self.max_pending:
+                self.wake.notify()
+
+    def record_new(self, convo_id: int):
+        self._submit({"op": "new", "c": convo_id})
+
+    def record_message(self, convo_id: int, message_index: int, msg: ChatMessage):
+        data = message_to_dict(msg)
+        payload = len(data["text"]) + len(data.get("thinking", ""))
+        if msg.role == "assistant":
+            with self.lock:
+                # the answer was already counted token by token, and its partials still in memory are moot
+                payload = max(0, payload - self.streamed.pop(convo_id, 0))
+                self.pending = [r for r in self.pending if not (r["op"] == "partial" and r["c"] == convo_id)]
+        self._submit({"op": "msg", "c": convo_id, "i": message_index, "m": data}, payload=payload)
+
+    def record_partial(self, convo_id: int, text: str = "", thinking: str = "", parent_id: Optional[int] = None):
+        # parent_id is the node the answer will be added under, e.g. the prompt of a regenerated answer
+        if not text and not thinking:
+            return
+        with self.lock:
+            self.records_submitted += 1
+            self.payload_bytes += len(text) + len(thinking)
+            self.streamed[convo_id] = self.streamed.get(convo_id, 0) + len(text) + len(thinking)
+            last = self.pending[-1] if self.pending else None
+            # coalesce consecutive tokens of the same stream into one record
+            if (last is not None and last["op"] == "partial" and last["c"] == convo_id
+                    and last.get("p") == parent_id):
+                if text:
+                    last["t"] = last.get("t", "") + text
+                if thinking:
+                    last["k"] = last.get("k", "") + thinking
+                return
+            record = {"op": "partial", "c": convo_id}
+            if parent_id is not None:
+                record["p"] = parent_id
+            if text:
+                record["t"] = text
+            if thinking:
+                record["k"] = thinking
+            self.pending.append(record)
+
+    def record_leaf(self, convo_id: int, node_id: int):
+        self._submit({"op": "leaf", "c": convo_id, "n": node_id})
+
+    def record_delete(self, convo_id: int):
+        with self.lock:
+            self.records_submitted += 1
+            # a convo that never reached the disk doesn't need to be written at all
+            unflushed_new = any(r["op"] == "new" and r["c"] == convo_id for r in self.pending)
+            self.pending = [r for r in self.pending if r["c"] != convo_id]
+            self.streamed.pop(convo_id, None)
+            if not unflushed_new:
+                self.pending.append({"op": "delete", "c": convo_id})
+
+    def flush(self):
+        with self.lock:
+            records, self.pending = self.pending, []
+        if not records or self.file is None:
+            return
+
+        data = b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in records)
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+
+        self.records_written += len(records)
+        self.bytes_written += len(data)
+        self.flushes += 1
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "records_submitted": self.records_submitted,
+            "records_written": self.records_written,
+            "payload_bytes": self.payload_bytes,
+            "bytes_written": self.bytes_written,
+            "flushes": self.flushes,
+            "fsyncs": self.fsyncs,
+            "write_amplification": self.bytes_written / self.payload_bytes if self.payload_bytes else 0.0,
+        }
+
+    def replay(self, thinking_max_chars: int = 200_000, thinking_strategy: str = "head_tail") -> List[Tuple[int, ConvoTree]]:
+        # Rebuild the conversations in creation order. A partial answer without its final "msg" record
+        # is turned into a regular assistant message so nothing that was streamed is lost.
+        if not self.path.exists():
+            return []
+
+        convos: Dict[int, ConvoTree] = {}
+        leaves: Dict[int, int] = {}
+        partials: Dict[int, List[List[str]]] = {}
+        partial_parents: Dict[int, int] = {}
+
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the file
+                    break
+
+                op = record.get("op")
+                convo_id = record.get("c")
+                if op == "new":
+                    convos.setdefault(convo_id, ConvoTree())
+                elif op == "msg":
+                    tree = convos.setdefault(convo_id, ConvoTree())
+                    msg = message_from_dict(record["m"], thinking_max_chars=thinking_max_chars, thinking_strategy=thinking_strategy)
+                    if msg.node_id < 0:
+                        # written before conversations could branch
+                        tree.append(msg)
+                    else:
+                        tree.add(msg)
+                    leaves.pop(convo_id, None)
+                    if msg.role == "assistant":
+                        partials.pop(convo_id, None)
+                elif op == "leaf":
+                    leaves[convo_id] = record.get("n", ROOT)
+                elif op == "partial":
+                    parts = partials.setdefault(convo_id, [[], []])
+                    parts[0].append(record.get("t", ""))
+                    parts[1].append(record.get("k", ""))
+                    if "p" in record:
+                        partial_parents[convo_id] = record["p"]
+                elif op == "delete":
+                    convos.pop(convo_id, None)
+                    partials.pop(convo_id, None)
+
+        for convo_id, tree in convos.items():
+            # the branch that was open last: the last switch, or else the newest message's branch
+            leaf = leaves.get(convo_id)
+            if leaf is not None and leaf in tree.nodes:
+                tree.select(leaf)
+            elif tree.nodes:
+                tree.select(max(tree.nodes))
+
+        for convo_id, (text_parts, thinking_parts) in partials.items():
+            if convo_id not in convos:
+                continue
+            thinking = None
+            if any(thinking_parts):
+                # the stream was never capped on disk, so cap it now like stream_step would have
+                thinking = ThinkingTrace(max_chars=thinking_max_chars, strategy=thinking_strategy)
+                for part in thinking_parts:
+                    thinking.append(part)
+            msg = ChatMessage(text="".join(text_parts) + RECOVERED_NOTE, role="assistant", marker="text",
+                              thinking=thinking)
+            tree = convos[convo_id]
+            parent_id = partial_parents.get(convo_id)
+            if parent_id is not None and (parent_id == ROOT or parent_id in tree.nodes):
+                # under the node it was streamed for, a regenerated answer is a sibling of the old one
+                msg.parent_id = parent_id
+                tree.add(msg)
+                tree.select(msg.node_id)
+            else:
+                # written before partials had a parent
+                tree.append(msg)
+
+        return sorted(convos.items())
+
+    def max_convo_id(self) -> int:
+        # streamed, for appending to a journal without replaying it
+        max_id = -1
+        if not self.path.exists():
+            return max_id
+        with open(self.path, "rb") as f:
+            for line in f:
+                if b'"new"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "new":
+                    max_id = max(max_id, int(record["c"]))
+        return max_id
+
+    def iter_messages(self, thinking_max_chars: int = 200_000, thinking_strategy: str = "head_tail") -> Iterator[Tuple[int, ChatMessage]]:
+        # Committed messages of every convo that wasn't deleted, streamed in two passes over the file
+        # so only the set of deleted ids is held in memory. Used to export without opening the app.
+        if not self.path.exists():
+            return
+
+        deleted = set()
+        with open(self.path, "rb") as f:
+            for line in f:
+                if b'"delete"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "delete":
+                    deleted.add(record.get("c"))
+
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "msg" and record.get("c") not in deleted:
+                    yield record["c"], message_from_dict(record["m"], thinking_max_chars=thinking_max_chars,
+                                                         thinking_strategy=thinking_strategy)
+
+    def compact(self, convos: List[Tuple[int, ConvoTree]]):
+        # Replace the journal with one "new" + "msg" records per surviving convo, every branch included.
+        # Written to a temp file and renamed so a crash leaves either the old or the new journal.
+        was_open = self.file is not None
+        if was_open:
+            self.flush()
+            self.file.close()
+
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            for convo_id, tree in convos:
+                f.write(json.dumps({"op": "new", "c": convo_id}).encode("utf-8") + b"\n")
+                for i, msg in enumerate(tree.iter_nodes()):
+                    record = {"op": "msg", "c": convo_id, "i": i, "m": message_to_dict(msg)}
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                if tree.nodes:
+                    f.write(json.dumps({"op": "leaf", "c": convo_id, "n": tree.leaf}).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        dir_fd = None
+        try:
+            dir_fd = os.open(self.path.parent, os.O_RDONLY)
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+        if was_open:
+            self.file = open(self.path, "ab")
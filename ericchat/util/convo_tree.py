@@ -0,0 +1,135 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .chat_message import ChatMessage
+
+ROOT = -1
+
+
+class ConvoTree:
+    # A conversation with branches. Every message is stored once as a node (msg.node_id) pointing to
+    # its parent (msg.parent_id), so branches share their common prefix and memory grows with unique
+    # messages, not with the number of branches.
+    #
+    # The tree reads like the list of messages on the active branch, the one ending at self.leaf:
+    # len(), indexing, iteration and append() all work on that path. fork() makes the next append
+    # start a sibling branch, select() switches to another branch.
+    def __init__(self):
+        self.nodes: Dict[int, ChatMessage] = {}
+        self.children: Dict[int, List[int]] = {}  # parent id -> child ids, oldest first
+        # the child last visited under each node, so switching back to a branch restores all of it
+        self.active_child: Dict[int, int] = {}
+        self.leaf = ROOT
+        self.next_id = 0
+        self._path: List[ChatMessage] = []
+
+    # list view of the active branch
+    def __len__(self) -> int:
+        return len(self._path)
+
+    def __getitem__(self, index):
+        return self._path[index]
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        return iter(self._path)
+
+    def __bool__(self) -> bool:
+        return bool(self._path)
+
+    def append(self, msg: ChatMessage) -> ChatMessage:
+        # O(1): a new node under the leaf, which becomes the new leaf
+        msg.node_id = self.next_id
+        msg.parent_id = self.leaf
+        self._link(msg)
+        self.leaf = msg.node_id
+        self._path.append(msg)
+        return msg
+
+    def add(self, msg: ChatMessage):
+        # a node that already has its ids, e.g. from the journal or an archive. It extends the active
+        # branch when it continues the leaf, otherwise it's a branch to select() later.
+        if msg.node_id < 0:
+            msg.node_id = self.next_id
+        elif msg.node_id in self.nodes:
+            # recorded twice, keep the newer copy
+            old = self.nodes[msg.node_id]
+            self.nodes[msg.node_id] = msg
+            self._path = [msg if m is old else m for m in self._path]
+            return
+        self._link(msg)
+        if msg.parent_id == self.leaf:
+            self.leaf = msg.node_id
+            self._path.append(msg)
+
+    def _link(self, msg: ChatMessage):
+        self.nodes[msg.node_id] = msg
+        self.children.setdefault(msg.parent_id, []).append(msg.node_id)
+        self.active_child[msg.parent_id] = msg.node_id
+        self.next_id = max(self.next_id, msg.node_id + 1)
+
+    def fork(self, index: int):
+        # the next append becomes a sibling of the message at index, nothing is copied or deleted
+        self.leaf = self._path[index].parent_id
+        del self._path[index:]
+
+    def select(self, node_id: int):
+        # switch to the branch through node_id, continuing down the children last visited under it
+        while node_id in self.active_child:
+            node_id = self.active_child[node_id]
+        self.leaf = node_id
+        self._rebuild_path()
+
+    def _rebuild_path(self):
+        path = []
+        node_id = self.leaf
+        while node_id != ROOT:
+            msg = self.nodes[node_id]
+            path.append(msg)
+            self.active_child[msg.parent_id] = node_id
+            node_id = msg.parent_id
+        path.reverse()
+        self._path = path
+
+    def siblings(self, index: int) -> Tuple[int, int]:
+        # (position among its siblings, number of siblings) of the message at index
+        msg = self._path[index]
+        siblings = self.children.get(msg.parent_id, [])
+        return siblings.index(msg.node_id), len(siblings)
+
+    def switch_sibling(self, index: int, step: int) -> bool:
+        msg = self._path[index]
+        siblings = self.children.get(msg.parent_id, [])
+        position = siblings.index(msg.node_id) + step
+        if not 0 <= position < len(siblings):
+            return False
+        # a sibling branch starts below it, reuse its last visited path
+        self.active_child[msg.parent_id] = siblings[position]
+        self.select(siblings[position])
+        return True
+
+    def index_of(self, node_id: int) -> Optional[int]:
+        # position of a node on the active branch, switching to its branch first if needed
+        if node_id not in self.nodes:
+            return None
+        msg = self.nodes[node_id]
+        if not any(m is msg for m in self._path):
+            self.select(node_id)
+        for i, m in enumerate(self._path):
+            if m is msg:
+                return i
+        return None
+
+    def iter_nodes(self) -> Iterator[ChatMessage]:
+        # every message of every branch, parents before children
+        for node_id in sorted(self.nodes):
+            yield self.nodes[node_id]
+
+    @classmethod
+    def from_messages(cls, messages: List[ChatMessage]) -> "ConvoTree":
+        # nodes with ids form a tree, messages saved before branching existed form one branch
+        tree = cls()
+        for msg in messages:
+            if msg.node_id < 0:
+                tree.append(msg)
+            else:
+                tree.add(msg)
+        return tree
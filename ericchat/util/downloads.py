@@ -0,0 +1,119 @@
+import ctypes
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+import psutil
+
+from .tasks import CancelToken
+
+# While the model generates, downloads are held to this rate and their disk IO is marked low priority,
+# so a model that is being used keeps its speed while another one downloads
+BUSY_BYTES_PER_SECOND = 20 * 1024 * 1024
+
+
+def set_io_priority(low: bool) -> bool:
+    # Disk priority of the calling thread: throttled on macOS, idle class on Linux. Best effort,
+    # False when the platform doesn't allow it.
+    try:
+        if sys.platform == "darwin":
+            # setiopolicy_np(IOPOL_TYPE_DISK, IOPOL_SCOPE_THREAD, IOPOL_THROTTLE or IOPOL_DEFAULT)
+            libc = ctypes.CDLL(None, use_errno=True)
+            return libc.setiopolicy_np(0, 1, 3 if low else 0) == 0
+        if sys.platform.startswith("linux"):
+            # a thread id works as a pid for ioprio_set
+            thread = psutil.Process(threading.get_native_id())
+            if low:
+                thread.ionice(psutil.IOPRIO_CLASS_IDLE)
+            else:
+                thread.ionice(psutil.IOPRIO_CLASS_BE, value=4)
+            return True
+    except (AttributeError, OSError, psutil.Error):
+        pass
+    return False
+
+
+class DownloadControl:
+    # Shared by the download tasks and the UI. gate() is install_model's gate callback, waiting in it
+    # is how a download is paused and held to its rate: the source doesn't read on until it returns.
+    #   max_bytes_per_second   the cap set by the user, 0 for none
+    #   busy_bytes_per_second  the cap while is_busy() is True, e.g. while the model generates
+    def __init__(self, max_bytes_per_second: int = 0, busy_bytes_per_second: int = BUSY_BYTES_PER_SECOND,
+                 is_busy: Optional[Callable[[], bool]] = None):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.busy_bytes_per_second = busy_bytes_per_second
+        self.is_busy = is_busy
+        self._running = threading.Event()
+        self._running.set()
+        self._lock = threading.Lock()
+        self._due = 0.0
+        self._low_priority = False
+        # bytes per second over the last few seconds, for the indicator
+        self.speed = 0.0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def rate(self) -> int:
+        busy = self.is_busy is not None and self.is_busy()
+        rates = [r for r in (self.max_bytes_per_second, self.busy_bytes_per_second if busy else 0) if r > 0]
+        return min(rates) if rates else 0
+
+    def start(self):
+        # called on the download thread before a download
+        with self._lock:
+            self._due = 0.0
+            self.speed = 0.0
+            self._window_start = time.monotonic()
+            self._window_bytes = 0
+
+    def gate(self, n: int, token: Optional[CancelToken] = None):
+        # n bytes were just read, returns when the next block may be read
+        while not self._running.is_set():
+            self.speed = 0.0
+            self._running.wait(0.25)
+            if token is not None:
+                token.raise_if_cancelled()
+        with self._lock:
+            now = time.monotonic()
+            self._window_bytes += n
+            if now - self._window_start >= 1.0:
+                self.speed = self._window_bytes / (now - self._window_start)
+                self._window_start = now
+                self._window_bytes = 0
+
+            busy = self.is_busy is not None and self.is_busy()
+            if busy != self._low_priority:
+                self._low_priority = busy
+                set_io_priority(busy)
+            rate = self.rate()
+            if not rate:
+                self._due = 0.0
+                return
+            # paced, not bursty: each block is due its size / rate after the one before, a pause or a
+            # slow source doesn't earn a burst afterwards
+            self._due = max(self._due, now) + n / rate
+            wait = self._due - now
+        if wait > 0:
+            if token is not None:
+                if token.wait(wait):
+                    token.raise_if_cancelled()
+            else:
+                time.sleep(wait)
+
+    def finish(self):
+        with self._lock:
+            self.speed = 0.0
+            if self._low_priority:
+                self._low_priority = False
+                set_io_priority(False)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .stream_trace import StreamRecorder, read_trace
+
+# telemetry on every replayed piece, EricUIState marks the message as cached
+CACHE_HIT_TELEMETRY = {"cache_hit": 1.0}
+
+
+class GenerationCache:
+    # Answers of deterministic generations, keyed by (model, messages, sampling settings). Entries
+    # are stream traces (see util/stream_trace.py), so a hit replays piece by piece through the same
+    # stream_step path as the model. Bounded by total size, the least recently used entries go first.
+    # Recency is the file's mtime, touched on every hit, so the LRU order survives restarts.
+    VERSION = 1
+
+    def __init__(self, root: Path, max_bytes: int = 256 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        # key -> size, oldest first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        found = []
+        for path in self.root.glob("*/*.jsonl"):
+            stat = path.stat()
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+        self.total_bytes = sum(self.entries.values())
+        for path in self.root.glob("*/.*.part"):
+            path.unlink()
+
+    @staticmethod
+    def is_deterministic(args) -> bool:
+        # only greedy decoding repeats its answer, mlx-lm treats top_p 0 as no nucleus filtering and
+        # still samples. The lowest creativity sets temp to 0.
+        return args.temp == 0
+
+    def key(self, model_id: str, messages: List[dict], args) -> str:
+        data = {
+            "v": self.VERSION,
+            "model": model_id,
+            "messages": messages,
+            "args": {"max_len": args.max_len, "top_k": args.top_k, "top_p": args.top_p, "temp": args.temp},
+        }
+        # a quantized or bounded KV cache changes the answer, left out when unset so older keys still match
+        kv = {name: getattr(args, name) for name in ("kv_bits", "max_kv_size") if getattr(args, name, None)}
+        if kv:
+            data["kv"] = kv
+        return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.jsonl"
+
+    def lookup(self, key: str) -> Optional[Path]:
+        with self.lock:
+            path = self._path(key)
+            if key not in self.entries or not path.is_file():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            os.utime(path)
+            self.hits += 1
+            return path
+
+    def replay(self, path: Path) -> Iterator:
+        # as fast as the UI takes them, the recorded timing is ignored
+        for _, piece in read_trace(path):
+            piece.payload["telemetry"] = CACHE_HIT_TELEMETRY
+            yield piece
+
+    def recorder(self, key: str, **header) -> StreamRecorder:
+        # record a miss next to its final name, commit() publishes it
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        return StreamRecorder(path.with_name(f".{key}.{uuid.uuid4().hex[:8]}.part"), **header)
+
+    def commit(self, key: str, recorder: StreamRecorder):
+        recorder.close()
+        path = self._path(key)
+        size = recorder.path.stat().st_size
+        if size > self.max_bytes:
+            recorder.path.unlink()
+            return
+        os.replace(recorder.path, path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.stores += 1
+            self._evict()
+
+    def discard(self, recorder: StreamRecorder):
+        # cancelled, stopped by the watchdog or failed: not what the model would answer again
+        recorder.close()
+        recorder.path.unlink(missing_ok=True)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._path(key).unlink(missing_ok=True)
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
@@ -0,0 +1,67 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# keys and values are quantized in groups of this many, each with a scale and a bias
+KV_GROUP_SIZE = 64
+# the first tokens a rotating cache always keeps, attention leans on them whatever they say
+ATTENTION_SINKS = 4
+# rough, for estimates before the text is tokenized
+CHARS_PER_TOKEN = 4
+
+# the KV cache settings offered in the app: (kv_bits, max_kv_size)
+KV_CACHE_MODES = {"Full KV cache": (None, None), "8-bit KV cache": (8, None), "4-bit KV cache": (4, None),
+                  "KV cache of the last 8192 tokens": (None, 8192), "KV cache of the last 4096 tokens": (None, 4096)}
+
+
+@dataclass
+class KVShape:
+    # what a model's KV cache holds per token, from its config.json
+    layers: int
+    kv_heads: int
+    head_dim: int
+    # layers with a sliding window hold at most sliding_window tokens whatever the setting
+    sliding_layers: int = 0
+    sliding_window: int = 0
+    dtype_bytes: int = 2
+
+
+def read_kv_shape(model_path: Path) -> Optional[KVShape]:
+    try:
+        config = json.loads((Path(model_path) / "config.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    # multimodal models keep the language model's numbers apart
+    config = config.get("text_config", config)
+    try:
+        layers = int(config["num_hidden_layers"])
+        heads = int(config["num_attention_heads"])
+        kv_heads = int(config.get("num_key_value_heads") or heads)
+        head_dim = int(config.get("head_dim") or config["hidden_size"] // heads)
+    except (KeyError, TypeError, ValueError):
+        return None
+    sliding = sum(1 for t in config.get("layer_types") or [] if t == "sliding_attention")
+    return KVShape(layers=layers, kv_heads=kv_heads, head_dim=head_dim, sliding_layers=sliding,
+                   sliding_window=int(config.get("sliding_window") or 0) if sliding else 0,
+                   dtype_bytes=4 if config.get("torch_dtype") == "float32" else 2)
+
+
+def trimmable_kv_cache(model_path: Path) -> bool:
+    # Speculative decoding drops rejected drafts from the KV cache. A sliding window layer's rotating
+    # cache can't drop positions once it wrapped, which happens after a few hundred tokens.
+    shape = read_kv_shape(model_path)
+    return shape is not None and shape.sliding_layers == 0
+
+
+def kv_cache_bytes(shape: KVShape, tokens: int, kv_bits: Optional[int] = None, max_kv_size: Optional[int] = None,
+                   group_size: int = KV_GROUP_SIZE, prefill_step_size: int = 512) -> int:
+    # Bytes of the KV cache once it holds tokens. Only the full attention layers are quantized or bounded.
+    # A bounded cache goes over its size by up to a prefill chunk while the chunk is attended to.
+    per_token = 2 * shape.kv_heads * shape.head_dim
+    per_element = shape.dtype_bytes if not kv_bits else kv_bits / 8 + 2 * shape.dtype_bytes / group_size
+    full_tokens = min(tokens, max_kv_size + prefill_step_size) if max_kv_size else tokens
+    sliding_tokens = min(tokens, shape.sliding_window + prefill_step_size)
+    full = (shape.layers - shape.sliding_layers) * full_tokens * per_token * per_element
+    sliding = shape.sliding_layers * sliding_tokens * per_token * shape.dtype_bytes
+    return int(full + sliding)
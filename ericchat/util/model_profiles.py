@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from .available_models import ModelDetails
+
+# Samples from normal use are blended in with this weight, a calibration run replaces the numbers
+USAGE_WEIGHT = 0.3
+
+
+@dataclass
+class ModelProfile:
+    # What a model did on this machine. Tied to the installed revision: other weights, other numbers.
+    backend: str
+    model: str
+    revision: str
+    load_seconds: float = 0.0
+    peak_rss_gb: float = 0.0
+    prefill_tps: float = 0.0
+    decode_tps: float = 0.0
+    loads: int = 0
+    generations: int = 0
+    calibrated: bool = False
+    updated: float = 0.0
+
+    def summary(self) -> str:
+        parts = []
+        if self.decode_tps:
+            parts.append(f"{round(self.decode_tps, 1)} tokens/s")
+        if self.prefill_tps:
+            parts.append(f"prompt {round(self.prefill_tps)} tokens/s")
+        if self.load_seconds:
+            parts.append(f"loads in {round(self.load_seconds, 1)} s")
+        if self.peak_rss_gb:
+            parts.append(f"{round(self.peak_rss_gb, 1)} GB peak")
+        return ", ".join(parts)
+
+
+class StreamSpeed:
+    # Prefill and decode speed of one generation, from the on_prefill callback and the piece times.
+    # The first piece is paid by the prefill, so decode speed is measured from it onwards.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.prompt_tokens = 0
+        self.prefill_done = 0.0
+        self.first = 0.0
+        self.last = 0.0
+        self.tokens = 0
+
+    def on_prefill(self, processed: int, total: int):
+        self.prompt_tokens = total
+        if processed >= total:
+            self.prefill_done = time.perf_counter()
+
+    def on_piece(self, marker: str):
+        if marker not in ("text", "thinking"):
+            return
+        now = time.perf_counter()
+        if self.tokens == 0:
+            self.first = now
+        self.last = now
+        self.tokens += 1
+
+    @property
+    def prefill_tps(self) -> float:
+        end = self.prefill_done or self.first
+        return self.prompt_tokens / (end - self.start) if self.prompt_tokens and end > self.start else 0.0
+
+    @property
+    def decode_tps(self) -> float:
+        return (self.tokens - 1) / (self.last - self.first) if self.tokens > 1 and self.last > self.first else 0.0
+
+
+def _blend(old: float, new: float, weight: float) -> float:
+    if not new:
+        return old
+    return new if not old else old + (new - old) * weight
+
+
+class ProfileStore:
+    # one profile per backend and model, in model_profiles.json in the data folder
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.profiles: Dict[str, ModelProfile] = {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        names = {f.name for f in fields(ModelProfile)}
+        for key, record in data.items():
+            self.profiles[key] = ModelProfile(**{k: v for k, v in record.items() if k in names})
+
+    @staticmethod
+    def _key(backend: str, model: str) -> str:
+        return f"{backend}:{model}"
+
+    def get(self, backend: str, model: str, revision: str) -> Optional[ModelProfile]:
+        # a profile of another revision is stale, it's forgotten (and gone from the file with the next save)
+        with self.lock:
+            key = self._key(backend, model)
+            profile = self.profiles.get(key)
+            if profile is not None and profile.revision != revision:
+                del self.profiles[key]
+                profile = None
+        return profile
+
+    def _profile(self, backend: str, model: str, revision: str) -> ModelProfile:
+        key = self._key(backend, model)
+        profile = self.profiles.get(key)
+        if profile is None or profile.revision != revision:
+            profile = self.profiles[key] = ModelProfile(backend=backend, model=model, revision=revision)
+        return profile
+
+    def record_load(self, backend: str, model: str, revision: str, seconds: float, peak_rss_gb: float):
+        with self.lock:
+            profile = self._profile(backend, model, revision)
+            weight = 1.0 if profile.loads == 0 else USAGE_WEIGHT
+            profile.load_seconds = _blend(profile.load_seconds, seconds, weight)
+            profile.peak_rss_gb = max(profile.peak_rss_gb, peak_rss_gb)
+            profile.loads += 1
+            profile.updated = time.time()
+        self.save()
+
+    def record_generation(self, backend: str, model: str, revision: str, speed: StreamSpeed, peak_rss_gb: float = 0.0):
+        # passive: every finished generation nudges the averages
+        with self.lock:
+            profile = self._profile(backend, model, revision)
+            weight = 1.0 if profile.generations == 0 else USAGE_WEIGHT
+            profile.prefill_tps = _blend(profile.prefill_tps, speed.prefill_tps, weight)
+            profile.decode_tps = _blend(profile.decode_tps, speed.decode_tps, weight)
+            profile.peak_rss_gb = max(profile.peak_rss_gb, peak_rss_gb)
+            profile.generations += 1
+            profile.updated = time.time()
+        self.save()
+
+    def record_calibration(self, profile: ModelProfile):
+        profile.calibrated = True
+        profile.updated = time.time()
+        with self.lock:
+            self.profiles[self._key(profile.backend, profile.model)] = profile
+        self.save()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({key: asdict(p) for key, p in self.profiles.items()}, indent=2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def required_gb(self, model: ModelDetails, backend: str, revision: str) -> float:
+        # the measured peak once the model ran here, its listed requirement before that
+        profile = self.get(backend, model.short_name, revision)
+        return profile.peak_rss_gb if profile is not None and profile.peak_rss_gb else model.required_memory
+
+    def recommend(self, models: Iterable[ModelDetails], backend: str, available_gb: float,
+                  revisions: Dict[str, str]) -> Optional[ModelDetails]:
+        # the fastest installed model whose measured peak fits in available_gb, revisions is short_name -> installed revision
+        best, best_tps = None, 0.0
+        for model in models:
+            if not model.is_downloaded:
+                continue
+            profile = self.get(backend, model.short_name, revisions.get(model.short_name, "unknown"))
+            if profile is None or not profile.decode_tps or profile.peak_rss_gb > available_gb:
+                continue
+            if profile.decode_tps > best_tps:
+                best, best_tps = model, profile.decode_tps
+        return best
@@ -0,0 +1,469 @@
+import errno
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from .model_store import ModelStore, file_sha256
+
+# Where model files come from. The default is the Hugging Face Hub, set ERICCHAT_MODEL_SOURCE to
+# install from elsewhere:
+#   /path/to/models         a local folder or network share, see DirectorySource
+#   hf-cache or hf-cache:/path   an existing Hugging Face cache
+#   https://mirror.internal an HTTP mirror that serves the Hub API (the same thing HF_ENDPOINT points at)
+MODEL_SOURCE_ENV = "ERICCHAT_MODEL_SOURCE"
+
+DETAILS_FILE = "erictransformer_details.json"
+
+# (bytes done, bytes total) for the whole install
+ProgressCallback = Callable[[int, int], None]
+# called with the size of every block read from a remote source before the next one is read,
+# blocking in it is how a download is paused or held to a rate, see DownloadControl
+GateCallback = Callable[[int], None]
+
+# bytes read between progress and gate callbacks
+FETCH_CHUNK = 1024 * 1024
+# a read that fails (e.g. the server dropped a connection that was paused for long) is reopened where it stopped
+FETCH_RETRIES = 3
+
+# a branch or tag of the Hub is resolved to its commit again after this long, see ManifestCache
+MANIFEST_TTL = 24 * 60 * 60
+
+_COMMIT = re.compile(r"[0-9a-f]{40}")
+
+
+@dataclass
+class SourceFile:
+    name: str  # file name, models are stored flat
+    size: int
+    sha256: Optional[str] = None
+
+
+class ModelSource:
+    name = ""
+
+    def describe(self) -> str:
+        return self.name
+
+    def list_files(self, repo_id: str) -> List[SourceFile]:
+        raise NotImplementedError
+
+    def resolved_revision(self, repo_id: str) -> Optional[str]:
+        # a fixed id for what list_files() returned, None names the revision after its content
+        return None
+
+    # True when fetch() continues a partly written dest instead of starting over, see install_model()
+    resumable = False
+
+    def open(self, repo_id: str, file: SourceFile, offset: int) -> Tuple[BinaryIO, int]:
+        # a stream of the file from offset, and the offset it really starts at (0 if the source can't skip)
+        raise NotImplementedError
+
+    def fetch(self, repo_id: str, file: SourceFile, dest: Path, on_bytes: Callable[[int], None],
+              gate: Optional[GateCallback] = None) -> str:
+        # write file to dest, report the bytes done so far and return how it was placed.
+        # The default reads open() in FETCH_CHUNK blocks, after what a resumable source left in dest.
+        done = dest.stat().st_size if self.resumable and dest.is_file() else 0
+        if file.size and done == file.size:
+            on_bytes(done)
+            return "download"
+        retries = 0
+        while True:
+            stream, done = self.open(repo_id, file, done)
+            with stream, open(dest, "r+b" if done else "wb") as out:
+                out.truncate(done)
+                out.seek(done)
+                on_bytes(done)
+                while True:
+                    try:
+                        block = stream.read(FETCH_CHUNK)
+                    except Exception:
+                        if retries == FETCH_RETRIES:
+                            raise
+                        retries += 1
+                        break
+                    if not block:
+                        return "download"
+                    out.write(block)
+                    done += len(block)
+                    on_bytes(done)
+                    if gate is not None:
+                        gate(len(block))
+
+
+class ManifestCache:
+    # What a branch or tag of a remote repo resolved to: its commit and the listing at that commit,
+    # in <root>/<repo>@<ref>.json. Used for ttl seconds, a commit never changes and doesn't expire.
+    def __init__(self, root: Path, ttl: float = MANIFEST_TTL):
+        self.root = Path(root)
+        self.ttl = ttl
+
+    def _path(self, repo_id: str, ref: str) -> Path:
+        return self.root / f"{repo_id.replace('/', '--')}@{ref.replace('/', '--')}.json"
+
+    def get(self, repo_id: str, ref: str) -> Optional[Tuple[str, List[SourceFile]]]:
+        try:
+            data = json.loads(self._path(repo_id, ref).read_text(encoding="utf-8"))
+            if not _COMMIT.fullmatch(ref) and time.time() - data["resolved_at"] > self.ttl:
+                return None
+            return data["revision"], [SourceFile(**f) for f in data["files"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, repo_id: str, ref: str, revision: str, files: List[SourceFile]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(repo_id, ref)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"repo_id": repo_id, "ref": ref, "revision": revision, "resolved_at": time.time(),
+                                   "files": [asdict(f) for f in files]}, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+class HubSource(ModelSource):
+    # The Hugging Face Hub, or a mirror of its API when endpoint is set. revision (a branch, tag or
+    # commit) is resolved to a commit once, the listing and every download are at that commit. With a
+    # cache the resolved listing is reused for its ttl, so installing again needs no round trip;
+    # refresh resolves the revision again, for update checks. fs and api default to HfFileSystem and
+    # HfApi, anything with their find() and model_info() works.
+    name = "hub"
+
+    def __init__(self, endpoint: Optional[str] = None, revision: str = "main", cache: Optional[ManifestCache] = None,
+                 refresh: bool = False, fs=None, api=None):
+        if fs is None or api is None:
+            from huggingface_hub import HfApi, HfFileSystem
+
+            fs = fs or (HfFileSystem(endpoint=endpoint) if endpoint else HfFileSystem())
+            api = api or HfApi(endpoint=endpoint)
+        self.endpoint = endpoint
+        self.revision = revision
+        self.cache = cache
+        self.refresh = refresh
+        self.fs = fs
+        self.api = api
+        self._resolved: Dict[str, Tuple[str, List[SourceFile]]] = {}
+        # round trips made to list repos
+        self.requests = 0
+
+    def describe(self) -> str:
+        return self.endpoint or "huggingface.co"
+
+    def _resolve(self, repo_id: str) -> Tuple[str, List[SourceFile]]:
+        resolved = self._resolved.get(repo_id)
+        if resolved is None and self.cache is not None and not self.refresh:
+            resolved = self.cache.get(repo_id, self.revision)
+        if resolved is None:
+            if _COMMIT.fullmatch(self.revision):
+                commit = self.revision
+            else:
+                commit = self.api.model_info(repo_id, revision=self.revision).sha
+                self.requests += 1
+            entries = self.fs.find(repo_id, revision=commit, detail=True)  # dict[rpath] -> info
+            self.requests += 1
+            files = []
+            for rpath, info in entries.items():
+                # files are stored flat by name, sub folders (e.g. alternative weight formats) are not needed
+                if "/" in rpath[len(repo_id) + 1:]:
+                    continue
+                info = info or {}
+                lfs = info.get("lfs") or {}
+                files.append(SourceFile(Path(rpath).name, int(info.get("size", 0) or 0), lfs.get("sha256")))
+            resolved = (commit, files)
+            if self.cache is not None:
+                self.cache.put(repo_id, self.revision, commit, files)
+        self._resolved[repo_id] = resolved
+        return resolved
+
+    def list_files(self, repo_id: str) -> List[SourceFile]:
+        # copies, install_model fills in hashes it finds
+        return [replace(f) for f in self._resolve(repo_id)[1]]
+
+    def resolved_revision(self, repo_id: str) -> Optional[str]:
+        return self._resolve(repo_id)[0]
+
+    # a cancelled or paused download continues from its partial file, the same way huggingface_hub resumes
+    resumable = True
+
+    def open(self, repo_id: str, file: SourceFile, offset: int) -> Tuple[BinaryIO, int]:
+        from huggingface_hub import hf_hub_url
+        from huggingface_hub.utils import build_hf_headers, get_session, hf_raise_for_status
+
+        url = hf_hub_url(repo_id, file.name, revision=self.resolved_revision(repo_id), endpoint=self.endpoint)
+        headers = build_hf_headers()
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        response = get_session().get(url, headers=headers, stream=True, timeout=30)
+        hf_raise_for_status(response)
+        response.raw.decode_content = True
+        # a server that ignores the range sends the whole file
+        return response.raw, offset if response.status_code == 206 else 0
+
+
+class DirectorySource(ModelSource):
+    # A folder holding one sub folder per model, looked up as <root>/<org>/<name>, <root>/<org>--<name>
+    # or <root>/<name>. A folder that is itself a model works too. Files are linked into place when
+    # possible, see place_file().
+    name = "directory"
+
+    def __init__(self, root: Path):
+        self.root = Path(root).expanduser()
+
+    def describe(self) -> str:
+        return str(self.root)
+
+    def model_dir(self, repo_id: str) -> Path:
+        for candidate in (self.root / repo_id, self.root / repo_id.replace("/", "--"), self.root / repo_id.split("/")[-1]):
+            if candidate.is_dir():
+                return candidate
+        if (self.root / "config.json").is_file():
+            return self.root
+        raise FileNotFoundError(f"{repo_id} not found in {self.root}")
+
+    def list_files(self, repo_id: str) -> List[SourceFile]:
+        files = []
+        for path in sorted(self.model_dir(repo_id).iterdir()):
+            if path.name.startswith(".") or path.name == DETAILS_FILE or not path.is_file():
+                continue
+            files.append(SourceFile(path.name, path.stat().st_size))
+        return files
+
+    def fetch(self, repo_id: str, file: SourceFile, dest: Path, on_bytes: Callable[[int], None],
+              gate: Optional[GateCallback] = None) -> str:
+        # local, nothing to throttle
+        method = place_file(self.model_dir(repo_id) / file.name, dest, on_bytes)
+        on_bytes(file.size)
+        return method
+
+
+class HFCacheSource(DirectorySource):
+    # An existing Hugging Face cache (huggingface-cli download, transformers, mlx_lm...). Snapshot
+    # files are symlinks to blobs named by their sha256, those blobs get linked.
+    name = "hf-cache"
+
+    def __init__(self, root: Optional[Path] = None, revision: str = "main"):
+        if root is None:
+            hf_home = Path(os.environ.get("HF_HOME", Path.home() / ".cache/huggingface"))
+            root = os.environ.get("HF_HUB_CACHE", hf_home / "hub")
+        super().__init__(root)
+        self.revision = revision
+
+    def model_dir(self, repo_id: str) -> Path:
+        repo_dir = self.root / f"models--{repo_id.replace('/', '--')}"
+        ref = repo_dir / "refs" / self.revision
+        commit = ref.read_text().strip() if ref.is_file() else self.revision
+        snapshot = repo_dir / "snapshots" / commit
+        if not snapshot.is_dir():
+            raise FileNotFoundError(f"{repo_id}@{self.revision} not found in {self.root}")
+        return snapshot
+
+    def resolved_revision(self, repo_id: str) -> Optional[str]:
+        return self.model_dir(repo_id).name
+
+    def list_files(self, repo_id: str) -> List[SourceFile]:
+        files = super().list_files(repo_id)
+        snapshot = self.model_dir(repo_id)
+        for file in files:
+            blob = (snapshot / file.name).resolve().name
+            # LFS blobs are named by their sha256, small files by their git hash
+            if len(blob) == 64:
+                file.sha256 = blob
+        return files
+
+
+def installed_revision(save_path: Path) -> Optional[str]:
+    # the revision install_model() published in save_path, None for models installed before revisions were tracked
+    try:
+        details = json.loads((Path(save_path) / DETAILS_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return details.get("revision")
+
+
+def get_model_source(spec: Optional[str] = None, store: Optional[ModelStore] = None, refresh: bool = False) -> ModelSource:
+    # with a store, what the Hub's branches resolved to is cached in it, refresh resolves them again
+    spec = spec if spec is not None else os.environ.get(MODEL_SOURCE_ENV, "")
+    cache = ManifestCache(store.remote) if store is not None else None
+    if not spec or spec == "hub":
+        return HubSource(cache=cache, refresh=refresh)
+    if spec == "hf-cache":
+        return HFCacheSource()
+    if spec.startswith("hf-cache:"):
+        return HFCacheSource(Path(spec[len("hf-cache:"):]))
+    if spec.startswith(("http://", "https://")):
+        endpoint = spec.rstrip("/")
+        # a mirror's branches are its own
+        if cache is not None:
+            cache = ManifestCache(store.remote / re.sub(r"[^\w.-]", "_", endpoint))
+        return HubSource(endpoint=endpoint, cache=cache, refresh=refresh)
+    return DirectorySource(Path(spec))
+
+
+def _reflink(src: Path, dest: Path) -> bool:
+    # copy-on-write clone: instant and takes no space until one side changes (APFS, Btrfs, XFS)
+    if sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "clonefile"):
+            return False
+        return libc.clonefile(os.fsencode(src), os.fsencode(dest), 0) == 0
+
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        FICLONE = 0x40049409
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                return True
+            except OSError:
+                pass
+        dest.unlink()
+    return False
+
+
+def _copy_file_range(src: Path, dest: Path, on_bytes: Callable[[int], None]):
+    # the kernel copies without going through user space, and offloads to the server on NFS/SMB
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        done = 0
+        while done < size:
+            n = os.copy_file_range(fsrc.fileno(), fdest.fileno(), min(size - done, 64 * 1024 * 1024))
+            if n == 0:
+                break
+            done += n
+            on_bytes(done)
+
+
+def place_file(src: Path, dest: Path, on_bytes: Callable[[int], None] = lambda n: None) -> str:
+    # Cheapest way to get src's bytes at dest: reflink, hardlink, copy_file_range, then a plain copy.
+    # Returns the one used. Weights are never modified in place, so sharing them through a link is safe.
+    src = Path(src).resolve()
+    dest = Path(dest)
+    if dest.exists():
+        dest.unlink()
+
+    # a clone first: unlike a hardlink it stays intact when the source is edited in place
+    try:
+        if _reflink(src, dest):
+            return "reflink"
+    except OSError:
+        if dest.exists():
+            dest.unlink()
+
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except OSError:
+        pass
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            _copy_file_range(src, dest, on_bytes)
+            return "copy_file_range"
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+
+    # uses fcopyfile on macOS and sendfile on Linux
+    shutil.copyfile(src, dest)
+    return "copy"
+
+
+def verify_install(save_path: Path, files: List[SourceFile], check_hashes: bool = False) -> List[str]:
+    # problems with the installed files, empty when everything is there with the expected size (and hash)
+    problems = []
+    for file in files:
+        path = Path(save_path) / file.name
+        if not path.is_file():
+            problems.append(f"{file.name} is missing")
+        elif file.size and path.stat().st_size != file.size:
+            problems.append(f"{file.name} has {path.stat().st_size} bytes, expected {file.size}")
+        elif check_hashes and file.sha256 and file_sha256(path) != file.sha256:
+            problems.append(f"{file.name} doesn't match its sha256")
+    return problems
+
+
+def _adopt_legacy(store: ModelStore, save_path: Path, files: List[SourceFile], check_hashes: bool):
+    # a model folder from before the store: move the files that look right into it instead of fetching them again
+    for file in files:
+        path = save_path / file.name
+        if not path.is_file() or (file.size and path.stat().st_size != file.size):
+            continue
+        try:
+            file.sha256 = store.add_blob(path, file.sha256, verify=check_hashes or source.resumable)
+        except ValueError:
+            pass
+
+
+def install_model(source: ModelSource, repo_id: str, save_path: Path, store: ModelStore,
+                  on_progress: Optional[ProgressCallback] = None, check_hashes: bool = False,
+                  gate: Optional[GateCallback] = None) -> Dict[str, object]:
+    # Fetch the blobs the store doesn't have yet, verify the revision and only then publish it: the
+    # snapshot with the details file that marks the model as downloaded is switched in with one rename.
+    # Raise from on_progress to cancel. Holds the store's install lock so gc() can't take the blobs
+    # of a revision that isn't published yet.
+    with store.install_lock():
+        return _install_model(source, repo_id, Path(save_path), store, on_progress, check_hashes, gate)
+
+
+def _install_model(source: ModelSource, repo_id: str, save_path: Path, store: ModelStore,
+                   on_progress: Optional[ProgressCallback], check_hashes: bool,
+                   gate: Optional[GateCallback]) -> Dict[str, object]:
+    files = source.list_files(repo_id)
+    if save_path.is_dir() and not save_path.is_symlink():
+        _adopt_legacy(store, save_path, files, check_hashes)
+
+    # files with a known hash that the store has are shared with other models and revisions
+    entries = {f.name: {"sha256": f.sha256, "size": f.size} for f in files if f.sha256 and store.has_blob(f.sha256, f.size)}
+    fetch = [f for f in files if f.name not in entries]
+    total = sum(f.size for f in fetch)
+    done = 0
+    methods: Dict[str, int] = {}
+
+    if on_progress is not None:
+        on_progress(0, total)
+    for file in fetch:
+        def on_bytes(n, base=done):
+            if on_progress is not None:
+                on_progress(base + min(n, file.size or n), total)
+
+        # fetched into the store's tmp folder, a cancelled file never becomes a blob. A resumable
+        # source keeps what it got for the next attempt, unless the finished file is what's wrong.
+        if source.resumable:
+            tmp_path = store.partial_path(repo_id, file.name, file.sha256 or f"{file.size}")
+        else:
+            tmp_path = store.tmp_path()
+        fetched = False
+        try:
+            method = source.fetch(repo_id, file, tmp_path, on_bytes, gate=gate)
+            fetched = True
+            if file.size and tmp_path.stat().st_size != file.size:
+                raise RuntimeError(f"{file.name} has {tmp_path.stat().st_size} bytes, expected {file.size}")
+            # a download is always checked against the hash it's stored under, a resumed one is put
+            # together from several responses and a corrupted part mustn't become a trusted blob
+            sha256 = store.add_blob(tmp_path, file.sha256, verify=check_hashes or source.resumable)
+        finally:
+            if fetched or not source.resumable:
+                tmp_path.unlink(missing_ok=True)
+        entries[file.name] = {"sha256": sha256, "size": file.size}
+        methods[method] = methods.get(method, 0) + 1
+        done += file.size
+        if on_progress is not None:
+            on_progress(done, total)
+
+    problems = [f"{name} is missing" for name, f in entries.items() if not store.has_blob(f["sha256"], f["size"])]
+    if problems:
+        raise RuntimeError("Install failed verification: " + "; ".join(problems))
+
+    revision = store.write_manifest(repo_id, entries, revision=source.resolved_revision(repo_id), source=source.describe())
+    details = {"model_name": repo_id, "source": source.describe(), "revision": revision}
+    store.build_snapshot(repo_id, revision, {DETAILS_FILE: json.dumps(details, ensure_ascii=False, indent=2)})
+    store.switch(repo_id, revision, save_path)
+
+    return {"files": len(files), "fetched": len(fetch), "reused": len(files) - len(fetch), "bytes": total,
+            "revision": revision, "methods": methods}
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Content addressed storage for model files, shared by every model and revision:
+#   blobs/<aa>/<sha256>                  file contents, stored once however many models use them
+#   manifests/<repo>/<revision>.json     file name -> sha256 and size of one revision
+#   snapshots/<repo>/<revision>/<name>   hardlinks to the blobs, the folder the backends load
+#   refs/<repo>                          the current revision
+#   remote/<repo>@<ref>.json             the commit a Hub branch resolved to and its files, see ManifestCache
+# A model folder (default/<subdir>) is a symlink to its current snapshot and is switched atomically,
+# so a load never sees half of a revision.
+# Installs hold a shared lock on install.lock while they add blobs that no manifest lists yet, gc()
+# takes it exclusively and refuses to run while an install is going on, in this process or another.
+
+# a resumable download in tmp/ is kept for the next attempt for this long after it was last written
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _repo_key(repo_id: str) -> str:
+    return repo_id.replace("/", "--")
+
+
+def _write_atomic(path: Path, text: str):
+    tmp_path = path.with_name(path.name + ".part")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class ModelStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.manifests = self.root / "manifests"
+        self.snapshots = self.root / "snapshots"
+        self.refs = self.root / "refs"
+        self.tmp = self.root / "tmp"
+        self.remote = self.root / "remote"
+        for path in (self.blobs, self.manifests, self.snapshots, self.refs, self.tmp):
+            path.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def install_lock(self, exclusive: bool = False) -> Iterator[bool]:
+        # Yields False when an exclusive lock is asked for but someone else holds the lock, without
+        # waiting. Where flock doesn't exist nothing is locked.
+        with open(self.root / "install.lock", "a+b") as f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f.fileno(), (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusive else fcntl.LOCK_SH)
+                except BlockingIOError:
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs / sha256[:2] / sha256
+
+    def has_blob(self, sha256: str, size: int = 0) -> bool:
+        path = self.blob_path(sha256)
+        return path.is_file() and (not size or path.stat().st_size == size)
+
+    def tmp_path(self) -> Path:
+        # inside the store so adding a blob is a rename
+        return self.tmp / uuid.uuid4().hex
+
+    def partial_path(self, repo_id: str, name: str, key: str) -> Path:
+        # where a resumable download of a file is kept between attempts, key tells versions of it apart
+        return self.tmp / f"{_repo_key(repo_id)}--{name}.{key}.part"
+
+    def add_blob(self, path: Path, sha256: Optional[str] = None, verify: bool = False) -> str:
+        # Move a file into the store and return its sha256. The hash is computed when it isn't known
+        # or verify is set, a known hash is trusted otherwise.
+        if sha256 is None or verify:
+            actual = file_sha256(path)
+            if sha256 is not None and actual != sha256:
+                raise ValueError(f"{Path(path).name} doesn't match its sha256")
+            sha256 = actual
+
+        blob = self.blob_path(sha256)
+        # a blob with another size was changed through a hardlink, the new file replaces it
+        if blob.is_file() and blob.stat().st_size == Path(path).stat().st_size:
+            Path(path).unlink()
+            return sha256
+        blob.parent.mkdir(exist_ok=True)
+        try:
+            os.replace(path, blob)
+        except OSError:
+            # another file system, e.g. a legacy model folder on an external disk
+            shutil.move(str(path), str(blob))
+        return sha256
+
+    def _manifest_path(self, repo_id: str, revision: str) -> Path:
+        return self.manifests / _repo_key(repo_id) / f"{revision}.json"
+
+    def write_manifest(self, repo_id: str, files: Dict[str, dict], revision: Optional[str] = None, **extra) -> str:
+        # files is name -> {"sha256", "size"}. Without a revision (e.g. a local folder has none) it is
+        # named after its content, so the same files always give the same revision.
+        if revision is None:
+            listing = json.dumps(sorted((name, f["sha256"]) for name, f in files.items()))
+            revision = hashlib.sha256(listing.encode("utf-8")).hexdigest()[:16]
+        path = self._manifest_path(repo_id, revision)
+        path.parent.mkdir(exist_ok=True)
+        _write_atomic(path, json.dumps(dict(extra, repo_id=repo_id, revision=revision, files=files), indent=2))
+        return revision
+
+    def read_manifest(self, repo_id: str, revision: str) -> Optional[dict]:
+        path = self._manifest_path(repo_id, revision)
+        if not path.is_file():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def revisions(self, repo_id: str) -> List[str]:
+        folder = self.manifests / _repo_key(repo_id)
+        return sorted(p.stem for p in folder.glob("*.json")) if folder.is_dir() else []
+
+    def current_revision(self, repo_id: str) -> Optional[str]:
+        ref = self.refs / _repo_key(repo_id)
+        return ref.read_text(encoding="utf-8").strip() if ref.is_file() else None
+
+    def build_snapshot(self, repo_id: str, revision: str, extra_files: Optional[Dict[str, str]] = None) -> Path:
+        # A folder of hardlinks to the revision's blobs plus small generated files (the details file),
+        # built next to its final name and renamed. Falls back to symlinks where hardlinks don't work.
+        manifest = self.read_manifest(repo_id, revision)
+        if manifest is None:
+            raise FileNotFoundError(f"No manifest for {repo_id}@{revision}")
+
+        snapshot = self.snapshots / _repo_key(repo_id) / revision
+        snapshot.parent.mkdir(exist_ok=True)
+        building = snapshot.with_name(f".{revision}.{uuid.uuid4().hex[:8]}")
+        building.mkdir()
+        for name, f in manifest["files"].items():
+            blob = self.blob_path(f["sha256"])
+            try:
+                os.link(blob, building / name)
+            except OSError:
+                os.symlink(blob, building / name)
+        for name, text in (extra_files or {}).items():
+            (building / name).write_text(text, encoding="utf-8")
+
+        if snapshot.exists():
+            # a rebuild: move the old one out of the way first, a directory can't be replaced in one rename
+            old = snapshot.with_name(f".{revision}.old.{uuid.uuid4().hex[:8]}")
+            os.replace(snapshot, old)
+            os.replace(building, snapshot)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(building, snapshot)
+        return snapshot
+
+    def switch(self, repo_id: str, revision: str, link_path: Path):
+        # point the model folder at the revision's snapshot with one rename
+        snapshot = self.snapshots / _repo_key(repo_id) / revision
+        if not snapshot.is_dir():
+            raise FileNotFoundError(f"No snapshot for {repo_id}@{revision}")
+        link_path = Path(link_path)
+        if link_path.is_dir() and not link_path.is_symlink():
+            # a model folder from before the store, its useful files were adopted already
+            shutil.rmtree(link_path)
+        tmp_link = link_path.with_name(f".{link_path.name}.{uuid.uuid4().hex[:8]}")
+        # relative, so the data folder can be moved
+        os.symlink(os.path.relpath(snapshot, link_path.parent), tmp_link, target_is_directory=True)
+        os.replace(tmp_link, link_path)
+        _write_atomic(self.refs / _repo_key(repo_id), revision)
+
+    def _referenced_blobs(self, manifests: List[dict]) -> Set[str]:
+        return {f["sha256"] for manifest in manifests for f in manifest["files"].values()}
+
+    def _current_manifests(self) -> Dict[str, dict]:
+        manifests = {}
+        for ref in self.refs.iterdir():
+            if ref.name.endswith(".part"):
+                continue
+            revision = ref.read_text(encoding="utf-8").strip()
+            path = self.manifests / ref.name / f"{revision}.json"
+            if path.is_file():
+                manifests[ref.name] = json.loads(path.read_text(encoding="utf-8"))
+        return manifests
+
+    def _iter_blobs(self):
+        for folder in self.blobs.iterdir():
+            if folder.is_dir():
+                yield from folder.iterdir()
+
+    def gc(self, dry_run: bool = False) -> Dict[str, int]:
+        # Drop every revision that isn't current, then every blob no current revision uses. Raises
+        # while an install is going on, its new blobs aren't in a manifest until it's done.
+        with self.install_lock(exclusive=True) as locked:
+            if not locked:
+                raise RuntimeError("A model is being installed, try again when it's done.")
+            return self._gc(dry_run)
+
+    def _gc(self, dry_run: bool) -> Dict[str, int]:
+        current = self._current_manifests()
+        removed_revisions = 0
+        for repo_folder in list(self.manifests.iterdir()):
+            keep = current.get(repo_folder.name, {}).get("revision")
+            for path in list(repo_folder.glob("*.json")):
+                if path.stem == keep:
+                    continue
+                removed_revisions += 1
+                if not dry_run:
+                    shutil.rmtree(self.snapshots / repo_folder.name / path.stem, ignore_errors=True)
+                    path.unlink()
+
+        referenced = self._referenced_blobs(list(current.values()))
+        removed_blobs = freed = 0
+        for blob in list(self._iter_blobs()):
+            if blob.name in referenced:
+                continue
+            removed_blobs += 1
+            freed += blob.stat().st_size
+            if not dry_run:
+                blob.unlink()
+
+        if not dry_run:
+            # leftovers of installs that were cancelled or crashed. A partial download is resumed by the
+            # next attempt, only one that hasn't been touched in PARTIAL_MAX_AGE is given up on
+            stale = time.time() - PARTIAL_MAX_AGE
+            for path in list(self.tmp.iterdir()):
+                if path.suffix != ".part" or path.stat().st_mtime < stale:
+                    path.unlink()
+            for folder in list(self.snapshots.iterdir()):
+                for building in folder.glob(".*"):
+                    shutil.rmtree(building, ignore_errors=True)
+
+        return {"revisions": removed_revisions, "blobs": removed_blobs, "bytes": freed}
+
+    def disk_usage(self) -> Dict[str, dict]:
+        # Per repo: bytes of its current revision, the part no other current revision shares,
+        # and how many revisions are kept. The "" entry is the whole store and what gc() would free.
+        current = self._current_manifests()
+        users: Dict[str, int] = {}
+        for manifest in current.values():
+            for sha256 in {f["sha256"] for f in manifest["files"].values()}:
+                users[sha256] = users.get(sha256, 0) + 1
+
+        usage = {}
+        for key, manifest in current.items():
+            files = {f["sha256"]: f["size"] for f in manifest["files"].values()}
+            usage[manifest["repo_id"]] = {
+                "bytes": sum(files.values()),
+                "unique_bytes": sum(size for sha256, size in files.items() if users[sha256] == 1),
+                "revisions": len(list((self.manifests / key).glob("*.json"))),
+            }
+
+        total = reclaimable = 0
+        for blob in self._iter_blobs():
+            size = blob.stat().st_size
+            total += size
+            if blob.name not in users:
+                reclaimable += size
+        usage[""] = {"bytes": total, "reclaimable_bytes": reclaimable}
+        return usage
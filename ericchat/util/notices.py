@@ -43,4 +43,54 @@ def get_gpt_oss_120b_notice():
     
     """
 
-    return notice
\ No newline at end of file
+    return notice
+
+
+def get_smol_3b_cpu_notice():
+    notice = """
+    Recommended memory: ~8 GB
+
+    Description: HuggingFaceTB/SmolLM3-3B running on the CPU with transformers.
+
+    URL: https://huggingface.co/HuggingFaceTB/SmolLM3-3B
+
+    License: Apache 2.0 (https://choosealicense.com/licenses/apache-2.0/)
+
+    """
+
+    return notice
+
+
+def get_gpt_oss_20b_cpu_notice():
+    notice = """
+    Recommended memory: ~24 GB
+
+    Description: openai/gpt-oss-20b running on the CPU with transformers. Expect a few tokens per second.
+
+    URL: https://huggingface.co/openai/gpt-oss-20b
+
+    License: Apache 2.0 (https://choosealicense.com/licenses/apache-2.0/)
+
+    """
+
+    return notice
+
+
+def get_fake_notice():
+    notice = """
+    Description: A deterministic fake model for testing. Nothing is downloaded.
+
+    """
+
+    return notice
+
+
+def get_replay_notice(path):
+    notice = f"""
+    Description: Replays recorded generations instead of running a model. Nothing is downloaded.
+
+    Traces are read from: {path}
+
+    """
+
+    return notice
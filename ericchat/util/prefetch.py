@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import psutil
+
+WEIGHT_SUFFIXES = (".safetensors", ".gguf", ".bin", ".npz")
+
+# one read of a prefetch thread, and the part of a file one thread reads before the next thread
+# takes over, so a model with a single big shard is still read by all of them
+PREFETCH_BLOCK = 8 * 1024 * 1024
+PREFETCH_SEGMENT = 256 * 1024 * 1024
+PREFETCH_WORKERS = 4
+
+
+def weight_files(model_path: Path) -> List[Path]:
+    model_path = Path(model_path)
+    if not model_path.is_dir():
+        return []
+    return sorted(f for f in model_path.iterdir() if f.suffix in WEIGHT_SUFFIXES)
+
+
+def fits_in_memory(paths: Iterable[Path], copies: float = 2.0) -> bool:
+    # The page cache holds the files while the backend makes its own copy of the weights. Only worth it
+    # when both fit, otherwise the prefetched pages are evicted again before the backend gets to them.
+    size = sum(Path(p).stat().st_size for p in paths)
+    return size * copies <= psutil.virtual_memory().available
+
+
+def evict(paths: Iterable[Path]) -> bool:
+    # drops the files' pages from the page cache, for measuring a cold load. False where the platform can't
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # only clean pages are dropped
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+class Prefetcher:
+    # Reads weight files into the page cache on several threads, so the backend's own loading, which
+    # reads one file after another, finds them in memory. On Linux the kernel is asked to read ahead
+    # first (POSIX_FADV_WILLNEED). Best effort: a file that can't be read is left to the backend to report.
+    # on_progress(done bytes, total bytes) is called on the reading threads.
+    def __init__(self, paths: Iterable[Path], workers: int = PREFETCH_WORKERS,
+                 on_progress: Optional[Callable[[int, int], None]] = None):
+        self.paths = [Path(p) for p in paths]
+        self.sizes = [p.stat().st_size for p in self.paths]
+        self.workers = max(1, workers)
+        self.on_progress = on_progress
+        self.total = sum(self.sizes)
+        self.done = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._stop.is_set()
+
+    def cancel(self):
+        self._stop.set()
+
+    def _segments(self) -> Iterator[Tuple[Path, int, int]]:
+        # in file order, the threads move through the model from the front
+        for path, size in zip(self.paths, self.sizes):
+            for offset in range(0, size, PREFETCH_SEGMENT):
+                yield path, offset, min(PREFETCH_SEGMENT, size - offset)
+
+    def _add(self, n: int):
+        with self._lock:
+            self.done += n
+            done = self.done
+        if self.on_progress is not None:
+            self.on_progress(done, self.total)
+
+    def _read(self, segment: Tuple[Path, int, int]):
+        path, offset, length = segment
+        if self._stop.is_set():
+            return
+        buffer = memoryview(bytearray(PREFETCH_BLOCK))
+        end = offset + length
+        try:
+            with open(path, "rb", buffering=0) as f:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+                f.seek(offset)
+                while offset < end and not self._stop.is_set():
+                    n = f.readinto(buffer[:min(PREFETCH_BLOCK, end - offset)])
+                    if not n:
+                        break
+                    offset += n
+                    self._add(n)
+        except OSError:
+            pass
+
+    def run(self) -> "Prefetcher":
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ericchat-prefetch") as pool:
+                for _ in pool.map(self._read, self._segments()):
+                    pass
+        finally:
+            self.seconds = time.perf_counter() - start
+            self._finished.set()
+        return self
+
+    def start(self) -> "Prefetcher":
+        # in the background, e.g. for a model that was picked but not loaded yet
+        threading.Thread(target=self.run, daemon=True, name="ericchat-prefetch").start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    @property
+    def gb_per_second(self) -> float:
+        return self.done / self.seconds / (1024 ** 3) if self.seconds else 0.0
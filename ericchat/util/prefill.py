@@ -0,0 +1,31 @@
+import time
+
+
+class PrefillProgress:
+    # Tracks prompt processing so the status can show tokens done and an ETA.
+    def __init__(self):
+        self.start = time.monotonic()
+        self.processed = 0
+        self.total = 0
+
+    def update(self, processed: int, total: int):
+        self.processed = processed
+        self.total = total
+
+    @property
+    def pct(self) -> int:
+        return int(self.processed * 100 / self.total) if self.total else 0
+
+    @property
+    def eta(self) -> float:
+        elapsed = time.monotonic() - self.start
+        if self.processed <= 0 or elapsed <= 0:
+            return 0.0
+        rate = self.processed / elapsed
+        return (self.total - self.processed) / rate
+
+    def status(self) -> str:
+        text = f"Reading prompt: {self.processed:,} / {self.total:,} tokens"
+        if 0 < self.processed < self.total:
+            text += f", ~{max(1, round(self.eta))}s left"
+        return text
@@ -0,0 +1,183 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Optional
+
+# Instrumentation for the UI thread, written as Chrome trace JSON (chrome://tracing, ui.perfetto.dev).
+# Everything is off unless a Tracer is enabled: span() then returns one shared nullcontext, so a
+# disabled span costs an attribute check and a call.
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Optional[dict]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.tracer._add({"name": self.name, "ph": "X", "ts": self.tracer._us(self.start),
+                          "dur": (end - self.start) * 1e6, "tid": threading.get_ident(),
+                          "args": self.args or {}})
+
+
+class Tracer:
+    # Keeps the last max_events events in memory, dump() writes them out.
+    def __init__(self, enabled: bool = False, max_events: int = 500_000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.thread_names: Dict[int, str] = {}
+        # filled by SamplingProfiler
+        self.stack_frames: Dict[str, dict] = {}
+        self.samples = deque(maxlen=max_events)
+
+    def _us(self, t: float) -> float:
+        return (t - self.origin) * 1e6
+
+    def _add(self, event: dict):
+        tid = event["tid"]
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        self.events.append(event)
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def instant(self, name: str, **args):
+        if self.enabled:
+            self._add({"name": name, "ph": "i", "s": "t", "ts": self._us(time.perf_counter()),
+                       "tid": threading.get_ident(), "args": args})
+
+    def counter(self, name: str, **values):
+        if self.enabled:
+            self._add({"name": name, "ph": "C", "ts": self._us(time.perf_counter()),
+                       "tid": threading.get_ident(), "args": values})
+
+    def dump(self, path: Path):
+        events = [dict(event, pid=self.pid) for event in list(self.events)]
+        events += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in list(self.thread_names.items())]
+        data = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if self.samples:
+            data["stackFrames"] = dict(self.stack_frames)
+            data["samples"] = [dict(sample, pid=self.pid) for sample in list(self.samples)]
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".part")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+class LoopLagMonitor:
+    # Schedules a callback every interval seconds on an asyncio loop and records how late it ran.
+    # Lag is the time the loop was busy with something else: rendering, layout, a slow handler.
+    def __init__(self, loop, tracer: Tracer, interval: float = 0.05):
+        self.loop = loop
+        self.tracer = tracer
+        self.interval = interval
+        self.lags_ms = deque(maxlen=10_000)
+        self._handle = None
+        self._due = 0.0
+
+    def start(self):
+        self._schedule()
+
+    def _schedule(self):
+        self._due = time.perf_counter() + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        lag_ms = max(0.0, (time.perf_counter() - self._due) * 1000)
+        self.lags_ms.append(lag_ms)
+        self.tracer.counter("ui loop lag", ms=lag_ms)
+        self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def stats(self) -> Dict[str, float]:
+        lags = sorted(self.lags_ms)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "lag_p50_ms": lags[len(lags) // 2],
+            "lag_p99_ms": lags[int(len(lags) * 0.99)],
+            "lag_max_ms": lags[-1],
+        }
+
+
+class SamplingProfiler:
+    # Samples the stack of one thread (the UI thread by default) from a background thread with
+    # sys._current_frames(). Costs nothing on the sampled thread besides the GIL hand-offs.
+    def __init__(self, tracer: Tracer, interval: float = 0.005, thread_id: Optional[int] = None, max_depth: int = 64):
+        self.tracer = tracer
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.max_depth = max_depth
+        self._frame_ids: Dict[tuple, str] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        if not stack:
+            return
+
+        # stack frames are shared between samples, each one points to its caller
+        parent = None
+        for location in reversed(stack):
+            key = (parent, location)
+            frame_id = self._frame_ids.get(key)
+            if frame_id is None:
+                frame_id = self._frame_ids[key] = str(len(self._frame_ids))
+                name, filename, line = location
+                entry = {"name": f"{name} ({Path(filename).name}:{line})", "category": "python"}
+                if parent is not None:
+                    entry["parent"] = parent
+                self.tracer.stack_frames[frame_id] = entry
+            parent = frame_id
+
+        self.tracer.samples.append({"tid": self.thread_id, "ts": self.tracer._us(time.perf_counter()),
+                                    "sf": parent, "weight": 1, "name": "sample", "cpu": 0})
@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+WATCHDOG_ACTIONS = ("off", "stop", "steer")
+
+# sent as a user turn when a loop is steered instead of stopped
+STEER_PROMPT = "You are repeating yourself. Stop and give your final answer now."
+
+# the rolling n-gram hash is a polynomial in the pieces' string hashes modulo a Mersenne prime
+_MOD = (1 << 61) - 1
+_BASE = 1_000_003
+
+
+@dataclass
+class RepetitionLoop:
+    marker: str  # "thinking" or "text"
+    period: int  # tokens in one repetition
+    repeated_tokens: int  # tokens that were a copy of earlier ones when the loop was caught
+
+    def reason(self) -> str:
+        return f"repetition in {self.marker} ({self.period} token period, {self.repeated_tokens} tokens repeated)"
+
+
+class RepetitionWatchdog:
+    # Catches a stream that keeps producing the same tokens, in O(1) per token.
+    #
+    # A rolling hash of the last ngram pieces (the new piece added, the one leaving subtracted) is looked up in a table of where each n-gram was last
+    # seen. A match within the last window pieces at distance d means the stream may be repeating
+    # with period d, and every following piece that matches at the same distance extends the run.
+    # A loop is reported once the run covers min_repeats periods and at least min_tokens pieces,
+    # so ordinary repetition like table rows or a repeated word doesn't trip it.
+    # Feed a segment of pieces at a time with feed_segment(), one call per piece costs as much as the check.
+    def __init__(self, ngram: int = 8, window: int = 4096, min_repeats: int = 3, min_tokens: int = 64):
+        self.ngram = max(1, int(ngram))
+        self.window = window
+        self.min_repeats = max(2, int(min_repeats))
+        self.min_tokens = min_tokens
+        self.reset()
+
+    def reset(self):
+        self.position = 0
+        self.marker = ""
+        # hashes of the current n-gram's pieces, piece i at i % ngram, and their rolling hash
+        self._recent = [0] * self.ngram
+        self._hash = 0
+        self._top = pow(_BASE, self.ngram - 1, _MOD)
+        self._seen: Dict[int, int] = {}  # n-gram hash -> last position
+        self.period = 0
+        self.run = 0
+
+    def feed(self, text: str, marker: str = "text") -> Optional[RepetitionLoop]:
+        return self.feed_segment((text,), marker)
+
+    def feed_segment(self, texts: Sequence[str], marker: str = "text") -> Optional[RepetitionLoop]:
+        if marker != self.marker:
+            if marker not in ("thinking", "text"):
+                return None
+            # thinking and answer are checked on their own, a loop doesn't span the two
+            self.reset()
+            self.marker = marker
+
+        # runs once per token, everything it touches is a local
+        ngram, window, recent, seen, top = self.ngram, self.window, self._recent, self._seen, self._top
+        position, period, run, h = self.position, self.period, self.run, self._hash
+        loop = None
+        for text in texts:
+            slot = position % ngram
+            # the strings cache their hashes, the piece leaving the n-gram is in its slot
+            piece = hash(text) & _MOD
+            h = ((h - recent[slot] * top) * _BASE + piece) % _MOD
+            recent[slot] = piece
+            position += 1
+            if position < ngram:
+                continue
+
+            last = seen.get(h)
+            seen[h] = position
+            if last is None or position - last > window:
+                run = 0
+            elif position - last == period:
+                run += 1
+                repeated = run + ngram - 1
+                if repeated >= period * (self.min_repeats - 1) and repeated >= self.min_tokens:
+                    loop = RepetitionLoop(marker=marker, period=period, repeated_tokens=repeated)
+                    break
+            else:
+                period = position - last
+                run = 1
+
+        # n-grams that left the window are dropped in bulk, amortized O(1) per token
+        if len(seen) > 4 * window:
+            self._seen = {key: p for key, p in seen.items() if position - p <= window}
+        self.position, self.period, self.run, self._hash = position, period, run, h
+        return loop
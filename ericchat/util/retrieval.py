@@ -0,0 +1,377 @@
+import json
+import os
+import threading
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .search_index import tokenize
+
+# Local documents for retrieval: files are read line by line and cut into overlapping chunks, the
+# chunks are embedded in batches and appended to a VectorIndex. At question time the top-k chunks
+# are put in front of the question instead of the whole files.
+TEXT_SUFFIXES = {
+    ".txt", ".md", ".markdown", ".rst", ".org", ".tex", ".csv", ".tsv", ".json", ".yaml", ".yml", ".toml", ".ini",
+    ".cfg", ".xml", ".html", ".htm", ".css", ".py", ".js", ".ts", ".tsx", ".jsx", ".java", ".kt", ".swift", ".c",
+    ".h", ".cc", ".cpp", ".hpp", ".m", ".mm", ".go", ".rs", ".rb", ".php", ".sh", ".zsh", ".sql", ".r", ".jl",
+    ".lua", ".scala", ".cs", ".dart", ".vue", ".svelte",
+}
+MAX_FILE_BYTES = 20 * 1024 * 1024
+# "hashing" (the default) or a transformers embedding model, e.g. sentence-transformers/all-MiniLM-L6-v2
+EMBEDDER_ENV = "ERICCHAT_EMBEDDER"
+
+RETRIEVAL_PROMPT = "Excerpts from my files that may help:\n\n{excerpts}\n\nUsing them where they're relevant: {question}"
+
+
+def iter_files(paths: Iterable[Path]) -> Iterator[Path]:
+    # text files under paths, hidden folders (.git, .venv) and anything that looks binary are skipped
+    for root in paths:
+        root = Path(root)
+        if root.is_file():
+            yield root
+            continue
+        for folder, dirs, names in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in ("node_modules", "__pycache__"))
+            for name in sorted(names):
+                path = Path(folder) / name
+                if path.suffix.lower() not in TEXT_SUFFIXES or name.startswith("."):
+                    continue
+                try:
+                    if path.stat().st_size > MAX_FILE_BYTES:
+                        continue
+                    with open(path, "rb") as f:
+                        if b"\0" in f.read(4096):
+                            continue
+                except OSError:
+                    continue
+                yield path
+
+
+def _pieces(lines: Iterable[str], chunk_chars: int) -> Iterator[Tuple[int, str]]:
+    # minified or generated files can have one huge line, it's cut into chunk_chars pieces
+    for number, line in enumerate(lines, start=1):
+        for i in range(0, max(len(line), 1), chunk_chars):
+            yield number, line[i:i + chunk_chars]
+
+
+def chunk_lines(lines: Iterable[str], chunk_chars: int = 1200, overlap_chars: int = 200) -> Iterator[Tuple[int, str]]:
+    # (first line number, text) chunks of about chunk_chars, cut at line ends. The last lines of a chunk,
+    # up to overlap_chars, start the next one so an answer split across the cut is still found.
+    window: List[Tuple[int, str]] = []
+    size = 0
+    for number, piece in _pieces(lines, chunk_chars):
+        window.append((number, piece))
+        size += len(piece)
+        if size < chunk_chars:
+            continue
+        yield window[0][0], "".join(text for _, text in window)
+        keep: List[Tuple[int, str]] = []
+        kept = 0
+        for item in reversed(window[1:]):
+            if kept + len(item[1]) > overlap_chars:
+                break
+            keep.insert(0, item)
+            kept += len(item[1])
+        window, size = keep, kept
+    if any(text.strip() for _, text in window):
+        yield window[0][0], "".join(text for _, text in window)
+
+
+class HashingEmbedder:
+    # The fake (and dependency free) embedder: every word is hashed to one of dim slots with a sign,
+    # counts are damped with log1p and the vector is normalized. Finds shared words, not meaning,
+    # which is enough for tests, benchmarks and keyword heavy questions.
+    name = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self._slots: Dict[str, int] = {}
+
+    def _slot(self, token: str) -> int:
+        slot = self._slots.get(token)
+        if slot is None:
+            h = zlib.crc32(token.encode("utf-8"))
+            slot = (h % self.dim + 1) * (1 if h >> 31 else -1)
+            if len(self._slots) < 1_000_000:
+                self._slots[token] = slot
+        return slot
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows, slots = [], []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            rows.extend([i] * len(tokens))
+            slots.extend(self._slot(token) for token in tokens)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if slots:
+            slots_array = np.asarray(slots, dtype=np.int64)
+            np.add.at(out, (np.asarray(rows), np.abs(slots_array) - 1), np.sign(slots_array).astype(np.float32))
+        out = np.sign(out) * np.log1p(np.abs(out))
+        return _normalize(out)
+
+
+class TransformersEmbedder:
+    # A small sentence embedding model through transformers (mean pooled), e.g.
+    # sentence-transformers/all-MiniLM-L6-v2. Needs torch, imported on first use.
+    def __init__(self, model_name: str, max_tokens: int = 256):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.name = model_name
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.dim = self.model.config.hidden_size
+        self.max_tokens = max_tokens
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        batch = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_tokens, return_tensors="pt")
+        with self.torch.no_grad():
+            hidden = self.model(**batch).last_hidden_state
+        mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+        return _normalize(pooled.float().numpy())
+
+
+def get_embedder(spec: Optional[str] = None):
+    # "hashing" or the name or folder of a transformers embedding model, $ERICCHAT_EMBEDDER by default
+    spec = spec if spec is not None else os.environ.get(EMBEDDER_ENV, "")
+    if spec in ("", "hashing", "fake"):
+        return HashingEmbedder()
+    return TransformersEmbedder(spec)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+@dataclass
+class RetrievedChunk:
+    score: float
+    path: str
+    line: int
+    text: str
+
+
+class VectorIndex:
+    # Unit vectors in a flat float32 file that is memory mapped for search, so the index never has to
+    # fit in memory. The chunks' text is in a .jsonl next to it with a table of line offsets.
+    # Re-adding a changed file zeroes its old rows (they can't match anything) instead of rewriting.
+    def __init__(self, root: Path, dim: int, embedder: str = "hashing"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.meta_path = self.root / "index.json"
+        self.vectors_path = self.root / "vectors.f32"
+        self.chunks_path = self.root / "chunks.jsonl"
+        self.offsets_path = self.root / "offsets.u64"
+        self.lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+
+        meta = {}
+        if self.meta_path.is_file():
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        if meta and (meta["dim"] != dim or meta["embedder"] != embedder):
+            # vectors of another embedder can't be compared with the new ones
+            meta = {}
+            self._remove_files()
+        self.dim = dim
+        self.embedder = embedder
+        self.count = meta.get("count", 0)
+        # path -> {"mtime", "size", "first", "count"}
+        self.sources: Dict[str, dict] = meta.get("sources", {})
+        self._truncate()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _remove_files(self):
+        for path in (self.vectors_path, self.chunks_path, self.offsets_path, self.meta_path):
+            path.unlink(missing_ok=True)
+
+    def _truncate(self):
+        # rows written after the last save (a crash while ingesting) are dropped
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(self.count * self.dim * 4)
+        with open(self.offsets_path, "ab") as f:
+            f.truncate(self.count * 8)
+        end = 0
+        if self.count:
+            offsets = np.fromfile(self.offsets_path, dtype=np.uint64, count=self.count, offset=(self.count - 1) * 8)
+            with open(self.chunks_path, "rb") as f:
+                f.seek(int(offsets[-1]))
+                end = int(offsets[-1]) + len(f.readline())
+        with open(self.chunks_path, "ab") as f:
+            f.truncate(end)
+
+    def save(self):
+        with self.lock:
+            data = {"dim": self.dim, "embedder": self.embedder, "count": self.count, "sources": self.sources}
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+
+    def is_current(self, path: Path) -> bool:
+        source = self.sources.get(str(path))
+        if source is None:
+            return False
+        stat = path.stat()
+        return source["mtime"] == stat.st_mtime and source["size"] == stat.st_size
+
+    def add(self, vectors: np.ndarray, records: List[dict]):
+        # records are {"path", "line", "text"}, one per row of vectors
+        lines = [json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in records]
+        with self.lock:
+            with open(self.chunks_path, "ab") as f:
+                start = f.tell()
+                f.write(b"".join(lines))
+            offsets = np.cumsum([start] + [len(line) for line in lines[:-1]], dtype=np.uint64)
+            with open(self.offsets_path, "ab") as f:
+                f.write(offsets.tobytes())
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            self.count += len(records)
+            self._matrix = self._offsets = None
+
+    def start_source(self, path: Path):
+        # zero the rows of an older version of the file before its new chunks are added
+        old = self.sources.pop(str(path), None)
+        if old is not None and old["count"]:
+            with self.lock:
+                matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.count, self.dim))
+                matrix[old["first"]:old["first"] + old["count"]] = 0
+                matrix.flush()
+                del matrix
+                self._matrix = None
+        return self.count
+
+    def finish_source(self, path: Path, first: int):
+        stat = path.stat()
+        with self.lock:
+            self.sources[str(path)] = {"mtime": stat.st_mtime, "size": stat.st_size, "first": first, "count": self.count - first}
+
+    def _views(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            if self._matrix is None and self.count:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+                self._offsets = np.memmap(self.offsets_path, dtype=np.uint64, mode="r", shape=(self.count,))
+            return self._matrix, self._offsets
+
+    def search(self, queries: np.ndarray, k: int = 4, block_rows: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        # (scores, ids), both (len(queries), k) best first. The matrix is read in blocks, every query of the
+        # batch is scored against a block at once and only the running top k per query is kept.
+        matrix, _ = self._views()
+        queries = np.atleast_2d(queries).astype(np.float32)
+        n = len(queries)
+        if matrix is None:
+            return np.zeros((n, 0), dtype=np.float32), np.zeros((n, 0), dtype=np.int64)
+        k = min(k, len(matrix))
+        best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((n, k), dtype=np.int64)
+        for start in range(0, len(matrix), block_rows):
+            scores = queries @ matrix[start:start + block_rows].T
+            take = min(k, scores.shape[1])
+            top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            merged_ids = np.concatenate([best_ids, top + start], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+    def chunk(self, i: int) -> dict:
+        _, offsets = self._views()
+        with open(self.chunks_path, "rb") as f:
+            f.seek(int(offsets[i]))
+            return json.loads(f.readline())
+
+    def clear(self):
+        with self.lock:
+            self._matrix = self._offsets = None
+            self._remove_files()
+            self.count = 0
+            self.sources = {}
+            self.vectors_path.touch()
+            self.chunks_path.touch()
+            self.offsets_path.touch()
+
+
+def ingest(index: VectorIndex, embedder, paths: Iterable[Path], batch_size: int = 256, chunk_chars: int = 1200,
+           overlap_chars: int = 200, progress: Optional[Callable[[int, int], None]] = None,
+           should_stop: Callable[[], bool] = lambda: False) -> Dict[str, int]:
+    # One streaming pass: files are read line by line and embedded batch_size chunks at a time, memory
+    # stays flat for any amount of text. Unchanged files are skipped. progress(files, chunks).
+    stats = {"files": 0, "skipped": 0, "chunks": 0, "bytes": 0}
+    texts: List[str] = []
+    records: List[dict] = []
+
+    def flush():
+        if texts:
+            index.add(embedder.embed(texts), records)
+            texts.clear()
+            records.clear()
+
+    try:
+        for path in iter_files(paths):
+            if should_stop():
+                break
+            path = path.resolve()
+            if index.is_current(path):
+                stats["skipped"] += 1
+                continue
+            flush()
+            first = index.start_source(path)
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line, text in chunk_lines(f, chunk_chars, overlap_chars):
+                    texts.append(text)
+                    records.append({"path": str(path), "line": line, "text": text})
+                    stats["chunks"] += 1
+                    stats["bytes"] += len(text)
+                    if len(texts) >= batch_size:
+                        flush()
+            flush()
+            index.finish_source(path, first)
+            stats["files"] += 1
+            if progress is not None:
+                progress(stats["files"], stats["chunks"])
+    finally:
+        flush()
+        index.save()
+    return stats
+
+
+class Retriever:
+    def __init__(self, index: VectorIndex, embedder, k: int = 4, min_score: float = 0.1):
+        self.index = index
+        self.embedder = embedder
+        self.k = k
+        self.min_score = min_score
+
+    def search(self, queries: List[str], k: Optional[int] = None) -> List[List[RetrievedChunk]]:
+        if not len(self.index):
+            return [[] for _ in queries]
+        scores, ids = self.index.search(self.embedder.embed(queries), k or self.k)
+        results = []
+        for row_scores, row_ids in zip(scores, ids):
+            hits = []
+            for score, i in zip(row_scores, row_ids):
+                if score < self.min_score:
+                    continue
+                chunk = self.index.chunk(int(i))
+                hits.append(RetrievedChunk(float(score), chunk["path"], chunk["line"], chunk["text"]))
+            results.append(hits)
+        return results
+
+    def augment(self, question: str) -> str:
+        # the prompt the model gets: the question with its best excerpts, "" when nothing is close enough
+        hits = self.search([question])[0]
+        if not hits:
+            return ""
+        excerpts = "\n\n".join(f"[{i}] {Path(h.path).name}, line {h.line}:\n{h.text.strip()}" for i, h in enumerate(hits, start=1))
+        return RETRIEVAL_PROMPT.format(excerpts=excerpts, question=question)
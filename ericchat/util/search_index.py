@@ -0,0 +1,172 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+@dataclass
+class SearchHit:
+    convo_id: int
+    node_id: int
+    score: float
+    snippet: str
+
+
+class ConvoSearchIndex:
+    # In-process inverted index over committed chat messages.
+    # A document is one message, keyed by (convo_id, node_id) so messages on every branch are found.
+    # convo_id is stable across deletes, unlike the position of the conversation in EricUIState.convo_histories.
+    # Query terms are matched as prefixes through a sorted vocabulary, results are ranked with BM25.
+    # A prefix expands to the max_prefix_expansion words found in the most messages so one or two letter
+    # queries stay fast, the query tokens that were cut short are in truncated_prefixes after a search.
+    def __init__(self, max_prefix_expansion: int = 128, snippet_chars: int = 60):
+        self.max_prefix_expansion = max_prefix_expansion
+        self.snippet_chars = snippet_chars
+        self.truncated_prefixes: List[str] = []
+
+        self.postings: Dict[str, Dict[Tuple[int, int], int]] = {}
+        self.vocab: List[str] = []  # sorted, for prefix lookups
+
+        self.doc_lengths: Dict[Tuple[int, int], int] = {}
+        self.doc_text: Dict[Tuple[int, int], str] = {}
+        self.doc_terms: Dict[Tuple[int, int], Tuple[str, ...]] = {}
+        self.convo_docs: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, convo_id: int, node_id: int, text: str):
+        key = (convo_id, node_id)
+        if key in self.doc_lengths:
+            self._remove_doc(key)
+
+        tokens = tokenize(text)
+        if not tokens:
+            return
+
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.vocab, term)
+            posting[key] = tf
+
+        self.doc_lengths[key] = len(tokens)
+        self.doc_text[key] = text[:self.snippet_chars * 4]
+        self.doc_terms[key] = tuple(counts)
+        self.convo_docs[convo_id].append(key)
+        self.total_length += len(tokens)
+
+    def remove_convo(self, convo_id: int):
+        for key in self.convo_docs.pop(convo_id, []):
+            self._remove_doc(key)
+
+    def _remove_doc(self, key: Tuple[int, int]):
+        length = self.doc_lengths.pop(key, None)
+        if length is None:
+            return
+        self.doc_text.pop(key, None)
+        self.total_length -= length
+
+        for term in self.doc_terms.pop(key, ()):
+            posting = self.postings.get(term)
+            if posting is None or posting.pop(key, None) is None:
+                continue
+            if not posting:
+                del self.postings[term]
+                i = bisect_left(self.vocab, term)
+                if i < len(self.vocab) and self.vocab[i] == term:
+                    self.vocab.pop(i)
+
+        docs = self.convo_docs.get(key[0])
+        if docs and key in docs:
+            docs.remove(key)
+
+    def _expand(self, prefix: str) -> Tuple[List[str], bool]:
+        # (terms, whether some were left out)
+        # every word with the prefix sorts before the prefix with its last letter bumped
+        start = bisect_left(self.vocab, prefix)
+        end = bisect_left(self.vocab, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo=start)
+        terms = self.vocab[start:end]
+        if len(terms) <= self.max_prefix_expansion:
+            return terms, False
+        # the exact word always counts, it's first in sorted order
+        rest = heapq.nlargest(self.max_prefix_expansion - 1, terms[1:] if terms[0] == prefix else terms,
+                              key=lambda term: len(self.postings[term]))
+        return ([prefix] if terms[0] == prefix else []) + rest, True
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        query_tokens = tokenize(query)
+        self.truncated_prefixes = []
+        if not query_tokens or not self.doc_lengths:
+            return []
+
+        n_docs = len(self.doc_lengths)
+        doc_lengths = self.doc_lengths
+        # BM25 length normalisation folded into two constants so the inner loop stays small
+        norm_a = _K1 * (1 - _B)
+        norm_b = _K1 * _B * n_docs / self.total_length
+
+        # every query token has to match (as a prefix) for a message to be a hit
+        scores = None
+        for token in query_tokens:
+            token_scores: Dict[Tuple[int, int], float] = defaultdict(float)
+            terms, truncated = self._expand(token)
+            if truncated:
+                self.truncated_prefixes.append(token)
+            for term in terms:
+                posting = self.postings[term]
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                # exact matches rank above words that only share the prefix
+                weight = (1.0 if term == token else 0.7) * idf * (_K1 + 1)
+                for key, tf in posting.items():
+                    if scores is not None and key not in scores:
+                        continue
+                    token_scores[key] += weight * tf / (tf + norm_a + norm_b * doc_lengths[key])
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {key: scores[key] + s for key, s in token_scores.items()}
+            if not scores:
+                return []
+
+        # best message per conversation
+        best: Dict[int, Tuple[float, int]] = {}
+        for (convo_id, node_id), score in scores.items():
+            current = best.get(convo_id)
+            if current is None or score > current[0]:
+                best[convo_id] = (score, node_id)
+
+        ranked = heapq.nlargest(limit, best.items(), key=lambda item: item[1][0])
+        return [
+            SearchHit(convo_id=convo_id,
+                      node_id=node_id,
+                      score=score,
+                      snippet=self._snippet((convo_id, node_id), query_tokens[0]))
+            for convo_id, (score, node_id) in ranked
+        ]
+
+    def _snippet(self, key: Tuple[int, int], token: str) -> str:
+        text = self.doc_text.get(key, "").replace("\n", " ")
+        i = text.lower().find(token)
+        start = max(0, i - self.snippet_chars // 4) if i >= 0 else 0
+        return text[start:start + self.snippet_chars].strip()
@@ -0,0 +1,252 @@
+import random
+import time
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+
+class DraftController:
+    # Picks K, the number of tokens the draft model proposes per round.
+    #
+    # With a per-token acceptance rate a, a round of K drafts yields (1 - a^(K+1)) / (1 - a) tokens
+    # for K draft steps plus one verify pass of the target. K is chosen to maximise tokens per unit of
+    # target time from the measured rate and the measured draft/verify cost ratio. Both estimates decay
+    # so K follows the text: high for boilerplate the draft predicts well, low for everything else.
+    # When no K beats plain decoding the draft is switched off (K = 0) and retried every probe_interval rounds.
+    def __init__(self, k: int = 3, min_k: int = 1, max_k: int = 8, decay: float = 0.9,
+                 cost_ratio: float = 0.1, probe_interval: int = 16):
+        self.min_k = max(1, int(min_k))
+        self.max_k = max(self.min_k, int(max_k))
+        self.k = min(max(int(k), self.min_k), self.max_k)
+        self.decay = decay
+        self.probe_interval = probe_interval
+
+        # decayed counts for the acceptance estimate
+        self._accepted = 0.0
+        self._rejected = 0.0
+        # decayed draft-step / verify-pass time, starts from the cost_ratio guess
+        self._cost_ratio = cost_ratio
+        self._off_rounds = 0
+
+        # lifetime counters for telemetry
+        self.rounds = 0
+        self.proposed = 0
+        self.accepted = 0
+
+    def reset_stats(self):
+        # per message telemetry, K and the estimates carry over to the next message
+        self.rounds = 0
+        self.proposed = 0
+        self.accepted = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    @property
+    def estimated_rate(self) -> float:
+        # geometric estimate: drafts are checked until the first mismatch
+        seen = self._accepted + self._rejected
+        if not seen:
+            return 0.5
+        return min(0.99, self._accepted / seen)
+
+    @property
+    def cost_ratio(self) -> float:
+        return self._cost_ratio
+
+    def expected_tokens(self, k: int, rate: Optional[float] = None) -> float:
+        a = self.estimated_rate if rate is None else rate
+        return (1 - a ** (k + 1)) / (1 - a)
+
+    def speedup(self, k: int) -> float:
+        # tokens per target pass relative to plain decoding
+        return self.expected_tokens(k) / (1 + k * self._cost_ratio)
+
+    def update(self, proposed: int, accepted: int, draft_seconds: float = 0.0, verify_seconds: float = 0.0):
+        self.rounds += 1
+        if proposed <= 0:
+            # a plain decoding round while the draft is switched off
+            self._off_rounds += 1
+            if self._off_rounds >= self.probe_interval:
+                self._off_rounds = 0
+                self.k = self._best_k()
+            return
+
+        self.proposed += proposed
+        self.accepted += accepted
+
+        self._accepted = self._accepted * self.decay + accepted
+        self._rejected = self._rejected * self.decay + (1 if accepted < proposed else 0)
+        if draft_seconds > 0 and verify_seconds > 0:
+            ratio = draft_seconds / proposed / verify_seconds
+            self._cost_ratio = self._cost_ratio * self.decay + ratio * (1 - self.decay)
+
+        best = self._best_k()
+        self.k = best if self.speedup(best) > 1.0 else 0
+
+    def _best_k(self) -> int:
+        return max(range(self.min_k, self.max_k + 1), key=self.speedup)
+
+    def telemetry(self) -> dict:
+        return {"draft_acceptance": self.acceptance_rate, "draft_k": float(self.k)}
+
+
+class SpeculativeModel:
+    # One side of speculative decoding, a model with a KV cache.
+    #   prefill(tokens)      process the prompt except its last token
+    #   step(tokens, n)      feed tokens and return the next-token choice at each of the last n positions
+    #   trim(n)              drop the last n positions from the cache, raises when it can't drop all n
+    #   can_trim(n)          True when n more positions can be fed and then trimmed again. A sliding
+    #                        window cache can't once it has wrapped around
+    def prefill(self, tokens: Sequence[int]):
+        raise NotImplementedError
+
+    def step(self, tokens: Sequence[int], n_predict: int = 1) -> List[int]:
+        raise NotImplementedError
+
+    def trim(self, n: int):
+        raise NotImplementedError
+
+    def can_trim(self, n: int) -> bool:
+        return True
+
+
+def speculative_generate(target: SpeculativeModel, draft: SpeculativeModel, prompt: Sequence[int],
+                         max_tokens: int, controller: DraftController,
+                         check_cancelled: Optional[Callable[[], None]] = None,
+                         clock: Callable[[], float] = time.perf_counter) -> Iterator[Tuple[int, bool]]:
+    # (token, from_draft) pairs. The draft proposes controller.k tokens, the target checks all of them
+    # in one step and the longest agreeing prefix is kept, followed by the target's own next token.
+    # Greedy agreement like mlx-lm's speculative_generate_step, so the output is the target's.
+    # A round whose rejected drafts couldn't be trimmed from either cache decodes without drafts.
+
+    # the draft first, it's the cheaper one and the target's prefill is the one that reports progress
+    draft.prefill(prompt[:-1])
+    target.prefill(prompt[:-1])
+
+    y = [prompt[-1]]  # not yet seen by the target
+    draft_y = [prompt[-1]]  # not yet seen by the draft
+    ntoks = 0
+
+    while ntoks < max_tokens:
+        if check_cancelled is not None:
+            check_cancelled()
+
+        k = min(controller.k, max_tokens - ntoks - 1) if controller.k else 0
+        if k and not (target.can_trim(k + 1) and draft.can_trim(k)):
+            k = 0
+
+        start = clock()
+        drafts = []
+        if k:
+            last = draft_y
+            for _ in range(k):
+                last = draft.step(last, 1)
+                drafts.extend(last)
+        draft_seconds = clock() - start
+
+        start = clock()
+        verified = target.step(y + drafts, k + 1)
+        verify_seconds = clock() - start
+
+        n = 0
+        while n < k and verified[n] == drafts[n]:
+            n += 1
+        controller.update(k, n, draft_seconds, verify_seconds)
+
+        for token in verified[:n]:
+            ntoks += 1
+            yield token, True
+        ntoks += 1
+        yield verified[n], False
+
+        # the target saw every draft, the draft never saw its own last one
+        target.trim(k - n)
+        if k:
+            draft.trim(max(k - n - 1, 0))
+        if k and n == k:
+            draft_y = [drafts[-1], verified[n]]
+        elif k:
+            draft_y = [verified[n]]
+        else:
+            # the draft sat this round out, catch it up with what the target produced
+            draft_y = draft_y + [verified[n]]
+        y = [verified[n]]
+
+
+class SimClock:
+    # Simulated time for fake models, so benchmarks measure the algorithm and not time.sleep.
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeTargetModel(SpeculativeModel):
+    # Produces a fixed token sequence (token i is i % vocab) and costs verify_seconds per step,
+    # however many positions are checked, like a memory-bound forward pass.
+    # With a window, positions can only be trimmed while the cache holds fewer than window, like a
+    # sliding window layer.
+    def __init__(self, clock: SimClock, verify_seconds: float = 0.05, vocab: int = 1000, window: int = 0):
+        self.clock = clock
+        self.verify_seconds = verify_seconds
+        self.vocab = vocab
+        self.window = window
+        self.position = 0
+        self.steps = 0
+
+    def token_at(self, position: int) -> int:
+        return position % self.vocab
+
+    def prefill(self, tokens: Sequence[int]):
+        self.position = 0
+
+    def step(self, tokens: Sequence[int], n_predict: int = 1) -> List[int]:
+        self.clock.now += self.verify_seconds
+        self.steps += 1
+        # every fed token takes a position, the prediction at each of the last n is the true next token
+        start = self.position + len(tokens) - n_predict
+        self.position += len(tokens)
+        return [self.token_at(start + i) for i in range(n_predict)]
+
+    def can_trim(self, n: int) -> bool:
+        return not self.window or self.position + n < self.window
+
+    def trim(self, n: int):
+        if n and not self.can_trim(0):
+            raise RuntimeError(f"Can't trim {n} positions from a full window")
+        self.position -= n
+
+
+class FakeDraftModel(SpeculativeModel):
+    # Agrees with a FakeTargetModel at each position with a scripted probability.
+    # agreement is a float or a function of the position, e.g. to model a run of boilerplate.
+    def __init__(self, target: FakeTargetModel, clock: SimClock, agreement=0.8,
+                 step_seconds: float = 0.005, seed: int = 0):
+        self.target = target
+        self.clock = clock
+        self.agreement = agreement
+        self.step_seconds = step_seconds
+        self.rnd = random.Random(seed)
+        self.position = 0
+
+    def _agreement(self, position: int) -> float:
+        return self.agreement(position) if callable(self.agreement) else self.agreement
+
+    def prefill(self, tokens: Sequence[int]):
+        self.position = 0
+
+    def step(self, tokens: Sequence[int], n_predict: int = 1) -> List[int]:
+        self.clock.now += self.step_seconds
+        start = self.position + len(tokens) - n_predict
+        self.position += len(tokens)
+        out = []
+        for i in range(n_predict):
+            token = self.target.token_at(start + i)
+            if self.rnd.random() >= self._agreement(start + i):
+                token = (token + 1) % self.target.vocab
+            out.append(token)
+        return out
+
+    def trim(self, n: int):
+        self.position -= n
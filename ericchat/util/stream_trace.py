@@ -0,0 +1,99 @@
+import json
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+from .convo_archive import _is_zstd, _iter_lines, _require_zstd
+
+if TYPE_CHECKING:
+    from erictransformer import CHATStreamResult
+
+# A trace is JSON lines, optionally zstd compressed when the file name ends in ".zst":
+#   {"ericchat_trace": 1, ...}                     header, with whatever the recorder was told
+#   [dt, marker, text]                             one line per CHATStreamResult
+#   [dt, marker, text, telemetry]                  when the piece carried payload["telemetry"]
+# dt is the seconds since the previous piece, or since the recorder started for the first one,
+# so the first dt covers the prefill.
+TRACE_VERSION = 1
+
+
+class StreamRecorder:
+    def __init__(self, path: Path, **header):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._raw = open(self.path, "wb")
+        if _is_zstd(self.path):
+            self._out = _require_zstd().ZstdCompressor(level=10).stream_writer(self._raw, closefd=False)
+        else:
+            self._out = self._raw
+        self._out.write(json.dumps({"ericchat_trace": TRACE_VERSION, **header}).encode("utf-8") + b"\n")
+        self._last = time.monotonic()
+        self.count = 0
+
+    def record(self, piece):
+        now = time.monotonic()
+        line = [round(now - self._last, 6), piece.marker, piece.text]
+        telemetry = piece.payload.get("telemetry") if isinstance(piece.payload, dict) else None
+        if telemetry:
+            line.append(telemetry)
+        self._last = now
+        self._out.write(json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.count += 1
+
+    def close(self):
+        if self._raw is None:
+            return
+        if self._out is not self._raw:
+            self._out.close()
+        self._raw.close()
+        self._raw = None
+
+    def __enter__(self) -> "StreamRecorder":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace_header(path: Path) -> dict:
+    lines = _read(path)
+    try:
+        return next(lines)[1]
+    finally:
+        lines.close()
+
+
+def read_trace(path: Path) -> Iterator[Tuple[float, "CHATStreamResult"]]:
+    # (dt, piece) in recorded order, read as a stream
+    from erictransformer import CHATStreamResult
+
+    lines = _read(path)
+    next(lines)
+    for dt, line in lines:
+        payload = {"telemetry": line[3]} if len(line) > 3 else {}
+        yield dt, CHATStreamResult(text=line[2], marker=line[1], payload=payload)
+
+
+def _read(path: Path) -> Iterator[Tuple[float, Optional[list]]]:
+    path = Path(path)
+    with open(path, "rb") as raw:
+        source = _require_zstd().ZstdDecompressor().stream_reader(raw, closefd=False) if _is_zstd(path) else raw
+        lines = _iter_lines(source)
+
+        header = json.loads(next(lines, b"{}") or b"{}")
+        version = header.get("ericchat_trace")
+        if version is None:
+            raise ValueError(f"{path.name} is not an Eric Chat trace")
+        if version > TRACE_VERSION:
+            raise ValueError(f"{path.name} was written by a newer version of Eric Chat")
+        yield 0.0, header
+
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the recorder was killed mid-line
+                break
+            yield float(record[0]), record
@@ -0,0 +1,219 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# Typed background work of the app. Every task runs on the executor of its lane, a lane has a fixed
+# number of workers. Loading and generating share the single "model" worker, so a load can't start
+# while a stream is still running: submitting a load cancels the streams and waits its turn.
+# Checking an installed model's files has a lane of its own, a load doesn't wait for a download.
+DOWNLOAD = "download"
+VERIFY = "verify"
+LOAD = "load"
+GENERATE = "generate"
+IO = "io"
+
+LANES = {DOWNLOAD: "download", VERIFY: "verify", LOAD: "model", GENERATE: "model", IO: "io"}
+LANE_WORKERS = {"download": 1, "verify": 1, "model": 1, "io": 1}
+
+# kinds whose pending and running tasks are cancelled when a task of the key's kind is submitted
+SUPERSEDES = {LOAD: (LOAD, GENERATE)}
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+TRANSITIONS = {PENDING: (RUNNING, CANCELLED), RUNNING: FINISHED}
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.requested_at = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.requested_at = time.monotonic()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn()
+
+    def on_cancel(self, fn: Callable[[], None]):
+        # e.g. a backend's cancel(), called once on the cancelling thread, right away if already cancelled
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+
+@dataclass
+class TaskEvent:
+    task_id: int
+    kind: str
+    name: str
+    state: str
+    progress: float = -1.0  # 0 to 1, -1 when unknown
+    message: str = ""
+    error: str = ""
+
+
+class Task:
+    def __init__(self, manager: "TaskManager", task_id: int, kind: str, name: str, fn: Callable, args, kwargs):
+        self.manager = manager
+        self.id = task_id
+        self.kind = kind
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = PENDING
+        self.token = CancelToken()
+        self.progress = -1.0
+        self.message = ""
+        self.error: Optional[BaseException] = None
+        self.result = None
+        self._done = threading.Event()
+        self._last_report = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED
+
+    def cancel(self):
+        self.token.cancel()
+        # a pending task never starts, a running one stops at its next token check
+        self.manager._cancel_pending(self)
+
+    def report(self, progress: Optional[float] = None, message: Optional[str] = None):
+        # called by the task's function, from backend and download callbacks too, so it never raises
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if now - self._last_report >= self.manager.min_interval or self.progress >= 1.0:
+            self._last_report = now
+            self.manager._publish(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def event(self) -> TaskEvent:
+        return TaskEvent(self.id, self.kind, self.name, self.state, self.progress, self.message,
+                         f"{self.error}" if self.error is not None else "")
+
+
+class TaskManager:
+    # on_event gets a TaskEvent for every state change and (at most every min_interval) progress
+    # report. It's called on the worker threads, the app hands it to the UI loop.
+    def __init__(self, on_event: Optional[Callable[[TaskEvent], None]] = None,
+                 lanes: Optional[Dict[str, int]] = None, min_interval: float = 0.05):
+        self.on_event = on_event
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.executors = {lane: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ericchat-{lane}")
+                          for lane, workers in (lanes or LANE_WORKERS).items()}
+        self.tasks: Dict[int, Task] = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, kind: str, fn: Callable, *args, name: str = "", **kwargs) -> Task:
+        # fn(task, *args, **kwargs) runs on the lane of kind
+        with self.lock:
+            task = Task(self, next(self._ids), kind, name or kind, fn, args, kwargs)
+            superseded = [t for t in self.tasks.values() if t.kind in SUPERSEDES.get(kind, ())]
+            self.tasks[task.id] = task
+        for old in superseded:
+            old.cancel()
+        self._publish(task)
+        self.executors[LANES[kind]].submit(self._run, task)
+        return task
+
+    def _set_state(self, task: Task, state: str) -> bool:
+        with self.lock:
+            if state not in TRANSITIONS.get(task.state, ()):
+                return False
+            task.state = state
+            if state in FINISHED:
+                self.tasks.pop(task.id, None)
+        return True
+
+    def _cancel_pending(self, task: Task):
+        # a running task is only finished by _run, once its function has returned
+        with self.lock:
+            if task.state != PENDING:
+                return
+            task.state = CANCELLED
+            self.tasks.pop(task.id, None)
+        self._publish(task)
+        task._done.set()
+
+    def _run(self, task: Task):
+        if not self._set_state(task, RUNNING):
+            return
+        self._publish(task)
+        try:
+            task.result = task.fn(task, *task.args, **task.kwargs)
+            state = CANCELLED if task.token.cancelled else DONE
+        except TaskCancelled:
+            state = CANCELLED
+        except Exception as e:
+            task.error = e
+            state = CANCELLED if task.token.cancelled else FAILED
+        self._set_state(task, state)
+        self._publish(task)
+        task._done.set()
+
+    def _publish(self, task: Task):
+        if self.on_event is not None:
+            self.on_event(task.event())
+
+    def active(self, *kinds: str) -> List[Task]:
+        with self.lock:
+            return [t for t in self.tasks.values() if not kinds or t.kind in kinds]
+
+    def busy(self, *kinds: str) -> bool:
+        return len(self.active(*kinds)) > 0
+
+    def cancel(self, *kinds: str):
+        for task in self.active(*kinds):
+            task.cancel()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for task in self.active():
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not task.wait(left):
+                return False
+        return True
+
+    def shutdown(self, cancel: bool = True, wait: bool = False):
+        if cancel:
+            self.cancel()
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
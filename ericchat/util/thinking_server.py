@@ -0,0 +1,57 @@
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class ThinkingServer:
+    # Serves the thinking trace of a committed message when its collapsed block is opened in the
+    # transcript, so a render only carries the summary line. Listens on a free localhost port. The
+    # transcript is loaded under the server's origin, so no other page can read the traces, and the
+    # random token in the path keeps them from being guessed.
+    # lookup(convo_id, node_id) returns the trace's text or None, it's called on the server's threads.
+    def __init__(self, lookup: Callable[[int, int], Optional[str]], host: str = "127.0.0.1"):
+        self.lookup = lookup
+        self.token = secrets.token_urlsafe(16)
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._respond(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, 0), _Handler)
+        self._httpd.daemon_threads = True
+        self.origin = f"http://{host}:{self._httpd.server_port}/"
+        self.url = f"{self.origin}{self.token}/thinking"
+        self._thread: Optional[threading.Thread] = None
+
+    def _respond(self, request: BaseHTTPRequestHandler):
+        # /<token>/thinking/<convo_id>/<node_id>
+        prefix = f"/{self.token}/thinking/"
+        ids = request.path[len(prefix):].split("/") if request.path.startswith(prefix) else []
+        text = None
+        if len(ids) == 2 and all(part.isdigit() for part in ids):
+            text = self.lookup(int(ids[0]), int(ids[1]))
+        if text is None:
+            request.send_error(404)
+            return
+        body = text.encode("utf-8")
+        request.send_response(200)
+        request.send_header("Content-Type", "text/plain; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self) -> "ThinkingServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="ericchat-thinking")
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
@@ -0,0 +1,140 @@
+import zlib
+from collections import deque
+from typing import Optional
+
+THINKING_STRATEGIES = ("head", "tail", "head_tail")
+
+
+class ThinkingTrace:
+    # Holds the reasoning tokens of one assistant message apart from its visible text.
+    # Only max_chars are kept in memory. What gets dropped depends on strategy:
+    #   head:      keep the start of the trace, drop everything after the cap
+    #   tail:      keep the most recent max_chars
+    #   head_tail: keep the first half of the cap and a rolling window of the most recent half
+    def __init__(self, max_chars: int = 200_000, strategy: str = "head_tail"):
+        if strategy not in THINKING_STRATEGIES:
+            raise ValueError(f"Unknown thinking strategy: {strategy}")
+
+        self.max_chars = max(0, int(max_chars))
+        self.strategy = strategy
+
+        self.head = []
+        self.head_len = 0
+        self.tail = deque()
+        self.tail_len = 0
+
+        self.total_chars = 0
+        self.steps = 0
+
+        self._joined: Optional[str] = None
+        self._compressed: Optional[bytes] = None
+
+    @classmethod
+    def from_text(cls, text: str, total_chars: int = 0, max_chars: int = 200_000, strategy: str = "head_tail") -> "ThinkingTrace":
+        # rebuild a trace that was already truncated when it was saved, the saved text is kept as is
+        trace = cls(max_chars=max_chars, strategy=strategy)
+        trace.head = [text]
+        trace.head_len = len(text)
+        trace.total_chars = max(len(text), int(total_chars))
+        trace.steps = 1
+        trace._joined = text
+        return trace
+
+    @property
+    def dropped_chars(self) -> int:
+        return max(0, self.total_chars - self.kept_chars)
+
+    @property
+    def kept_chars(self) -> int:
+        return self.head_len + self.tail_len
+
+    @property
+    def is_truncated(self) -> bool:
+        return self.dropped_chars > 0
+
+    def _head_cap(self) -> int:
+        if self.strategy == "head":
+            return self.max_chars
+        if self.strategy == "tail":
+            return 0
+        return self.max_chars // 2
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._thaw()
+        self._joined = None
+        self.total_chars += len(text)
+        self.steps += 1
+
+        head_room = self._head_cap() - self.head_len
+        if head_room > 0:
+            self.head.append(text[:head_room])
+            self.head_len += min(head_room, len(text))
+            text = text[head_room:]
+            if not text:
+                return
+
+        tail_cap = self.max_chars - self._head_cap()
+        if tail_cap <= 0:
+            return
+
+        self.tail.append(text)
+        self.tail_len += len(text)
+
+        # amortized O(1): whole chunks are popped, only the oldest one is ever sliced
+        while self.tail_len > tail_cap:
+            overflow = self.tail_len - tail_cap
+            oldest = self.tail[0]
+            if len(oldest) <= overflow:
+                self.tail.popleft()
+                self.tail_len -= len(oldest)
+            else:
+                self.tail[0] = oldest[overflow:]
+                self.tail_len -= overflow
+
+    def text(self, marker: str = "\n\n[…]\n\n") -> str:
+        if self._joined is not None:
+            return self._joined
+
+        if self._compressed is not None:
+            return zlib.decompress(self._compressed).decode("utf-8")
+
+        head = "".join(self.head)
+        tail = "".join(self.tail)
+        if self.is_truncated and self.strategy != "head":
+            self._joined = f"{head}{marker}{tail}" if head else f"{marker}{tail}"
+        elif self.is_truncated:
+            self._joined = f"{head}{marker}"
+        else:
+            self._joined = head + tail
+        return self._joined
+
+    def compress(self):
+        # Trade a little CPU at render time for a much smaller resident trace.
+        if self._compressed is not None:
+            return
+        self._compressed = zlib.compress(self.text().encode("utf-8"), 6)
+        self._drop_plain()
+
+    @property
+    def is_frozen(self) -> bool:
+        return self._compressed is not None
+
+    def _drop_plain(self):
+        self.head = []
+        self.tail = deque()
+        self._joined = None
+
+    def _thaw(self):
+        # appending to a frozen trace: restore it into the head so the cap still applies
+        if not self.is_frozen:
+            return
+        text = zlib.decompress(self._compressed).decode("utf-8")
+        self._compressed = None
+        self.head = [text]
+        self.head_len = len(text)
+        self.tail_len = 0
+
+    def __len__(self) -> int:
+        return self.total_chars
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("erictransformer")
+
+from erictransformer import CHATCallArgs  # noqa: E402
+
+from ericchat.backends import (FakeChatBackend, InferenceCancelled,  # noqa: E402
+                               ProcessChatBackend)
+
+
+def _stream_in_background(backend, messages, args, **kwargs):
+    outcome = {"pieces": 0, "prefilled": 0}
+    done = threading.Event()
+
+    def _on_prefill(processed, total):
+        outcome["prefilled"] = processed
+
+    def _consume():
+        try:
+            for _ in backend.stream(messages, args, on_prefill=_on_prefill, **kwargs):
+                outcome["pieces"] += 1
+            outcome["result"] = "done"
+        except InferenceCancelled:
+            outcome["result"] = "cancelled"
+        finally:
+            done.set()
+
+    threading.Thread(target=_consume, daemon=True).start()
+    return outcome, done
+
+
+def test_cancel_during_prefill_stops_at_the_next_chunk():
+    # 20000 tokens at 4000 tokens/s take 5 s to prefill, a chunk of 256 takes 64 ms
+    backend = FakeChatBackend(prefill_tps=4000)
+    messages = [{"role": "user", "content": "word " * 20_000}]
+    for _ in range(3):
+        outcome, done = _stream_in_background(backend, messages, CHATCallArgs(max_len=64), prefill_step_size=256)
+        time.sleep(0.2)
+        start = time.monotonic()
+        backend.cancel()
+        assert done.wait(2)
+        assert time.monotonic() - start < 0.064 + 0.25
+        assert outcome["result"] == "cancelled"
+        assert outcome["pieces"] == 0
+        assert 0 < outcome["prefilled"] < backend.prompt_tokens(messages)
+
+
+def test_cancel_during_decode_stops_at_the_next_token():
+    backend = FakeChatBackend(prefill_tps=0, decode_tps=50, answer="word " * 1000)
+    outcome, done = _stream_in_background(backend, [{"role": "user", "content": "hi"}], CHATCallArgs(max_len=2000))
+    time.sleep(0.2)
+    start = time.monotonic()
+    backend.cancel()
+    assert done.wait(2)
+    assert time.monotonic() - start < 0.02 + 0.25
+    assert outcome["result"] == "cancelled"
+    assert 0 < outcome["pieces"] < 1000
+
+    # the next stream isn't cancelled by the last one's cancel
+    pieces = list(backend.stream([{"role": "user", "content": "hi"}], CHATCallArgs(max_len=5)))
+    assert len(pieces) == 5
+
+
+def test_candidates_share_their_steps():
+    backend = FakeChatBackend(prefill_tps=0, decode_tps=500, answer="word " * 50, batch_cost=0.1)
+    messages = [{"role": "user", "content": "hi"}]
+    args = CHATCallArgs(max_len=100)
+
+    start = time.perf_counter()
+    for _ in range(4):
+        single = list(backend.stream(messages, args))
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = list(backend.stream_candidates(messages, args, 4))
+    batch = time.perf_counter() - start
+
+    assert [piece for index, piece in batched if index == 0] == single
+    assert {index for index, _ in batched} == {0, 1, 2, 3}
+    # 1.3 single steps per batched step against 4
+    assert batch < sequential * 0.6
+
+
+def test_process_backend_restarts_after_a_crash():
+    messages = [{"role": "user", "content": "hi"}]
+    args = CHATCallArgs(max_len=100)
+    backend = ProcessChatBackend(FakeChatBackend, "fake", load_timeout=60, prefill_tps=0, decode_tps=0)
+    try:
+        first = [(piece.marker, piece.text) for piece in backend.stream(messages, args)]
+        assert ("text", "answer. ") in first
+
+        # the model takes the child down, the GUI finds out on the next stream
+        backend.process.kill()
+        backend.process.join(5)
+        assert not backend.is_alive()
+        with pytest.raises(RuntimeError, match="exited unexpectedly"):
+            list(backend.stream(messages, args))
+    finally:
+        backend.unload()
+
+    backend = ProcessChatBackend(FakeChatBackend, "fake", load_timeout=60, prefill_tps=0, decode_tps=0)
+    try:
+        assert backend.is_alive()
+        assert [(piece.marker, piece.text) for piece in backend.stream(messages, args)] == first
+    finally:
+        backend.unload()
+    assert not backend.is_alive()
+
+
+def test_process_backend_cancel_and_early_stop():
+    backend = ProcessChatBackend(FakeChatBackend, "fake", load_timeout=60, prefill_tps=0, decode_tps=50,
+                                 answer="word " * 1000)
+    messages = [{"role": "user", "content": "hi"}]
+    try:
+        outcome, done = _stream_in_background(backend, messages, CHATCallArgs(max_len=2000))
+        time.sleep(0.3)
+        start = time.monotonic()
+        backend.cancel()
+        assert done.wait(2)
+        assert time.monotonic() - start < 0.5
+        assert outcome["result"] == "cancelled"
+
+        # a caller that stops reading leaves a clean pipe for the next stream
+        pieces = backend.stream(messages, CHATCallArgs(max_len=2000))
+        next(pieces)
+        pieces.close()
+        assert len(list(backend.stream(messages, CHATCallArgs(max_len=3)))) == 3
+    finally:
+        backend.unload()
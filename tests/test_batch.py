@@ -0,0 +1,60 @@
+import json
+import signal
+import threading
+
+import pytest
+
+pytest.importorskip("erictransformer")
+
+from ericchat.backends import FakeChatBackend  # noqa: E402
+from ericchat.batch import finished_ids, run_batch  # noqa: E402
+
+PROMPTS = 20
+
+
+class _Flaky(FakeChatBackend):
+    # fails the prompts in fail, and presses Ctrl-C while the interrupt_at-th prompt is answered
+    def __init__(self, fail=(), interrupt_at: int = 0):
+        super().__init__(decode_tps=400.0)
+        self.fail = set(fail)
+        self.interrupt_at = interrupt_at
+        self.calls = 0
+
+    def stream(self, messages, args, **kwargs):
+        self.calls += 1
+        if self.calls == self.interrupt_at:
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+        if messages[-1]["content"] in self.fail:
+            raise RuntimeError("out of memory")
+        yield from super().stream(messages, args, **kwargs)
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_an_interrupted_run_resumes(tmp_path):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text("".join(json.dumps({"id": f"p{i}", "prompt": f"question {i}"}) + "\n" for i in range(PROMPTS)))
+    output = tmp_path / "prompts.results.jsonl"
+
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(lambda: _Flaky(fail={"question 3", "question 7"}, interrupt_at=10), prompts, output)
+    first = _lines(output)
+    assert 9 <= len(first) <= 10
+    assert [r["id"] for r in first if "error" in r] == ["p3", "p7"]
+    # a crash in the middle of writing a result
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"id": "p10", "text": "This is')
+
+    assert finished_ids(output) == {r["id"] for r in first if "error" not in r}
+    assert output.read_text(encoding="utf-8").endswith("}\n")
+
+    stats = run_batch(lambda: _Flaky(), prompts, output)
+    assert stats["skipped"] == len(first) - 2
+    assert stats["prompts"] == PROMPTS - stats["skipped"]
+    assert stats["failed"] == 0
+    # the failed prompts ran again, every prompt has one answer
+    answers = [r["id"] for r in _lines(output) if "error" not in r]
+    assert sorted(answers) == sorted(f"p{i}" for i in range(PROMPTS))
+    assert finished_ids(output) == set(answers)
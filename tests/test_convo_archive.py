@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from ericchat.cli import main
+from ericchat.util import (ChatMessage, ConvoJournal, ConvoTree,
+                           ThinkingTrace, get_journal_path, read_archive,
+                           write_archive)
+
+
+def _texts(tree: ConvoTree):
+    return [msg.text for msg in tree]
+
+
+def _write_journal(data_dir, convos) -> ConvoJournal:
+    # convos is convo_id -> list of (text, role), the way EricUIState commits them
+    journal = ConvoJournal(get_journal_path(data_dir), fsync=False)
+    journal.start()
+    for convo_id, messages in convos.items():
+        journal.record_new(convo_id)
+        tree = ConvoTree()
+        for text, role in messages:
+            tree.append(ChatMessage(text=text, role=role, marker="text" if role == "assistant" else ""))
+            journal.record_message(convo_id, len(tree) - 1, tree[-1])
+    return journal
+
+
+def _messages(n: int):
+    return [(f"message {i}", "user" if i % 2 == 0 else "assistant") for i in range(n)]
+
+
+def test_export_and_import_into_a_journal_with_conversations(tmp_path):
+    journal = _write_journal(tmp_path / "a", {0: _messages(4), 1: _messages(7), 2: _messages(2)})
+    journal.record_delete(1)
+    journal.close()
+    archive = tmp_path / "convos.jsonl"
+    assert main(["export", str(archive), "--data-dir", str(tmp_path / "a")]) == 0
+    # the deleted convo isn't exported
+    assert sum(1 for _ in open(archive)) == 1 + 4 + 2
+
+    _write_journal(tmp_path / "b", {0: [("already here", "user")], 5: _messages(3)}).close()
+    # a chunk ends in the middle of a convo
+    assert main(["import", str(archive), "--data-dir", str(tmp_path / "b"), "--chunk-size", "3"]) == 0
+
+    replayed = ConvoJournal(get_journal_path(tmp_path / "b")).replay()
+    assert [convo_id for convo_id, _ in replayed] == [0, 5, 6, 7]
+    assert [_texts(tree) for _, tree in replayed] == [["already here"], [t for t, _ in _messages(3)],
+                                                      [t for t, _ in _messages(4)], [t for t, _ in _messages(2)]]
+    assert replayed[2][1][1].role == "assistant"
+
+
+def test_zst_archive_round_trip(tmp_path):
+    pytest.importorskip("zstandard")
+    trace = ThinkingTrace()
+    trace.append("reasoning " * 500)
+    branched = ConvoTree()
+    branched.append(ChatMessage(text="q", role="user"))
+    branched.append(ChatMessage(text="a", role="assistant", marker="text", thinking=trace))
+    branched.fork(1)
+    branched.append(ChatMessage(text="a again", role="assistant", marker="text"))
+    messages = [(7, msg) for msg in branched.iter_nodes()]
+    messages += [(9, ChatMessage(text=f"line {i} ✓", role="user")) for i in range(1000)]
+
+    path = tmp_path / "convos.jsonl.zst"
+    progress = []
+    assert write_archive(path, messages) == len(messages)
+    assert path.read_bytes()[:4] == b"\x28\xb5\x2f\xfd"
+    chunks = list(read_archive(path, chunk_size=256, progress=lambda *p: progress.append(p)))
+    assert [len(chunk) for chunk in chunks] == [256, 256, 256, 235]
+    assert progress[-1] == (1003, path.stat().st_size, path.stat().st_size)
+
+    read = [item for chunk in chunks for item in chunk]
+    assert [(key, msg.text, msg.node_id, msg.parent_id) for key, msg in read] == \
+           [(key, msg.text, msg.node_id, msg.parent_id) for key, msg in messages]
+    assert read[1][1].thinking.text() == trace.text()
+
+
+def test_a_truncated_last_line_is_skipped(tmp_path):
+    path = tmp_path / "convos.jsonl"
+    write_archive(path, [(0, ChatMessage(text=f"message {i}", role="user")) for i in range(10)])
+    data = path.read_bytes()
+    # a copy cut off in the middle of the last message
+    path.write_bytes(data[:-10])
+    read = [msg.text for chunk in read_archive(path, chunk_size=4) for _, msg in chunk]
+    assert read == [f"message {i}" for i in range(9)]
+
+    # a broken line with messages after it isn't a cut off copy
+    lines = data.split(b"\n")
+    lines[3] = lines[3][:-5]
+    path.write_bytes(b"\n".join(lines))
+    with pytest.raises(ValueError, match="after 2 messages"):
+        list(read_archive(path))
+
+    path.write_text(json.dumps({"c": 0, "m": {"text": "no header"}}) + "\n")
+    with pytest.raises(ValueError, match="not an Eric Chat archive"):
+        list(read_archive(path))
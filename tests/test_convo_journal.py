@@ -0,0 +1,88 @@
+from ericchat.util import ChatMessage, ConvoJournal
+
+
+def _journal(tmp_path) -> ConvoJournal:
+    # flushed by the tests only
+    journal = ConvoJournal(tmp_path / "journal.jsonl", flush_interval=3600, max_pending=10**9, fsync=False)
+    journal.start()
+    return journal
+
+
+def _stream_answer(journal: ConvoJournal, convo_id: int, tokens: int = 500, flush_every: int = 0) -> ChatMessage:
+    journal.record_message(convo_id, 0, ChatMessage(text="question", role="user"))
+    for i in range(tokens):
+        journal.record_partial(convo_id, thinking=" hmm")
+        journal.record_partial(convo_id, text=" word")
+        if flush_every and i % flush_every == 0:
+            journal.flush()
+    return ChatMessage(text=" word" * tokens, role="assistant", marker="text")
+
+
+def test_streamed_answer_is_counted_once(tmp_path):
+    journal = _journal(tmp_path)
+    journal.record_new(0)
+    answer = _stream_answer(journal, 0, flush_every=10)
+    journal.record_message(0, 1, answer)
+    journal.close()
+
+    stats = journal.stats()
+    assert stats["payload_bytes"] == len("question") + 500 * len(" hmm") + 500 * len(" word")
+    # written as partial records and again in the message
+    assert stats["write_amplification"] > 1.8
+
+
+def test_unwritten_partials_are_dropped_on_commit(tmp_path):
+    journal = _journal(tmp_path)
+    journal.record_new(0)
+    answer = _stream_answer(journal, 0)
+    journal.record_message(0, 1, answer)
+    journal.close()
+
+    assert journal.stats()["write_amplification"] < 1.5
+    [(_, tree)] = journal.replay()
+    assert [msg.text for msg in tree] == ["question", answer.text]
+
+
+def test_partial_after_regenerate_is_recovered_as_a_sibling(tmp_path):
+    journal = _journal(tmp_path)
+    journal.record_new(0)
+    journal.record_message(0, 0, ChatMessage(text="question", role="user", node_id=0, parent_id=-1))
+    journal.record_message(0, 1, ChatMessage(text="first answer", role="assistant", marker="text",
+                                             node_id=1, parent_id=0))
+    # regenerate forks under the question without a leaf record, then the app dies mid-answer
+    journal.record_partial(0, text="second", parent_id=0)
+    journal.close()
+
+    [(_, tree)] = journal.replay()
+    assert [msg.text for msg in tree][0] == "question"
+    assert tree[1].text.startswith("second")
+    assert tree.siblings(1) == (1, 2)
+
+
+def test_replay_after_a_torn_write(tmp_path):
+    journal = _journal(tmp_path)
+    journal.record_new(0)
+    journal.record_message(0, 0, ChatMessage(text="question", role="user", node_id=0, parent_id=-1))
+    journal.record_partial(0, text="half an ", parent_id=0)
+    journal.record_partial(0, text="answer", parent_id=0)
+    journal.flush()
+    journal.record_new(1)
+    journal.record_message(1, 0, ChatMessage(text="lost in the crash", role="user", node_id=0, parent_id=-1))
+    journal.close()
+    # the app died in the middle of the last write
+    data = journal.path.read_bytes()
+    journal.path.write_bytes(data[:data.rindex(b"\n", 0, len(data) - 1) + 20])
+
+    convos = dict(ConvoJournal(journal.path).replay())
+    tree = convos[0]
+    assert tree[0].text == "question"
+    assert tree[1].text.startswith("half an answer")
+    assert not convos[1].nodes
+
+    # records appended after the torn one are read back too
+    journal = _journal(tmp_path)
+    journal.record_new(2)
+    journal.record_message(2, 0, ChatMessage(text="after the restart", role="user", node_id=0, parent_id=-1))
+    journal.close()
+    assert [convo_id for convo_id, _ in journal.replay()] == [0, 1, 2]
+    assert journal.max_convo_id() == 2
@@ -0,0 +1,115 @@
+from ericchat.util import ChatMessage, ConvoJournal, ConvoTree
+
+
+def _msg(text: str, role: str = "user") -> ChatMessage:
+    return ChatMessage(text=text, role=role, marker="text" if role == "assistant" else "")
+
+
+def _texts(tree: ConvoTree):
+    return [msg.text for msg in tree]
+
+
+def _conversation() -> ConvoTree:
+    tree = ConvoTree()
+    for text, role in (("q1", "user"), ("a1", "assistant"), ("q2", "user"), ("a2", "assistant")):
+        tree.append(_msg(text, role))
+    return tree
+
+
+def test_regenerate_forks_a_sibling_answer():
+    tree = _conversation()
+    tree.fork(3)
+    assert _texts(tree) == ["q1", "a1", "q2"]
+    tree.append(_msg("a2 again", "assistant"))
+
+    assert _texts(tree) == ["q1", "a1", "q2", "a2 again"]
+    assert tree.siblings(3) == (1, 2)
+    # the shared prefix is stored once
+    assert len(tree.nodes) == 5
+
+
+def test_edit_keeps_the_old_branch_and_its_answers():
+    tree = _conversation()
+    tree.fork(2)
+    tree.append(_msg("q2 edited"))
+    tree.append(_msg("a2 edited", "assistant"))
+
+    assert tree.switch_sibling(2, -1)
+    assert _texts(tree) == ["q1", "a1", "q2", "a2"]
+    assert not tree.switch_sibling(2, -1)
+    assert tree.switch_sibling(2, +1)
+    assert _texts(tree) == ["q1", "a1", "q2 edited", "a2 edited"]
+    assert not tree.switch_sibling(2, +1)
+
+
+def test_switching_back_restores_the_last_visited_branch():
+    tree = _conversation()
+    # two answers under the edited prompt, the second one was looked at last
+    tree.fork(2)
+    tree.append(_msg("q2 edited"))
+    tree.append(_msg("first", "assistant"))
+    tree.fork(3)
+    tree.append(_msg("second", "assistant"))
+
+    tree.switch_sibling(2, -1)
+    tree.switch_sibling(2, +1)
+    assert _texts(tree) == ["q1", "a1", "q2 edited", "second"]
+
+    # a search hit on another branch switches to it
+    a2 = next(msg.node_id for msg in tree.iter_nodes() if msg.text == "a2")
+    assert tree.index_of(a2) == 3
+    assert _texts(tree) == ["q1", "a1", "q2", "a2"]
+    assert tree.index_of(12345) is None
+
+
+def test_messages_without_ids_form_one_branch():
+    tree = ConvoTree.from_messages([_msg("q1"), _msg("a1", "assistant"), _msg("q2")])
+    assert _texts(tree) == ["q1", "a1", "q2"]
+    assert [msg.parent_id for msg in tree] == [-1, 0, 1]
+
+
+def _journal(path) -> ConvoJournal:
+    journal = ConvoJournal(path, flush_interval=3600, max_pending=10**9, fsync=False)
+    journal.start()
+    return journal
+
+
+def _record(journal: ConvoJournal, convo_id: int, tree: ConvoTree, msg: ChatMessage):
+    # what EricUIState does for every committed message
+    tree.append(msg)
+    journal.record_message(convo_id, len(tree) - 1, msg)
+
+
+def test_branched_tree_survives_the_journal(tmp_path):
+    journal = _journal(tmp_path / "journal.jsonl")
+    tree = ConvoTree()
+    journal.record_new(0)
+    for text, role in (("q1", "user"), ("a1", "assistant"), ("q2", "user"), ("a2", "assistant")):
+        _record(journal, 0, tree, _msg(text, role))
+    tree.fork(2)
+    _record(journal, 0, tree, _msg("q2 edited"))
+    _record(journal, 0, tree, _msg("a2 edited", "assistant"))
+    tree.fork(1)
+    _record(journal, 0, tree, _msg("a1 again", "assistant"))
+    # back to the edited prompt, the way switch_branch records it
+    tree.switch_sibling(1, -1)
+    journal.record_leaf(0, tree.leaf)
+    journal.record_new(1)
+    journal.record_message(1, 0, _msg("deleted"))
+    journal.record_delete(1)
+    journal.close()
+
+    [(convo_id, replayed)] = journal.replay()
+    assert convo_id == 0
+    assert _texts(replayed) == _texts(tree) == ["q1", "a1", "q2 edited", "a2 edited"]
+    assert {n: m.text for n, m in replayed.nodes.items()} == {n: m.text for n, m in tree.nodes.items()}
+    assert replayed.children == tree.children
+    assert replayed.siblings(2) == (1, 2)
+
+    # and again after compacting it to one record per node
+    journal.compact([(0, replayed)])
+    [(_, compacted)] = ConvoJournal(journal.path).replay()
+    assert _texts(compacted) == _texts(tree)
+    assert compacted.children == tree.children
+    compacted.switch_sibling(1, +1)
+    assert _texts(compacted) == ["q1", "a1 again"]
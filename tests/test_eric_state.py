@@ -0,0 +1,109 @@
+import pytest
+
+from ericchat.util import ChatMessage, ConvoJournal
+
+pytest.importorskip("erictransformer")
+
+from erictransformer import CHATStreamResult  # noqa: E402
+
+from ericchat.eric_state import EricUIState  # noqa: E402
+
+
+def _journal_with_convos(path, n: int) -> ConvoJournal:
+    journal = ConvoJournal(path, fsync=False)
+    journal.start()
+    for convo_id in range(n):
+        journal.record_new(convo_id)
+        journal.record_message(convo_id, 0, ChatMessage(text=f"restored question {convo_id}", role="user",
+                                                        node_id=0, parent_id=-1))
+    journal.close()
+    return ConvoJournal(path, fsync=False)
+
+
+def test_search_index_is_built_in_the_background(tmp_path):
+    state = EricUIState(tmp_path / "models", backend="fake")
+    state.attach_journal(_journal_with_convos(tmp_path / "journal.jsonl", 200))
+
+    # changes made while the index is built are kept
+    state.user_input("fresh question")
+    state.delete_convo(0)
+
+    assert state.search_ready.wait(10)
+    assert len(state.search("restored", limit=1000)) == 199
+    assert len(state.search("fresh")) == 1
+    state.journal.close()
+
+
+def _answer(state: EricUIState, text: str):
+    state.in_inference = True
+    state.stream_step(CHATStreamResult(text=text, marker="text", payload={}))
+    state.finish_chat()
+
+
+def test_edit_and_regenerate_send_only_the_active_branch(tmp_path):
+    state = EricUIState(tmp_path / "models", backend="fake")
+    state.attach_journal(_journal_with_convos(tmp_path / "journal.jsonl", 0))
+    state.user_input("q1")
+    _answer(state, "a1")
+    state.user_input("q2")
+    _answer(state, "a2")
+
+    messages = state.regenerate()
+    assert [m["content"] for m in messages] == ["q1", "a1", "q2"]
+    _answer(state, "a2 again")
+    messages = state.edit_message(2, "q2 edited")
+    assert [m["content"] for m in messages] == ["q1", "a1", "q2 edited"]
+    _answer(state, "a2 edited")
+
+    assert state.branch_point() == 2
+    assert state.switch_branch(2, -1)
+    assert [msg.text for msg in state.convo_history] == ["q1", "a1", "q2", "a2 again"]
+    assert state.switch_branch(3, -1)
+    assert [msg.text for msg in state.convo_history] == ["q1", "a1", "q2", "a2"]
+    state.journal.close()
+
+    # the switched to branch is the one that comes back
+    restored = EricUIState(tmp_path / "models", backend="fake")
+    restored.attach_journal(ConvoJournal(tmp_path / "journal.jsonl", fsync=False))
+    tree = restored.convo_histories[0]
+    assert [msg.text for msg in tree] == ["q1", "a1", "q2", "a2"]
+    assert len(tree.nodes) == 7
+    restored.journal.close()
+
+
+def test_deleting_another_convo_keeps_the_active_branch(tmp_path):
+    state = EricUIState(tmp_path / "models", backend="fake")
+    state.attach_journal(_journal_with_convos(tmp_path / "journal.jsonl", 2))
+    state.user_input("q")
+    _answer(state, "first")
+    state.regenerate()
+    _answer(state, "second")
+    state.switch_branch(1, -1)
+    current = state.convo_history
+
+    state.delete_convo(0)
+    assert state.convo_history is current
+    assert state.convo_histories[state.current_convo_index] is current
+    assert [msg.text for msg in state.convo_history] == ["q", "first"]
+    assert state.search_ready.wait(10)
+    assert state.search("second")[0][0] == state.current_convo_index
+    state.journal.close()
+
+
+def test_documents_only_go_with_the_current_prompt(tmp_path):
+    class _Retriever:
+        def augment(self, question):
+            return f"excerpts for {question}"
+
+    state = EricUIState(tmp_path / "models", backend="fake")
+    state.attach_journal(_journal_with_convos(tmp_path / "journal.jsonl", 0))
+    state.retriever = _Retriever()
+    assert [m["content"] for m in state.user_input("q1")] == ["excerpts for q1"]
+    _answer(state, "a1")
+    messages = state.user_input("q2")
+    assert [m["content"] for m in messages] == ["q1", "a1", "excerpts for q2"]
+    _answer(state, "a2")
+    # regenerating looks them up again, nothing of them is kept on the message
+    assert [m["content"] for m in state.regenerate()] == ["q1", "a1", "excerpts for q2"]
+    assert not any(msg.expanded_text for msg in state.convo_history)
+    state.journal.close()
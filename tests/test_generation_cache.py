@@ -0,0 +1,124 @@
+import os
+import types
+
+import pytest
+
+from ericchat.util import GenerationCache
+
+erictransformer = pytest.importorskip("erictransformer")
+from erictransformer import CHATCallArgs, CHATStreamResult  # noqa: E402
+
+from ericchat.eric_state import EricUIState  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _args(**kwargs) -> CHATCallArgs:
+    values = {"max_len": 256, "top_k": 0, "temp": 0, "top_p": 0}
+    values.update(kwargs)
+    return CHATCallArgs(**values)
+
+
+def _store(cache: GenerationCache, key: str, text: str):
+    recorder = cache.recorder(key, model="m")
+    recorder.record(CHATStreamResult(text=text, marker="text", payload={}))
+    cache.commit(key, recorder)
+
+
+def _replayed(cache: GenerationCache, key: str) -> str:
+    path = cache.lookup(key)
+    return None if path is None else "".join(piece.text for piece in cache.replay(path))
+
+
+def test_only_greedy_decoding_is_cached():
+    assert GenerationCache.is_deterministic(_args(temp=0, top_p=0.8))
+    # top_p 0 turns nucleus filtering off, the answer is still sampled
+    assert not GenerationCache.is_deterministic(_args(temp=0.7, top_p=0))
+
+    state = types.SimpleNamespace()
+    EricUIState.set_creativity(state, 1)
+    assert GenerationCache.is_deterministic(state)
+    EricUIState.set_creativity(state, 2)
+    assert not GenerationCache.is_deterministic(state)
+
+
+def test_key_covers_model_revision_draft_and_settings(tmp_path):
+    cache = GenerationCache(tmp_path)
+    key = cache.key("mlx:20B@aaa", MESSAGES, _args())
+    others = [
+        cache.key("cpu:20B@aaa", MESSAGES, _args()),
+        cache.key("mlx:120B@aaa", MESSAGES, _args()),
+        # an updated model has a new revision
+        cache.key("mlx:20B@bbb", MESSAGES, _args()),
+        cache.key("mlx:20B@aaa+Draft", MESSAGES, _args()),
+        cache.key("mlx:20B@aaa", MESSAGES + [{"role": "assistant", "content": "hello"}], _args()),
+        cache.key("mlx:20B@aaa", MESSAGES, _args(max_len=512)),
+    ]
+    assert len({key, *others}) == len(others) + 1
+    assert cache.key("mlx:20B@aaa", list(MESSAGES), _args()) == key
+
+    # a quantized KV cache answers differently, an unset one keeps the key
+    with_kv = _args()
+    with_kv.kv_bits = 4
+    assert cache.key("mlx:20B@aaa", MESSAGES, with_kv) != key
+    with_kv.kv_bits = None
+    assert cache.key("mlx:20B@aaa", MESSAGES, with_kv) == key
+
+
+def test_new_revision_misses(tmp_path):
+    cache = GenerationCache(tmp_path)
+    _store(cache, cache.key("mlx:20B@aaa", MESSAGES, _args()), "old answer")
+    assert _replayed(cache, cache.key("mlx:20B@aaa", MESSAGES, _args())) == "old answer"
+    assert _replayed(cache, cache.key("mlx:20B@bbb", MESSAGES, _args())) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = GenerationCache(tmp_path)
+    for key in ("a", "b", "c"):
+        _store(cache, key, key * 100)
+    entry_bytes = cache.total_bytes // 3
+
+    # a hit makes "a" the most recent, so "b" goes first
+    assert _replayed(cache, "a") == "a" * 100
+    cache.max_bytes = 3 * entry_bytes
+    _store(cache, "d", "d" * 100)
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert _replayed(cache, "b") is None
+    assert not cache._path("b").exists()
+    assert cache.stats()["evictions"] == 1
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_recency_survives_a_restart(tmp_path):
+    cache = GenerationCache(tmp_path)
+    for i, key in enumerate(("a", "b", "c")):
+        _store(cache, key, key)
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    os.utime(cache._path("a"), (2000, 2000))
+    # a crash while recording leaves a part file behind
+    cache.recorder("d").close()
+
+    reopened = GenerationCache(tmp_path)
+    assert list(reopened.entries) == ["b", "c", "a"]
+    assert reopened.total_bytes == cache.total_bytes
+    assert not list(tmp_path.glob("*/.*.part"))
+
+
+def test_discarded_and_cleared_answers_are_gone(tmp_path):
+    cache = GenerationCache(tmp_path)
+    recorder = cache.recorder("a")
+    recorder.record(CHATStreamResult(text="cut off", marker="text", payload={}))
+    cache.discard(recorder)
+    assert _replayed(cache, "a") is None
+    assert not recorder.path.exists()
+
+    _store(cache, "b", "answer")
+    # replayed pieces are marked so the message shows as cached
+    [piece] = cache.replay(cache.lookup("b"))
+    assert piece.payload["telemetry"]["cache_hit"] == 1.0
+    cache.clear()
+    assert _replayed(cache, "b") is None
+    assert cache.total_bytes == 0
+    assert not GenerationCache(tmp_path).entries
@@ -0,0 +1,58 @@
+import json
+
+from ericchat.util import KVShape, kv_cache_bytes, read_kv_shape
+
+GB = 1024 ** 3
+
+# the numbers of published configs
+LLAMA_3_8B = {"num_hidden_layers": 32, "num_attention_heads": 32, "num_key_value_heads": 8, "hidden_size": 4096,
+              "torch_dtype": "bfloat16"}
+GPT_OSS_20B = {"num_hidden_layers": 24, "num_attention_heads": 64, "num_key_value_heads": 8, "head_dim": 64,
+               "hidden_size": 2880, "sliding_window": 128,
+               "layer_types": ["sliding_attention", "full_attention"] * 12}
+
+
+def _model(tmp_path, name: str, config: dict):
+    path = tmp_path / name
+    path.mkdir()
+    (path / "config.json").write_text(json.dumps(config))
+    return path
+
+
+def test_shape_from_config(tmp_path):
+    assert read_kv_shape(_model(tmp_path, "llama", LLAMA_3_8B)) == KVShape(layers=32, kv_heads=8, head_dim=128)
+    assert read_kv_shape(_model(tmp_path, "gpt-oss", GPT_OSS_20B)) == KVShape(
+        layers=24, kv_heads=8, head_dim=64, sliding_layers=12, sliding_window=128)
+
+    # a multimodal model's language model, in float32, without grouped query attention
+    vlm = {"text_config": {"num_hidden_layers": 2, "num_attention_heads": 4, "hidden_size": 256, "torch_dtype": "float32"}}
+    assert read_kv_shape(_model(tmp_path, "vlm", vlm)) == KVShape(layers=2, kv_heads=4, head_dim=64, dtype_bytes=4)
+    assert read_kv_shape(_model(tmp_path, "broken", {"hidden_size": 256})) is None
+    assert read_kv_shape(tmp_path / "missing") is None
+
+
+def test_full_cache_size():
+    shape = KVShape(layers=32, kv_heads=8, head_dim=128)
+    # keys and values of 32 layers, 8 heads of 128 halves: 128 KB a token
+    assert kv_cache_bytes(shape, 1) == 128 * 1024
+    assert kv_cache_bytes(shape, 8192) == 1 * GB
+    assert kv_cache_bytes(shape, 0) == 0
+
+
+def test_quantized_and_bounded_caches():
+    shape = KVShape(layers=32, kv_heads=8, head_dim=128)
+    # a byte (or half) per element plus a half scale and bias per 64
+    assert kv_cache_bytes(shape, 8192, kv_bits=8) == int(GB * (1 + 4 / 64) / 2)
+    assert kv_cache_bytes(shape, 8192, kv_bits=4) == int(GB * (0.5 + 4 / 64) / 2)
+    # the last 4096 tokens and the prefill chunk being attended to
+    assert kv_cache_bytes(shape, 100_000, max_kv_size=4096) == (4096 + 512) * 128 * 1024
+    assert kv_cache_bytes(shape, 1000, max_kv_size=4096) == kv_cache_bytes(shape, 1000)
+
+
+def test_sliding_window_layers_stay_small():
+    shape = KVShape(layers=24, kv_heads=8, head_dim=64, sliding_layers=12, sliding_window=128)
+    per_layer_token = 2 * 8 * 64 * 2
+    assert kv_cache_bytes(shape, 10_000) == 12 * 10_000 * per_layer_token + 12 * (128 + 512) * per_layer_token
+    # only the full attention layers are quantized
+    assert kv_cache_bytes(shape, 10_000, kv_bits=8) == int(12 * 10_000 * 2 * 8 * 64 * (1 + 4 / 64)
+                                                           + 12 * (128 + 512) * per_layer_token)
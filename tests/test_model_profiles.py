@@ -0,0 +1,64 @@
+import json
+import subprocess
+import sys
+
+from ericchat.util import ModelDetails, PeakMemory, ProfileStore, StreamSpeed
+
+
+def _model(short_name: str, required_memory: int = 0) -> ModelDetails:
+    return ModelDetails(name=f"💾 {short_name}", short_name=short_name, type="hf", required_memory=required_memory,
+                        hf_id=f"org/{short_name}", save_path=None, is_downloaded=True, details_path=None, notice="")
+
+
+def _speed(decode_tps: float) -> StreamSpeed:
+    speed = StreamSpeed()
+    speed.tokens, speed.first, speed.last = 11, 0.0, 10 / decode_tps
+    return speed
+
+
+def test_a_new_revision_starts_over(tmp_path):
+    store = ProfileStore(tmp_path / "model_profiles.json")
+    store.record_load("mlx", "20B", "aaa", 5.0, 14.0)
+    store.record_generation("mlx", "20B", "aaa", _speed(60.0), 15.0)
+    assert store.get("mlx", "20B", "aaa").peak_rss_gb == 15.0
+
+    # the model was updated: its old numbers don't count for the new weights
+    reopened = ProfileStore(tmp_path / "model_profiles.json")
+    assert reopened.required_gb(_model("20B", 16), "mlx", "bbb") == 16
+    assert reopened.get("mlx", "20B", "aaa") is None
+    assert reopened.recommend([_model("20B")], "mlx", 64.0, {"20B": "bbb"}) is None
+    reopened.record_load("mlx", "20B", "bbb", 4.0, 12.0)
+    profile = json.loads((tmp_path / "model_profiles.json").read_text())["mlx:20B"]
+    assert (profile["revision"], profile["peak_rss_gb"], profile["generations"]) == ("bbb", 12.0, 0)
+
+
+def test_picker_uses_the_measured_peak(tmp_path):
+    store = ProfileStore(tmp_path / "model_profiles.json")
+    store.record_load("mlx", "20B", "aaa", 5.0, 14.0)
+    store.record_generation("mlx", "20B", "aaa", _speed(60.0), 15.0)
+    store.record_load("mlx", "120B", "ccc", 30.0, 70.0)
+    store.record_generation("mlx", "120B", "ccc", _speed(40.0), 72.0)
+    revisions = {"20B": "aaa", "120B": "ccc", "3B": "ddd"}
+
+    assert store.required_gb(_model("20B"), "mlx", "aaa") == 15.0
+    # not measured yet
+    assert store.required_gb(_model("3B"), "mlx", "ddd") == 0
+    models = [_model("3B"), _model("20B"), _model("120B")]
+    assert store.recommend(models, "mlx", 96.0, revisions).short_name == "20B"
+    assert store.recommend(models[2:], "mlx", 96.0, revisions).short_name == "120B"
+    assert store.recommend(models[2:], "mlx", 64.0, revisions) is None
+
+
+def test_peak_memory_counts_what_was_added():
+    with PeakMemory(interval=0.01) as memory:
+        block = b"x" * (64 * 1024 * 1024)
+    assert memory.growth >= 60 * 1024 * 1024
+    assert memory.growth < memory.peak
+    del block
+
+    # a model worker is measured on its own, without the app's memory
+    child = subprocess.Popen([sys.executable, "-c", "import sys; sys.stdin.read()"], stdin=subprocess.PIPE)
+    try:
+        assert 0 < PeakMemory(pid=child.pid).sample() < PeakMemory().sample()
+    finally:
+        child.communicate(b"")
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import types
+from pathlib import Path
+
+import pytest
+from fsspec import AbstractFileSystem
+
+from ericchat.util import (DirectorySource, HFCacheSource, HubSource,
+                           ManifestCache, ModelSource, ModelStore, SourceFile,
+                           install_model, installed_revision, verify_install)
+from ericchat.util.model_source import DETAILS_FILE, FETCH_CHUNK
+
+REPO = "org/model"
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _model_files(tag: str = "") -> dict:
+    return {"config.json": json.dumps({"model_type": "fake", "tag": tag}).encode(),
+            "model.safetensors": f"weights {tag}".encode() * 5000,
+            "tokenizer.json": b"{}"}
+
+
+def _write_folder(folder: Path, files: dict) -> Path:
+    folder.mkdir(parents=True)
+    for name, data in files.items():
+        (folder / name).write_bytes(data)
+    return folder
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    # any attempt to reach the network fails the test
+    def _connect(*args, **kwargs):
+        raise AssertionError("tried to connect while offline")
+
+    monkeypatch.setattr(socket.socket, "connect", _connect)
+    monkeypatch.setattr(socket, "create_connection", _connect)
+
+
+def test_offline_install_from_a_folder(tmp_path, offline):
+    files = _model_files()
+    _write_folder(tmp_path / "models" / "org--model", files)
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    source = DirectorySource(tmp_path / "models")
+
+    info = install_model(source, REPO, save_path, store)
+    assert info["fetched"] == len(files)
+    assert {name: (save_path / name).read_bytes() for name in files} == files
+    assert installed_revision(save_path) == info["revision"]
+    assert json.loads((save_path / DETAILS_FILE).read_text())["source"] == str(tmp_path / "models")
+    assert not verify_install(save_path, source.list_files(REPO))
+
+    # installing again places the same blobs, named by their content
+    blobs = sorted(store.blobs.rglob("*"))
+    assert install_model(source, REPO, save_path, store)["revision"] == info["revision"]
+    assert sorted(store.blobs.rglob("*")) == blobs
+
+
+def test_offline_install_from_the_hf_cache(tmp_path, offline):
+    # models--org--model/{blobs/<sha256>, refs/main, snapshots/<commit>/<name> -> blob}
+    files = _model_files()
+    repo_dir = tmp_path / "hub" / "models--org--model"
+    commit = "a" * 40
+    (repo_dir / "blobs").mkdir(parents=True)
+    (repo_dir / "refs").mkdir()
+    (repo_dir / "refs" / "main").write_text(commit)
+    snapshot = repo_dir / "snapshots" / commit
+    snapshot.mkdir(parents=True)
+    for name, data in files.items():
+        blob = repo_dir / "blobs" / _sha256(data)
+        blob.write_bytes(data)
+        (snapshot / name).symlink_to(os.path.relpath(blob, snapshot))
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    source = HFCacheSource(tmp_path / "hub")
+
+    install_model(source, REPO, save_path, store, check_hashes=True)
+    assert installed_revision(save_path) == commit
+    assert {name: (save_path / name).read_bytes() for name in files} == files
+    assert not verify_install(save_path, source.list_files(REPO), check_hashes=True)
+
+
+def test_a_cancelled_install_publishes_nothing(tmp_path, offline):
+    files = _model_files()
+    _write_folder(tmp_path / "models" / "model", files)
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    source = DirectorySource(tmp_path / "models")
+
+    def on_progress(done, total):
+        if done:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        install_model(source, REPO, save_path, store, on_progress=on_progress)
+    assert not (save_path / DETAILS_FILE).exists()
+    assert installed_revision(save_path) is None
+
+    install_model(source, REPO, save_path, store)
+    assert not verify_install(save_path, source.list_files(REPO))
+
+
+class _LocalSource(ModelSource):
+    # a resumable source reading a local folder, counting the bytes it sends
+    name = "local"
+    resumable = True
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.sent = 0
+
+    def list_files(self, repo_id):
+        return [SourceFile(p.name, p.stat().st_size) for p in sorted(self.folder.iterdir())]
+
+    def open(self, repo_id, file, offset):
+        source = self
+
+        class _Counting(types.SimpleNamespace):
+            def read(self, n):
+                block = f.read(n)
+                source.sent += len(block)
+                return block
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                f.close()
+
+        f = open(self.folder / file.name, "rb")
+        f.seek(offset)
+        return _Counting(), offset
+
+
+def test_a_cancelled_download_resumes(tmp_path):
+    weights = os.urandom(3 * FETCH_CHUNK + 1000)
+    folder = _write_folder(tmp_path / "remote", {"model.safetensors": weights})
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    source = _LocalSource(folder)
+
+    def gate(n):
+        if source.sent >= 2 * FETCH_CHUNK:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        install_model(source, REPO, save_path, store, gate=gate)
+    assert source.sent == 2 * FETCH_CHUNK
+
+    source.sent = 0
+    install_model(source, REPO, save_path, store)
+    assert source.sent == len(weights) - 2 * FETCH_CHUNK
+    assert (save_path / "model.safetensors").read_bytes() == weights
+    # the partial file became the blob
+    assert not any(p.is_file() for p in store.root.rglob("*.part"))
+
+
+class _LocalHubFS(AbstractFileSystem):
+    # <root>/<repo>/<commit>/<files>, with the Hub's info: size and the sha256 of LFS files
+    cachable = False
+
+    def __init__(self, root: Path):
+        super().__init__()
+        self.root = root
+
+    def find(self, path, maxdepth=None, withdirs=False, detail=False, revision=None, **kwargs):
+        entries = {}
+        for file in sorted((self.root / path / revision).iterdir()):
+            entries[f"{path}/{file.name}"] = {"name": f"{path}/{file.name}", "size": file.stat().st_size,
+                                              "type": "file", "lfs": {"sha256": _sha256(file.read_bytes())}}
+        return entries if detail else sorted(entries)
+
+
+class _LocalHubAPI:
+    def __init__(self, root: Path):
+        self.root = root
+
+    def model_info(self, repo_id, revision=None):
+        return types.SimpleNamespace(sha=(self.root / repo_id / "refs" / revision).read_text())
+
+
+class _LocalHub(HubSource):
+    def open(self, repo_id, file, offset):
+        f = open(self.fs.root / repo_id / self.resolved_revision(repo_id) / file.name, "rb")
+        f.seek(offset)
+        return f, offset
+
+
+class _Hub:
+    # a repo on the stand-in Hub, every push moves main
+    def __init__(self, root: Path):
+        self.root = root
+        self.commits = []
+
+    def push(self, files: dict) -> str:
+        commit = hashlib.sha1(f"commit {len(self.commits)}".encode()).hexdigest()
+        _write_folder(self.root / REPO / commit, files)
+        (self.root / REPO / "refs").mkdir(exist_ok=True)
+        (self.root / REPO / "refs" / "main").write_text(commit)
+        self.commits.append(commit)
+        return commit
+
+    def source(self, store: ModelStore, refresh: bool = False, ttl: float = 3600.0) -> HubSource:
+        return _LocalHub(cache=ManifestCache(store.remote, ttl=ttl), refresh=refresh,
+                         fs=_LocalHubFS(self.root), api=_LocalHubAPI(self.root))
+
+
+def test_manifest_cache_is_reused(tmp_path):
+    hub = _Hub(tmp_path / "hub")
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    first = hub.push(_model_files("first"))
+
+    source = hub.source(store)
+    install_model(source, REPO, save_path, store)
+    # what main points at and the listing there
+    assert source.requests == 2
+    assert installed_revision(save_path) == first
+
+    # installing and verifying again ask nothing
+    source = hub.source(store)
+    info = install_model(source, REPO, save_path, store)
+    assert info["fetched"] == 0
+    assert not verify_install(save_path, source.list_files(REPO), check_hashes=True)
+    assert source.requests == 0
+
+
+def test_install_stays_pinned_until_refreshed(tmp_path):
+    hub = _Hub(tmp_path / "hub")
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    first = hub.push(_model_files("first"))
+    install_model(hub.source(store), REPO, save_path, store)
+
+    files = _model_files("first")
+    files["config.json"] = b'{"model_type": "fake", "tag": "second"}'
+    second = hub.push(files)
+    source = hub.source(store)
+    install_model(source, REPO, save_path, store)
+    assert source.requests == 0
+    assert installed_revision(save_path) == first
+
+    # only the changed file is fetched
+    source = hub.source(store, refresh=True)
+    info = install_model(source, REPO, save_path, store)
+    assert source.requests == 2
+    assert info["fetched"] == 1
+    assert installed_revision(save_path) == second
+    assert (save_path / "config.json").read_bytes() == files["config.json"]
+
+    # an expired listing is resolved again
+    third = hub.push(_model_files("third"))
+    source = hub.source(store, ttl=0)
+    install_model(source, REPO, save_path, store)
+    assert source.requests == 2
+    assert installed_revision(save_path) == third
+
+    # an old commit stays in the store until gc
+    shutil.rmtree(hub.root / REPO / first)
+    assert store.read_manifest(REPO, first) is not None
+
+
+def test_a_corrupted_partial_download_is_fetched_again(tmp_path):
+    hub = _Hub(tmp_path / "hub")
+    store = ModelStore(tmp_path / "store")
+    save_path = tmp_path / "model"
+    files = {"model.safetensors": os.urandom(3 * FETCH_CHUNK)}
+    hub.push(files)
+    fetched = []
+
+    def gate(n):
+        fetched.append(n)
+        if len(fetched) == 2:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        install_model(hub.source(store), REPO, save_path, store, gate=gate)
+    [partial] = store.tmp.glob("*.part")
+    with open(partial, "r+b") as f:
+        f.write(b"garbage")
+
+    # the resumed file doesn't match the Hub's sha256 and isn't kept
+    with pytest.raises(ValueError):
+        install_model(hub.source(store), REPO, save_path, store)
+    assert not list(store.tmp.glob("*.part"))
+    assert not any(p.is_file() for p in store.blobs.rglob("*"))
+    assert installed_revision(save_path) is None
+
+    install_model(hub.source(store), REPO, save_path, store)
+    assert (save_path / "model.safetensors").read_bytes() == files["model.safetensors"]
@@ -0,0 +1,40 @@
+import os
+import time
+
+import pytest
+
+from ericchat.util import ModelStore
+from ericchat.util.model_store import PARTIAL_MAX_AGE
+
+
+def test_gc_keeps_resumable_downloads(tmp_path):
+    store = ModelStore(tmp_path / "store")
+    partial = store.partial_path("org/model", "model.safetensors", "abc")
+    partial.write_bytes(b"half of it")
+    stale = store.partial_path("org/old", "model.safetensors", "def")
+    stale.write_bytes(b"long forgotten")
+    old = time.time() - PARTIAL_MAX_AGE - 60
+    os.utime(stale, (old, old))
+    leftover = store.tmp_path()
+    leftover.write_bytes(b"cancelled")
+
+    store.gc()
+    assert partial.exists()
+    assert not stale.exists()
+    assert not leftover.exists()
+
+
+def test_gc_refuses_while_installing(tmp_path):
+    store = ModelStore(tmp_path / "store")
+    # a blob an install has added but not listed in a manifest yet
+    blob = tmp_path / "blob"
+    blob.write_bytes(b"weights")
+    sha256 = store.add_blob(blob)
+
+    with store.install_lock():
+        with pytest.raises(RuntimeError):
+            store.gc()
+    assert store.has_blob(sha256)
+
+    store.gc()
+    assert not store.has_blob(sha256)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from ericchat.util import Prefetcher, weight_files
+from ericchat.util import prefetch as prefetch_module
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(prefetch_module, "PREFETCH_BLOCK", MB)
+    monkeypatch.setattr(prefetch_module, "PREFETCH_SEGMENT", 4 * MB)
+
+
+def _model(folder, shards: int = 2, shard_mb: int = 10):
+    folder.mkdir()
+    for i in range(shards):
+        with open(folder / f"model-{i}.safetensors", "wb") as f:
+            f.truncate(shard_mb * MB)
+    (folder / "config.json").write_text("{}")
+    return weight_files(folder)
+
+
+def test_reads_every_byte_once(tmp_path):
+    files = _model(tmp_path / "model")
+    assert [p.name for p in files] == ["model-0.safetensors", "model-1.safetensors"]
+    reported = []
+    prefetch = Prefetcher(files, workers=3, on_progress=lambda done, total: reported.append(done)).run()
+    assert prefetch.done == prefetch.total == 20 * MB
+    assert sorted(reported) == [n * MB for n in range(1, 21)]
+    assert prefetch.wait(0)
+
+
+def test_switching_models_cancels_the_old_prefetch(tmp_path):
+    # what picking one model, then another does: the first prefetch stops at its next block
+    first_files = _model(tmp_path / "first")
+    second_files = _model(tmp_path / "second")
+    started = threading.Event()
+
+    def slow(done, total):
+        started.set()
+        time.sleep(0.02)
+
+    first = Prefetcher(first_files, workers=2, on_progress=slow).start()
+    assert started.wait(2)
+    first.cancel()
+    second = Prefetcher(second_files, workers=2).start()
+
+    assert first.wait(2)
+    assert first.cancelled
+    # at most the block each thread was reading
+    assert first.done <= 4 * MB
+    assert second.wait(2)
+    assert second.done == second.total
+
+    # cancelled before it started, nothing is read
+    third = Prefetcher(first_files)
+    third.cancel()
+    assert third.run().done == 0
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+import time
+
+from ericchat.util import LoopLagMonitor, SamplingProfiler, Tracer
+
+
+def _events(path, ph: str):
+    return [e for e in json.loads(path.read_text())["traceEvents"] if e["ph"] == ph]
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span("render_html"):
+        pass
+    tracer.instant("loaded")
+    tracer.counter("cache", hits=1)
+    assert tracer.span("a") is tracer.span("b")
+    assert not tracer.events
+
+
+def test_spans_are_written_as_a_chrome_trace(tmp_path):
+    tracer = Tracer(enabled=True, max_events=4)
+    with tracer.span("stream_step", chars=12):
+        with tracer.span("render_html"):
+            time.sleep(0.01)
+    tracer.instant("loaded", model="20B")
+    worker = threading.Thread(target=tracer.counter, args=("cache",), kwargs={"hits": 3}, name="worker")
+    worker.start()
+    worker.join()
+
+    path = tmp_path / "ui.json"
+    tracer.dump(path)
+    inner, outer = _events(path, "X")
+    assert (outer["name"], inner["name"]) == ("stream_step", "render_html")
+    assert outer["args"] == {"chars": 12}
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert inner["dur"] >= 10_000
+    [counter] = _events(path, "C")
+    assert counter["args"] == {"hits": 3}
+    assert {e["args"]["name"] for e in _events(path, "M")} == {threading.current_thread().name, "worker"}
+
+    # only the last max_events are kept
+    for i in range(10):
+        tracer.instant(f"event {i}")
+    tracer.dump(path)
+    assert [e["name"] for e in _events(path, "i")] == [f"event {i}" for i in range(6, 10)]
+
+
+def test_loop_lag_counts_a_blocked_loop(tmp_path):
+    tracer = Tracer(enabled=True)
+
+    async def run():
+        monitor = LoopLagMonitor(asyncio.get_running_loop(), tracer, interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        # a slow handler on the UI loop
+        time.sleep(0.15)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(run())
+    stats = monitor.stats()
+    assert stats["samples"] >= 5
+    assert stats["lag_max_ms"] >= 100
+    assert stats["lag_p50_ms"] < 100
+
+    path = tmp_path / "ui.json"
+    tracer.dump(path)
+    lags = [e["args"]["ms"] for e in _events(path, "C") if e["name"] == "ui loop lag"]
+    assert len(lags) == stats["samples"]
+    assert max(lags) == stats["lag_max_ms"]
+    assert LoopLagMonitor(None, tracer).stats() == {"samples": 0}
+
+
+def _busy_render(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler_records_the_ui_stack(tmp_path):
+    tracer = Tracer(enabled=True)
+    profiler = SamplingProfiler(tracer, interval=0.002)
+    profiler.start()
+    _busy_render(0.2)
+    profiler.stop()
+
+    path = tmp_path / "ui.json"
+    tracer.dump(path)
+    data = json.loads(path.read_text())
+    assert len(data["samples"]) >= 10
+    frames = data["stackFrames"]
+    leaves = [frames[sample["sf"]]["name"] for sample in data["samples"]]
+    assert sum(name.startswith("_busy_render (test_profiling.py") for name in leaves) >= len(leaves) // 2
+    # every frame points to its caller, up to the test that called _busy_render
+    callers = []
+    frame = frames[data["samples"][0]["sf"]]
+    while "parent" in frame:
+        frame = frames[frame["parent"]]
+        callers.append(frame["name"])
+    assert any(name.startswith("test_sampling_profiler_records_the_ui_stack") for name in callers)
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from ericchat.util import RepetitionWatchdog
+
+_VOCAB = [f"w{i}" for i in range(5000)] + [" the", " a", ",", ".", "\n", "|", " of"]
+
+
+def _feed(watchdog: RepetitionWatchdog, pieces, segment: int):
+    for i in range(0, len(pieces), segment):
+        loop = watchdog.feed_segment(pieces[i:i + segment], "thinking")
+        if loop is not None:
+            return i + segment, loop
+    return None, None
+
+
+@pytest.mark.parametrize("period", [2, 5, 60, 300])
+def test_catches_a_loop(period):
+    rnd = random.Random(period)
+    paragraph = [rnd.choice(_VOCAB) for _ in range(period)]
+    pieces = [rnd.choice(_VOCAB) for _ in range(500)] + paragraph * (400 // period + 10)
+    caught_at, loop = _feed(RepetitionWatchdog(), pieces, 16)
+    assert loop is not None and loop.period == period
+    # the paragraph, then two more periods of it or min_tokens, and the rest of the segment
+    assert caught_at - 500 <= period + max(2 * period, 64) + 8 + 16
+
+
+def test_no_loop_in_ordinary_text():
+    rnd = random.Random(0)
+    pieces = [rnd.choice(_VOCAB) for _ in range(100_000)]
+    assert _feed(RepetitionWatchdog(), pieces, 16) == (None, None)
+
+
+def test_segments_and_single_pieces_agree():
+    rnd = random.Random(1)
+    pieces = [rnd.choice(_VOCAB) for _ in range(300)] + [rnd.choice(_VOCAB) for _ in range(40)] * 10
+    caught_at, loop = _feed(RepetitionWatchdog(), pieces, 1)
+    _, segmented = _feed(RepetitionWatchdog(), pieces, 16)
+    assert loop is not None and segmented is not None
+    assert (loop.period, loop.repeated_tokens) == (segmented.period, segmented.repeated_tokens)
+
+
+def test_rolling_hash_is_the_hash_of_the_last_ngram():
+    # equal n-grams hash the same wherever they are, whatever came before them
+    rnd = random.Random(2)
+    pieces = [rnd.choice(_VOCAB) for _ in range(1000)]
+    watchdog = RepetitionWatchdog(ngram=8)
+    hashes = []
+    for text in pieces:
+        watchdog.feed(text, "thinking")
+        hashes.append(watchdog._hash)
+    for end in (8, 100, 999):
+        fresh = RepetitionWatchdog(ngram=8)
+        fresh.feed_segment(pieces[end - 7:end + 1], "thinking")
+        assert fresh._hash == hashes[end]
+    assert len(set(hashes[7:])) == len({tuple(pieces[i - 7:i + 1]) for i in range(7, len(pieces))})
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from ericchat.util import StreamRecorder
+
+pytest.importorskip("erictransformer")
+
+from erictransformer import CHATCallArgs, CHATStreamResult  # noqa: E402
+
+from ericchat.backends import ReplayChatBackend  # noqa: E402
+from ericchat.replay import replay_trace  # noqa: E402
+
+# a short answer with its thinking, 20 ms apart
+PIECES = ([("", "think_start")] + [(f"step {i} ", "thinking") for i in range(5)] + [("", "think_end")]
+          + [(f"word{i} ", "text") for i in range(8)])
+DT = 0.02
+
+
+def _write_trace(path):
+    lines = [{"ericchat_trace": 1, "model": "recorded"}]
+    lines += [[DT, marker, text] for text, marker in PIECES]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    return path
+
+
+def test_replay_a_recorded_trace(tmp_path):
+    path = _write_trace(tmp_path / "trace.jsonl")
+    fast = replay_trace(path, speed=0)
+    assert fast["pieces"] == len(PIECES)
+    assert fast["renders"] >= 1
+    assert fast["seconds"] < len(PIECES) * DT
+
+    # the recorded timing, twice as fast
+    timed = replay_trace(path, speed=2, render=False)
+    assert timed["pieces"] == len(PIECES)
+    assert timed["renders"] == 0
+    assert timed["seconds"] >= 0.9 * len(PIECES) * DT / 2
+
+
+def test_replay_backend_plays_the_folder_in_order(tmp_path):
+    pytest.importorskip("zstandard")
+    _write_trace(tmp_path / "a.jsonl")
+    # recorded the way the app does, compressed, with telemetry
+    with StreamRecorder(tmp_path / "b.jsonl.zst", model="recorded") as recorder:
+        recorder.record(CHATStreamResult(text="other", marker="text", payload={"telemetry": {"draft_acceptance": 0.5}}))
+
+    backend = ReplayChatBackend(str(tmp_path), speed=0)
+    played = [[(p.text, p.marker) for p in backend.stream([], CHATCallArgs())] for _ in range(3)]
+    assert played[0] == PIECES
+    assert played[1] == [("other", "text")]
+    assert played[2] == PIECES
+    [piece] = backend.stream([], CHATCallArgs())
+    assert piece.payload["telemetry"] == {"draft_acceptance": 0.5}
+
+    (tmp_path / "empty").mkdir()
+    with pytest.raises(ValueError, match="No traces"):
+        ReplayChatBackend(str(tmp_path / "empty"))
@@ -0,0 +1,97 @@
+import numpy as np
+
+from ericchat.util import HashingEmbedder, Retriever, VectorIndex, ingest
+from ericchat.util.retrieval import chunk_lines
+
+
+class _TopicEmbedder:
+    # one dimension per topic word, counting its mentions, and records the batches it was given
+    name = "topics"
+    topics = ("apples", "boats", "clouds", "dogs")
+    dim = len(topics)
+
+    def __init__(self):
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(len(texts))
+        out = np.array([[text.count(topic) for topic in self.topics] for text in texts], dtype=np.float32)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return out / norms
+
+
+def _index(tmp_path, embedder) -> VectorIndex:
+    return VectorIndex(tmp_path / "index", embedder.dim, embedder=embedder.name)
+
+
+def test_ingest_streams_in_batches(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(5):
+        (docs / f"notes{i}.md").write_text("".join(f"line {n} about apples\n" for n in range(200)))
+    (docs / "image.txt").write_bytes(b"\0binary")
+    (docs / ".hidden.md").write_text("apples")
+    embedder = _TopicEmbedder()
+    index = _index(tmp_path, embedder)
+
+    stats = ingest(index, embedder, [docs], batch_size=8, chunk_chars=300, overlap_chars=50)
+    assert stats["files"] == 5
+    assert stats["chunks"] == len(index) == sum(embedder.batches)
+    # never more than a batch of chunks in memory
+    assert max(embedder.batches) <= 8
+
+    # unchanged files are skipped, a changed one replaces its chunks
+    embedder.batches.clear()
+    (docs / "notes0.md").write_text("boats\n")
+    stats = ingest(index, embedder, [docs], batch_size=8)
+    assert (stats["files"], stats["skipped"], stats["chunks"]) == (1, 4, 1)
+    hits = Retriever(index, embedder, k=3).search(["boats"])[0]
+    assert [hit.text for hit in hits] == ["boats\n"]
+
+
+def test_top_k_is_best_first(tmp_path):
+    embedder = _TopicEmbedder()
+    index = _index(tmp_path, embedder)
+    texts = ["dogs", "apples boats", "apples", "clouds", "apples apples boats", "boats"]
+    index.add(embedder.embed(texts), [{"path": f"/docs/{i}.txt", "line": 1, "text": t} for i, t in enumerate(texts)])
+
+    query = embedder.embed(["apples"])
+    scores, ids = index.search(query, k=3)
+    assert [texts[i] for i in ids[0]] == ["apples", "apples apples boats", "apples boats"]
+    assert list(scores[0]) == sorted(scores[0], reverse=True)
+    # reading the matrix in blocks picks the same rows
+    block_scores, block_ids = index.search(query, k=3, block_rows=2)
+    assert (block_ids == ids).all()
+    assert np.allclose(block_scores, scores)
+
+    # below min_score isn't returned, so nothing is put in front of an unrelated question
+    retriever = Retriever(index, embedder, k=3, min_score=0.1)
+    assert [hit.text for hit in retriever.search(["dogs"])[0]] == ["dogs"]
+    prompt = retriever.augment("apples?")
+    assert prompt.startswith("Excerpts from my files") and prompt.endswith("apples?")
+    assert "0.txt" not in prompt
+    assert retriever.augment("nothing close") == ""
+
+
+def test_rows_after_the_last_save_are_dropped(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+    index = _index(tmp_path, embedder)
+    index.add(embedder.embed(["saved"]), [{"path": "a", "line": 1, "text": "saved"}])
+    index.save()
+    # a crash while ingesting, before the next save
+    index.add(embedder.embed(["lost"]), [{"path": "b", "line": 1, "text": "lost"}])
+
+    reopened = _index(tmp_path, embedder)
+    assert len(reopened) == 1
+    assert reopened.chunk(0)["text"] == "saved"
+    # another embedder's vectors can't be searched
+    assert len(VectorIndex(tmp_path / "index", 32, embedder="other")) == 0
+
+
+def test_chunks_overlap_at_line_ends():
+    lines = [f"{n:03d}\n" for n in range(10)]
+    chunks = list(chunk_lines(lines, chunk_chars=12, overlap_chars=4))
+    assert chunks[0] == (1, "000\n001\n002\n")
+    assert chunks[1] == (3, "002\n003\n004\n")
+    assert "".join(text for _, text in chunks).count("009") == 1
@@ -0,0 +1,25 @@
+from ericchat.util import ConvoSearchIndex
+
+
+def test_short_prefix_keeps_the_most_common_words():
+    index = ConvoSearchIndex(max_prefix_expansion=4)
+    # "sa0".."sa9" sort first but are in one message each, "sz" is in every other conversation
+    for convo_id in range(10):
+        index.add(convo_id, 0, f"sa{convo_id}")
+    for convo_id in range(10, 40):
+        index.add(convo_id, 0, "sz" if convo_id % 2 else "other")
+
+    hits = index.search("s", limit=100)
+    assert {hit.convo_id for hit in hits} >= set(range(11, 40, 2))
+    assert index.truncated_prefixes == ["s"]
+
+    index.search("sz")
+    assert index.truncated_prefixes == []
+
+
+def test_exact_word_is_always_searched():
+    index = ConvoSearchIndex(max_prefix_expansion=2)
+    index.add(0, 0, "s")
+    for convo_id in range(1, 20):
+        index.add(convo_id, 0, "sa sb sc")
+    assert 0 in {hit.convo_id for hit in index.search("s", limit=100)}
@@ -0,0 +1,57 @@
+import json
+
+from ericchat.util import trimmable_kv_cache
+from ericchat.util.speculative import (DraftController, FakeDraftModel, FakeTargetModel, SimClock,
+                                       speculative_generate)
+
+
+def _generate(window: int = 0, agreement: float = 0.7, max_tokens: int = 300):
+    clock = SimClock()
+    target = FakeTargetModel(clock, window=window)
+    draft = FakeDraftModel(target, clock, agreement=agreement)
+    prompt = list(range(20))
+    return list(speculative_generate(target, draft, prompt, max_tokens, DraftController(), clock=clock))
+
+
+def test_output_is_the_targets():
+    out = _generate()
+    assert [token for token, _ in out] == list(range(300))
+    assert any(from_draft for _, from_draft in out)
+
+
+def test_untrimmable_cache_stops_drafting():
+    # the window fills at 128 positions, after that rejected drafts couldn't be dropped again
+    out = _generate(window=128)
+    assert [token for token, _ in out] == list(range(300))
+    assert any(from_draft for _, from_draft in out[:128])
+    assert not any(from_draft for _, from_draft in out[128:])
+
+
+def test_trim_past_the_window_raises():
+    target = FakeTargetModel(SimClock(), window=8)
+    target.step(list(range(10)))
+    assert not target.can_trim(1)
+    try:
+        target.trim(2)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("trim should fail once the window is full")
+
+
+def test_sliding_window_models_cant_draft(tmp_path):
+    # gpt-oss alternates 128 token sliding window layers with full attention ones
+    gpt_oss = tmp_path / "gpt-oss"
+    gpt_oss.mkdir()
+    (gpt_oss / "config.json").write_text(json.dumps({
+        "num_hidden_layers": 4, "num_attention_heads": 64, "num_key_value_heads": 8, "head_dim": 64,
+        "sliding_window": 128, "layer_types": ["sliding_attention", "full_attention"] * 2}))
+    smol = tmp_path / "smol"
+    smol.mkdir()
+    (smol / "config.json").write_text(json.dumps({
+        "num_hidden_layers": 36, "num_attention_heads": 16, "num_key_value_heads": 4, "hidden_size": 2048}))
+
+    assert not trimmable_kv_cache(gpt_oss)
+    assert trimmable_kv_cache(smol)
+    # not downloaded yet
+    assert not trimmable_kv_cache(tmp_path / "missing")
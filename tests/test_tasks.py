@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+
+from ericchat.util import TaskManager
+from ericchat.util.tasks import (CANCELLED, DONE, DOWNLOAD, FAILED, FINISHED,
+                                 GENERATE, LOAD, VERIFY, TaskCancelled)
+
+
+class _Model:
+    # stands in for a backend: a stream that stops at its next token once cancelled
+    def __init__(self):
+        self.stop = threading.Event()
+
+    def cancel(self):
+        self.stop.set()
+
+    def stream(self, tokens: int = 2000, seconds_per_token: float = 0.0025):
+        for _ in range(tokens):
+            if self.stop.is_set():
+                return
+            time.sleep(seconds_per_token)
+            yield "word"
+
+
+def test_load_supersedes_a_running_stream():
+    # the Model button pressed at a random point of an answer, again and again
+    rnd = random.Random(0)
+    events = []
+    manager = TaskManager(on_event=events.append)
+    holder = {"model": _Model()}
+    spans = {GENERATE: [], LOAD: []}
+    lock = threading.Lock()
+    swapped = 0
+
+    def generate(task):
+        nonlocal swapped
+        model = holder["model"]
+        task.token.on_cancel(model.cancel)
+        start = time.perf_counter()
+        try:
+            for _ in model.stream():
+                task.token.raise_if_cancelled()
+        finally:
+            with lock:
+                spans[GENERATE].append((start, time.perf_counter()))
+                swapped += holder["model"] is not model
+
+    def load(task):
+        start = time.perf_counter()
+        time.sleep(0.02)
+        holder["model"] = _Model()
+        with lock:
+            spans[LOAD].append((start, time.perf_counter()))
+
+    streams, loads = [], []
+    for _ in range(20):
+        streams.append(manager.submit(GENERATE, generate))
+        time.sleep(rnd.uniform(0, 0.05))
+        loads.append(manager.submit(LOAD, load))
+        assert streams[-1].wait(2)
+        assert loads[-1].wait(2)
+    manager.shutdown(wait=True)
+
+    overlaps = [(g, l) for g in spans[GENERATE] for l in spans[LOAD] if g[0] < l[1] and l[0] < g[1]]
+    assert not overlaps
+    assert not swapped
+    assert all(task.state == CANCELLED for task in streams)
+    assert all(task.state == DONE for task in loads)
+    # every task was reported finished exactly once
+    finished = [e.task_id for e in events if e.state in FINISHED]
+    assert sorted(finished) == sorted(t.id for t in streams + loads)
+
+
+def test_a_second_load_cancels_the_pending_one():
+    manager = TaskManager()
+    release = threading.Event()
+    loaded = []
+
+    def load(task, name):
+        release.wait(2)
+        loaded.append(name)
+
+    first = manager.submit(LOAD, load, "first")
+    second = manager.submit(LOAD, load, "second")
+    third = manager.submit(LOAD, load, "third")
+    release.set()
+    assert third.wait(2)
+    manager.shutdown(wait=True)
+
+    # the running one finishes its work but counts as cancelled, the pending one never starts
+    assert first.state == CANCELLED
+    assert second.state == CANCELLED
+    assert third.state == DONE
+    assert loaded == ["first", "third"]
+
+
+def test_download_cancel_stops_at_the_next_chunk():
+    manager = TaskManager()
+
+    def download(task):
+        for i in range(1000):
+            task.token.raise_if_cancelled()
+            time.sleep(0.002)
+            task.report((i + 1) / 1000, "Downloading")
+
+    downloading = manager.submit(DOWNLOAD, download)
+    time.sleep(0.1)
+    start = time.perf_counter()
+    downloading.cancel()
+    assert downloading.wait(1)
+    assert time.perf_counter() - start < 0.5
+    assert downloading.state == CANCELLED
+    assert 0 < downloading.progress < 1
+    manager.shutdown(wait=True)
+
+
+def test_a_failed_task_keeps_its_error():
+    manager = TaskManager()
+
+    def download(task):
+        raise OSError("disk full")
+
+    task = manager.submit(DOWNLOAD, download)
+    assert task.wait(1)
+    assert task.state == FAILED
+    assert str(task.error) == "disk full"
+    assert task.event().error == "disk full"
+
+    def cancelled(task):
+        raise TaskCancelled()
+
+    task = manager.submit(DOWNLOAD, cancelled)
+    assert task.wait(1)
+    assert task.state == CANCELLED
+    manager.shutdown(wait=True)
+
+
+def test_verify_runs_during_a_download():
+    # loading a downloaded model while another one downloads
+    manager = TaskManager()
+    release = threading.Event()
+
+    def download(task):
+        while not release.wait(0.01):
+            task.token.raise_if_cancelled()
+
+    def verify(task):
+        return manager.submit(LOAD, lambda task: "loaded")
+
+    downloading = manager.submit(DOWNLOAD, download)
+    verifying = manager.submit(VERIFY, verify)
+    try:
+        assert verifying.wait(1)
+        assert verifying.result.wait(1)
+        assert verifying.result.result == "loaded"
+        assert not downloading.finished
+    finally:
+        release.set()
+    assert downloading.wait(1)
+    assert downloading.state == DONE
+    manager.shutdown(wait=True)
@@ -0,0 +1,66 @@
+import tempfile
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from ericchat.util import ChatMessage, ThinkingServer, ThinkingTrace
+
+pytest.importorskip("erictransformer")
+
+from ericchat.eric_state import EricUIState  # noqa: E402
+from ericchat.message_html import render_html  # noqa: E402
+
+
+def _state_with_thinking(answers: int = 3) -> EricUIState:
+    state = EricUIState(Path(tempfile.mkdtemp()), backend="fake")
+    for i in range(answers):
+        state.convo_history.append(ChatMessage(text="question", role="user"))
+        trace = ThinkingTrace()
+        trace.append(f"secret reasoning {i} " * 1000)
+        trace.compress()
+        state.convo_history.append(ChatMessage(text="answer", role="assistant", thinking=trace))
+    return state
+
+
+def test_render_carries_only_the_summary():
+    state = _state_with_thinking()
+    html = render_html(state, thinking_url="http://127.0.0.1:1/token/thinking")
+    assert "secret reasoning" not in html
+    assert html.count('<details class="thinking"') == 3
+    assert 'data-src="http://127.0.0.1:1/token/thinking/0/1"' in html
+
+    # another convo's node ids start over, its URLs don't
+    state.new_convo()
+    state.convo_history.append(ChatMessage(text="question", role="user"))
+    state.convo_history.append(ChatMessage(text="answer", role="assistant", thinking=ThinkingTrace()))
+    state.convo_history[1].thinking.append("other")
+    html = render_html(state, thinking_url="http://127.0.0.1:1/token/thinking")
+    assert 'data-src="http://127.0.0.1:1/token/thinking/1/1"' in html
+
+
+def test_server_serves_the_trace_when_opened():
+    state = _state_with_thinking()
+    first = state.convo_history
+    server = ThinkingServer(state.thinking_text).start()
+    try:
+        with urllib.request.urlopen(f"{server.url}/0/3") as response:
+            assert response.read().decode("utf-8") == first[3].thinking.text()
+            # only the transcript, loaded under the server's origin, reads it
+            assert response.headers["Access-Control-Allow-Origin"] is None
+        assert server.url.startswith(server.origin)
+
+        # a page rendered before switching convos still gets its traces
+        state.new_convo()
+        with urllib.request.urlopen(f"{server.url}/0/3") as response:
+            assert response.read().decode("utf-8") == first[3].thinking.text()
+
+        # a user message has no trace, the new convo has no node 3, and other paths need the token
+        for path in ("/0/2", "/1/3", "/3", "/9/3"):
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(server.url + path)
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(server.url.replace(server.token, "guess") + "/0/3")
+    finally:
+        server.close()